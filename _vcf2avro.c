@@ -0,0 +1,806 @@
+/*
+** Copyright (C) 2014, Jerome Kelleher
+**
+** This file is part of vcf2avro.
+**
+** Wormtable is free software: you can redistribute it and/or modify
+** it under the terms of the GNU Lesser General Public License as published by
+** the Free Software Foundation, either version 3 of the License, or
+** (at your option) any later version.
+**
+** Wormtable is distributed in the hope that it will be useful,
+** but WITHOUT ANY WARRANTY; without even the implied warranty of
+** MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+** GNU Lesser General Public License for more details.
+**
+** You should have received a copy of the GNU Lesser General Public License
+** along with vcf2avro.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+/*
+ * Extension module decoding the selected columns of the records in a
+ * decompressed Avro data block written by vcf2avro, used by the
+ * ColumnDecoder class in vcf2avro.py. Numeric scalar columns are written
+ * into a fixed width buffer with a null value for missing values, so
+ * that they can be wrapped as NumPy arrays without any per-row Python
+ * objects; other columns are returned as lists of Python values.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+#include <string.h>
+#include <math.h>
+
+/* Ways of decoding a column; these must match COLUMN_MODES in vcf2avro.py */
+#define MODE_SKIP 0
+#define MODE_FIXED 1
+#define MODE_OBJECT 2
+#define MODE_DICTIONARY 3
+
+/* The null value of int and long fixed width columns */
+#define INT_MISSING INT32_MIN
+
+enum {
+    T_NULL, T_BOOLEAN, T_INT, T_LONG, T_FLOAT, T_DOUBLE, T_BYTES, T_STRING,
+    T_ARRAY, T_UNION
+};
+
+typedef struct node {
+    int type;
+    Py_ssize_t num_children;
+    struct node **children;
+} node_t;
+
+typedef struct {
+    int mode;
+    /* The type of the non-null values of fixed width columns */
+    int value_type;
+    node_t *node;
+    PyObject *dictionary;
+} column_t;
+
+typedef struct {
+    PyObject_HEAD
+    Py_ssize_t num_columns;
+    Py_ssize_t num_selected;
+    column_t *columns;
+} BlockDecoder;
+
+typedef struct {
+    const uint8_t *pos;
+    const uint8_t *end;
+} buffer_t;
+
+static void
+free_node(node_t *node)
+{
+    Py_ssize_t j;
+
+    if (node != NULL) {
+        for (j = 0; j < node->num_children; j++) {
+            free_node(node->children[j]);
+        }
+        PyMem_Free(node->children);
+        PyMem_Free(node);
+    }
+}
+
+static node_t *
+new_node(int type, Py_ssize_t num_children)
+{
+    node_t *node = PyMem_Malloc(sizeof(node_t));
+
+    if (node == NULL) {
+        PyErr_NoMemory();
+        return NULL;
+    }
+    node->type = type;
+    node->num_children = num_children;
+    node->children = NULL;
+    if (num_children > 0) {
+        node->children = PyMem_Calloc(num_children, sizeof(node_t *));
+        if (node->children == NULL) {
+            PyMem_Free(node);
+            PyErr_NoMemory();
+            return NULL;
+        }
+    }
+    return node;
+}
+
+/*
+ * Returns a new node for the specified Avro type, given as the Python
+ * object parsed from the JSON schema.
+ */
+static node_t *
+parse_type(PyObject *avro_type)
+{
+    static const char *names[] = {"null", "boolean", "int", "long", "float",
+        "double", "bytes", "string"};
+    node_t *node = NULL;
+    PyObject *value;
+    const char *name;
+    Py_ssize_t j, n;
+
+    if (PyUnicode_Check(avro_type)) {
+        name = PyUnicode_AsUTF8(avro_type);
+        if (name == NULL) {
+            return NULL;
+        }
+        for (j = 0; j < (Py_ssize_t) (sizeof(names) / sizeof(*names)); j++) {
+            if (strcmp(name, names[j]) == 0) {
+                return new_node((int) j, 0);
+            }
+        }
+    } else if (PyList_Check(avro_type)) {
+        n = PyList_GET_SIZE(avro_type);
+        node = new_node(T_UNION, n);
+        if (node == NULL) {
+            return NULL;
+        }
+        for (j = 0; j < n; j++) {
+            node->children[j] = parse_type(PyList_GET_ITEM(avro_type, j));
+            if (node->children[j] == NULL) {
+                free_node(node);
+                return NULL;
+            }
+        }
+        return node;
+    } else if (PyDict_Check(avro_type)) {
+        value = PyDict_GetItemString(avro_type, "type");
+        if (value != NULL && PyUnicode_Check(value)
+                && PyUnicode_CompareWithASCIIString(value, "array") == 0) {
+            value = PyDict_GetItemString(avro_type, "items");
+            if (value == NULL) {
+                PyErr_SetString(PyExc_ValueError, "Array without items");
+                return NULL;
+            }
+            node = new_node(T_ARRAY, 1);
+            if (node == NULL) {
+                return NULL;
+            }
+            node->children[0] = parse_type(value);
+            if (node->children[0] == NULL) {
+                free_node(node);
+                return NULL;
+            }
+            return node;
+        } else if (value != NULL) {
+            return parse_type(value);
+        }
+    }
+    value = PyObject_Repr(avro_type);
+    if (value != NULL) {
+        PyErr_Format(PyExc_ValueError, "Unsupported Avro type: %U", value);
+        Py_DECREF(value);
+    }
+    return NULL;
+}
+
+static int
+truncated(void)
+{
+    PyErr_SetString(PyExc_ValueError, "Truncated Avro data block");
+    return -1;
+}
+
+static int
+read_long(buffer_t *buf, int64_t *value)
+{
+    uint64_t n = 0;
+    int shift = 0;
+    uint8_t b;
+
+    do {
+        if (buf->pos >= buf->end || shift > 63) {
+            return truncated();
+        }
+        b = *buf->pos++;
+        n |= ((uint64_t) (b & 0x7f)) << shift;
+        shift += 7;
+    } while (b & 0x80);
+    *value = (int64_t) (n >> 1) ^ -(int64_t) (n & 1);
+    return 0;
+}
+
+/*
+ * Reads the length of a bytes or string value and returns a pointer to
+ * its data in ptr.
+ */
+static int
+read_bytes(buffer_t *buf, const char **ptr, Py_ssize_t *size)
+{
+    int64_t n;
+
+    if (read_long(buf, &n) != 0) {
+        return -1;
+    }
+    if (n < 0 || n > buf->end - buf->pos) {
+        return truncated();
+    }
+    *ptr = (const char *) buf->pos;
+    *size = (Py_ssize_t) n;
+    buf->pos += n;
+    return 0;
+}
+
+static int
+read_float(buffer_t *buf, double *value)
+{
+    uint32_t u;
+    float f;
+
+    if (buf->end - buf->pos < 4) {
+        return truncated();
+    }
+    u = (uint32_t) buf->pos[0] | ((uint32_t) buf->pos[1] << 8)
+        | ((uint32_t) buf->pos[2] << 16) | ((uint32_t) buf->pos[3] << 24);
+    memcpy(&f, &u, 4);
+    buf->pos += 4;
+    *value = f;
+    return 0;
+}
+
+static int
+read_double(buffer_t *buf, double *value)
+{
+    uint64_t u = 0;
+    int j;
+
+    if (buf->end - buf->pos < 8) {
+        return truncated();
+    }
+    for (j = 7; j >= 0; j--) {
+        u = (u << 8) | buf->pos[j];
+    }
+    memcpy(value, &u, 8);
+    buf->pos += 8;
+    return 0;
+}
+
+/*
+ * Reads the branch of a union and returns the corresponding node.
+ */
+static node_t *
+read_branch(node_t *node, buffer_t *buf)
+{
+    int64_t branch;
+
+    if (read_long(buf, &branch) != 0) {
+        return NULL;
+    }
+    if (branch < 0 || branch >= node->num_children) {
+        PyErr_SetString(PyExc_ValueError, "Invalid Avro union branch");
+        return NULL;
+    }
+    return node->children[branch];
+}
+
+/*
+ * Reads the count of the next block of items in an array, skipping the
+ * block size if present.
+ */
+static int
+read_array_count(buffer_t *buf, int64_t *count)
+{
+    int64_t size;
+
+    if (read_long(buf, count) != 0) {
+        return -1;
+    }
+    if (*count < 0) {
+        *count = -*count;
+        if (read_long(buf, &size) != 0) {
+            return -1;
+        }
+    }
+    return 0;
+}
+
+static int
+skip_value(node_t *node, buffer_t *buf)
+{
+    int64_t n, j;
+    const char *ptr;
+    Py_ssize_t size;
+
+    switch (node->type) {
+        case T_NULL:
+            return 0;
+        case T_BOOLEAN:
+            if (buf->pos >= buf->end) {
+                return truncated();
+            }
+            buf->pos++;
+            return 0;
+        case T_INT:
+        case T_LONG:
+            return read_long(buf, &n);
+        case T_FLOAT:
+        case T_DOUBLE:
+            n = node->type == T_FLOAT ? 4 : 8;
+            if (buf->end - buf->pos < n) {
+                return truncated();
+            }
+            buf->pos += n;
+            return 0;
+        case T_BYTES:
+        case T_STRING:
+            return read_bytes(buf, &ptr, &size);
+        case T_ARRAY:
+            while (1) {
+                if (read_long(buf, &n) != 0) {
+                    return -1;
+                }
+                if (n == 0) {
+                    return 0;
+                }
+                if (n < 0) {
+                    /* The block size lets us jump over the items */
+                    if (read_long(buf, &n) != 0) {
+                        return -1;
+                    }
+                    if (n < 0 || n > buf->end - buf->pos) {
+                        return truncated();
+                    }
+                    buf->pos += n;
+                } else {
+                    for (j = 0; j < n; j++) {
+                        if (skip_value(node->children[0], buf) != 0) {
+                            return -1;
+                        }
+                    }
+                }
+            }
+        case T_UNION:
+            node = read_branch(node, buf);
+            if (node == NULL) {
+                return -1;
+            }
+            return skip_value(node, buf);
+    }
+    return 0;
+}
+
+/*
+ * Returns a new reference to the Python value of the specified type
+ * read from the buffer, in the form returned by RecordDecoder.
+ */
+static PyObject *
+decode_value(node_t *node, buffer_t *buf)
+{
+    PyObject *ret, *item;
+    int64_t n, j;
+    double x;
+    const char *ptr;
+    Py_ssize_t size;
+
+    switch (node->type) {
+        case T_NULL:
+            Py_RETURN_NONE;
+        case T_BOOLEAN:
+            if (buf->pos >= buf->end) {
+                truncated();
+                return NULL;
+            }
+            return PyBool_FromLong(*buf->pos++);
+        case T_INT:
+        case T_LONG:
+            if (read_long(buf, &n) != 0) {
+                return NULL;
+            }
+            return PyLong_FromLongLong(n);
+        case T_FLOAT:
+        case T_DOUBLE:
+            if ((node->type == T_FLOAT ? read_float(buf, &x)
+                        : read_double(buf, &x)) != 0) {
+                return NULL;
+            }
+            return PyFloat_FromDouble(x);
+        case T_BYTES:
+            if (read_bytes(buf, &ptr, &size) != 0) {
+                return NULL;
+            }
+            return PyBytes_FromStringAndSize(ptr, size);
+        case T_STRING:
+            if (read_bytes(buf, &ptr, &size) != 0) {
+                return NULL;
+            }
+            return PyUnicode_DecodeUTF8(ptr, size, NULL);
+        case T_ARRAY:
+            ret = PyList_New(0);
+            if (ret == NULL) {
+                return NULL;
+            }
+            while (1) {
+                if (read_array_count(buf, &n) != 0) {
+                    Py_DECREF(ret);
+                    return NULL;
+                }
+                if (n == 0) {
+                    return ret;
+                }
+                for (j = 0; j < n; j++) {
+                    item = decode_value(node->children[0], buf);
+                    if (item == NULL || PyList_Append(ret, item) != 0) {
+                        Py_XDECREF(item);
+                        Py_DECREF(ret);
+                        return NULL;
+                    }
+                    Py_DECREF(item);
+                }
+            }
+        case T_UNION:
+            node = read_branch(node, buf);
+            if (node == NULL) {
+                return NULL;
+            }
+            return decode_value(node, buf);
+    }
+    PyErr_SetString(PyExc_ValueError, "Unsupported Avro type");
+    return NULL;
+}
+
+/*
+ * Reads a value of a fixed width column into the specified slot of the
+ * output buffer.
+ */
+static int
+decode_fixed(column_t *column, buffer_t *buf, char *out, Py_ssize_t row)
+{
+    node_t *node = column->node;
+    int64_t n = INT_MISSING;
+    int32_t i32;
+    float f;
+    double x = NAN;
+
+    if (node->type == T_UNION) {
+        node = read_branch(node, buf);
+        if (node == NULL) {
+            return -1;
+        }
+    }
+    if (node->type != T_NULL && node->type != column->value_type) {
+        PyErr_SetString(PyExc_ValueError, "Unexpected type in fixed column");
+        return -1;
+    }
+    switch (column->value_type) {
+        case T_INT:
+            if (node->type != T_NULL && read_long(buf, &n) != 0) {
+                return -1;
+            }
+            i32 = (int32_t) n;
+            memcpy(out + 4 * row, &i32, 4);
+            break;
+        case T_LONG:
+            if (node->type != T_NULL && read_long(buf, &n) != 0) {
+                return -1;
+            }
+            memcpy(out + 8 * row, &n, 8);
+            break;
+        case T_FLOAT:
+            if (node->type != T_NULL && read_float(buf, &x) != 0) {
+                return -1;
+            }
+            f = (float) x;
+            memcpy(out + 4 * row, &f, 4);
+            break;
+        case T_DOUBLE:
+            if (node->type != T_NULL && read_double(buf, &x) != 0) {
+                return -1;
+            }
+            memcpy(out + 8 * row, &x, 8);
+            break;
+    }
+    return 0;
+}
+
+/*
+ * Returns a new reference to the value of a dictionary encoded column,
+ * appending new values to the block's dictionary.
+ */
+static PyObject *
+decode_dictionary(node_t *node, buffer_t *buf, PyObject *values)
+{
+    int64_t branch, code;
+    const char *ptr;
+    Py_ssize_t size;
+    PyObject *value;
+
+    if (read_long(buf, &branch) != 0) {
+        return NULL;
+    }
+    if (branch == 0) {
+        if (read_long(buf, &code) != 0) {
+            return NULL;
+        }
+        if (code < 0 || code >= PyList_GET_SIZE(values)) {
+            PyErr_SetString(PyExc_ValueError, "Invalid dictionary code");
+            return NULL;
+        }
+        value = PyList_GET_ITEM(values, code);
+        Py_INCREF(value);
+        return value;
+    } else if (branch == 1) {
+        if (read_bytes(buf, &ptr, &size) != 0) {
+            return NULL;
+        }
+        value = PyBytes_FromStringAndSize(ptr, size);
+        if (value == NULL || PyList_Append(values, value) != 0) {
+            Py_XDECREF(value);
+            return NULL;
+        }
+        return value;
+    }
+    Py_RETURN_NONE;
+}
+
+static int
+value_width(int type)
+{
+    return type == T_LONG || type == T_DOUBLE ? 8 : 4;
+}
+
+static void
+BlockDecoder_dealloc(BlockDecoder *self)
+{
+    Py_ssize_t j;
+
+    if (self->columns != NULL) {
+        for (j = 0; j < self->num_columns; j++) {
+            free_node(self->columns[j].node);
+            Py_XDECREF(self->columns[j].dictionary);
+        }
+        PyMem_Free(self->columns);
+    }
+    Py_TYPE(self)->tp_free((PyObject *) self);
+}
+
+/*
+ * Returns the type of the non-null values of a fixed width column, or
+ * -1 if the type is not a numeric type or a union of one with null.
+ */
+static int
+get_fixed_type(node_t *node)
+{
+    Py_ssize_t j;
+    int type = -1;
+
+    if (node->type != T_UNION) {
+        type = node->type;
+    } else {
+        for (j = 0; j < node->num_children; j++) {
+            if (node->children[j]->type != T_NULL) {
+                if (type != -1) {
+                    return -1;
+                }
+                type = node->children[j]->type;
+            }
+        }
+    }
+    if (type != T_INT && type != T_LONG && type != T_FLOAT
+            && type != T_DOUBLE) {
+        return -1;
+    }
+    return type;
+}
+
+static int
+BlockDecoder_init(BlockDecoder *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"fields", NULL};
+    PyObject *fields, *item, *avro_type, *dictionary;
+    column_t *column;
+    Py_ssize_t j;
+    int mode;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O!", kwlist,
+                &PyList_Type, &fields)) {
+        return -1;
+    }
+    if (self->columns != NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "BlockDecoder already initialised");
+        return -1;
+    }
+    self->num_columns = PyList_GET_SIZE(fields);
+    self->num_selected = 0;
+    self->columns = PyMem_Calloc(self->num_columns + 1, sizeof(column_t));
+    if (self->columns == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    for (j = 0; j < self->num_columns; j++) {
+        item = PyList_GET_ITEM(fields, j);
+        if (!PyArg_ParseTuple(item, "OiO", &avro_type, &mode, &dictionary)) {
+            return -1;
+        }
+        column = &self->columns[j];
+        column->mode = mode;
+        column->node = parse_type(avro_type);
+        if (column->node == NULL) {
+            return -1;
+        }
+        if (mode == MODE_FIXED) {
+            column->value_type = get_fixed_type(column->node);
+            if (column->value_type == -1) {
+                PyErr_SetString(PyExc_ValueError,
+                        "Fixed width columns must have a numeric type");
+                return -1;
+            }
+        } else if (mode == MODE_DICTIONARY) {
+            if (!PyList_Check(dictionary)) {
+                PyErr_SetString(PyExc_TypeError, "Dictionary must be a list");
+                return -1;
+            }
+            Py_INCREF(dictionary);
+            column->dictionary = dictionary;
+        } else if (mode != MODE_SKIP && mode != MODE_OBJECT) {
+            PyErr_SetString(PyExc_ValueError, "Unknown column mode");
+            return -1;
+        }
+        if (mode != MODE_SKIP) {
+            self->num_selected++;
+        }
+    }
+    return 0;
+}
+
+static PyObject *
+BlockDecoder_decode(BlockDecoder *self, PyObject *args)
+{
+    Py_buffer data;
+    Py_ssize_t count, row, j, k;
+    PyObject *ret = NULL;
+    PyObject **outputs = NULL;
+    PyObject **values = NULL;
+    PyObject *value;
+    column_t *column;
+    buffer_t buf;
+
+    if (self->columns == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "BlockDecoder not initialised");
+        return NULL;
+    }
+    if (!PyArg_ParseTuple(args, "y*n", &data, &count)) {
+        return NULL;
+    }
+    if (count < 0) {
+        PyErr_SetString(PyExc_ValueError, "Negative record count");
+        goto out;
+    }
+    outputs = PyMem_Calloc(self->num_columns + 1, sizeof(PyObject *));
+    values = PyMem_Calloc(self->num_columns + 1, sizeof(PyObject *));
+    if (outputs == NULL || values == NULL) {
+        PyErr_NoMemory();
+        goto out;
+    }
+    for (j = 0; j < self->num_columns; j++) {
+        column = &self->columns[j];
+        if (column->mode == MODE_FIXED) {
+            outputs[j] = PyBytes_FromStringAndSize(NULL,
+                    count * value_width(column->value_type));
+        } else if (column->mode != MODE_SKIP) {
+            outputs[j] = PyList_New(count);
+        }
+        if (column->mode != MODE_SKIP && outputs[j] == NULL) {
+            goto out;
+        }
+        if (column->mode == MODE_DICTIONARY) {
+            /* New values are only added to the dictionary for this block */
+            values[j] = PyList_GetSlice(column->dictionary, 0,
+                    PyList_GET_SIZE(column->dictionary));
+            if (values[j] == NULL) {
+                goto out;
+            }
+        }
+    }
+    buf.pos = data.buf;
+    buf.end = buf.pos + data.len;
+    for (row = 0; row < count; row++) {
+        for (j = 0; j < self->num_columns; j++) {
+            column = &self->columns[j];
+            switch (column->mode) {
+                case MODE_SKIP:
+                    if (skip_value(column->node, &buf) != 0) {
+                        goto out;
+                    }
+                    continue;
+                case MODE_FIXED:
+                    if (decode_fixed(column, &buf,
+                                PyBytes_AS_STRING(outputs[j]), row) != 0) {
+                        goto out;
+                    }
+                    continue;
+                case MODE_OBJECT:
+                    value = decode_value(column->node, &buf);
+                    break;
+                default:
+                    value = decode_dictionary(column->node, &buf, values[j]);
+                    break;
+            }
+            if (value == NULL) {
+                goto out;
+            }
+            PyList_SET_ITEM(outputs[j], row, value);
+        }
+    }
+    ret = PyList_New(self->num_selected);
+    if (ret == NULL) {
+        goto out;
+    }
+    k = 0;
+    for (j = 0; j < self->num_columns; j++) {
+        if (outputs[j] != NULL) {
+            PyList_SET_ITEM(ret, k, outputs[j]);
+            outputs[j] = NULL;
+            k++;
+        }
+    }
+out:
+    if (outputs != NULL) {
+        for (j = 0; j < self->num_columns; j++) {
+            Py_XDECREF(outputs[j]);
+            Py_XDECREF(values[j]);
+        }
+    }
+    PyMem_Free(outputs);
+    PyMem_Free(values);
+    PyBuffer_Release(&data);
+    return ret;
+}
+
+static PyMethodDef BlockDecoder_methods[] = {
+    {"decode", (PyCFunction) BlockDecoder_decode, METH_VARARGS,
+        "decode(data, count)\n\n"
+        "Decodes the count records in the specified decompressed data block\n"
+        "and returns a list with one value for each selected column: a bytes\n"
+        "object holding the little-endian values of fixed width columns, \n"
+        "and a list of Python values for the other columns."},
+    {NULL}
+};
+
+static PyTypeObject BlockDecoderType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "_vcf2avro.BlockDecoder",
+    .tp_basicsize = sizeof(BlockDecoder),
+    .tp_dealloc = (destructor) BlockDecoder_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_doc = "BlockDecoder(fields)\n\n"
+        "Decoder for the records in Avro data blocks. fields is a list with\n"
+        "one (avro_type, mode, dictionary) tuple for each field in the \n"
+        "schema, where mode is one of 0 (skip), 1 (fixed width), 2 (Python\n"
+        "values) or 3 (dictionary encoded, with the initial dictionary).",
+    .tp_methods = BlockDecoder_methods,
+    .tp_init = (initproc) BlockDecoder_init,
+    .tp_new = PyType_GenericNew,
+};
+
+static struct PyModuleDef vcf2avro_module = {
+    PyModuleDef_HEAD_INIT,
+    "_vcf2avro",
+    "C decoder for the Avro data blocks written by vcf2avro.",
+    -1,
+    NULL
+};
+
+PyMODINIT_FUNC
+PyInit__vcf2avro(void)
+{
+    PyObject *module;
+
+    if (PyType_Ready(&BlockDecoderType) < 0) {
+        return NULL;
+    }
+    module = PyModule_Create(&vcf2avro_module);
+    if (module == NULL) {
+        return NULL;
+    }
+    Py_INCREF(&BlockDecoderType);
+    if (PyModule_AddObject(module, "BlockDecoder",
+                (PyObject *) &BlockDecoderType) != 0) {
+        Py_DECREF(&BlockDecoderType);
+        Py_DECREF(module);
+        return NULL;
+    }
+    return module;
+}
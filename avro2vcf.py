@@ -0,0 +1,377 @@
+"""
+Converts an Avro encoded VCF written by vcf2avro back into VCF, using
+the header lines and samples stored in the Avro file metadata. The data
+blocks are decoded and formatted in a pool of worker processes, and
+written in order to stdout or to a plain or BGZF compressed file.
+"""
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import json
+import argparse
+import collections
+import multiprocessing
+
+import vcf2avro
+
+# The number of blocks queued for each worker process.
+BLOCKS_PER_JOB = 2
+
+FIXED_COLUMNS = [name.decode() for name in vcf2avro.VCF_FIXED_COLUMNS]
+
+def format_float(value):
+    """
+    Returns the shortest string representation of the specified float
+    column value that reads back as the same 32 bit float.
+    """
+    if vcf2avro.np is not None:
+        return vcf2avro.np.format_float_positional(
+                vcf2avro.np.float32(value), trim="-")
+    return "{0:.7g}".format(value)
+
+def format_value(value):
+    """
+    Returns the VCF representation of the specified column value as bytes.
+    """
+    if value is None:
+        return vcf2avro.MISSING_VALUE
+    elif isinstance(value, bytes):
+        return value
+    elif isinstance(value, list):
+        return b",".join(format_value(v) for v in value)
+    elif isinstance(value, float):
+        return format_float(value).encode()
+    elif isinstance(value, str):
+        return value.encode()
+    return str(value).encode()
+
+def get_vcf_type(avro_type):
+    """
+    Returns the (Number, Type) of the ##INFO or ##FORMAT line for a column
+    of the specified Avro type.
+    """
+    t = vcf2avro.get_value_type(avro_type)
+    number = b"1"
+    if isinstance(t, dict):
+        t = vcf2avro.get_value_type(t["items"])
+        number = b"."
+    vcf_type = {"int": vcf2avro.INTEGER, "float": vcf2avro.FLOAT}.get(t,
+            vcf2avro.STRING)
+    return number, vcf_type
+
+
+class VCFFormatter(object):
+    """
+    Class that formats the records of an Avro encoded VCF with the
+    specified metadata as VCF lines, for the specified list of samples
+    or for all samples if this is None.
+    """
+    def __init__(self, metadata, samples=None):
+        schema = metadata[vcf2avro.AVRO_SCHEMA_KEY].decode()
+        self.__fields = json.loads(schema)["fields"]
+        names = [f["name"] for f in self.__fields]
+        all_samples = json.loads(metadata.get(vcf2avro.SAMPLES_KEY,
+            b"[]").decode())
+        if samples is None:
+            samples = all_samples
+        for sample in samples:
+            if sample not in all_samples:
+                raise ValueError("Unknown sample: " + sample)
+        # Samples are output in the order they were stored.
+        self.__samples = [s for s in all_samples if s in samples]
+        self.__sample_indexes = [all_samples.index(s) for s in self.__samples]
+        self.__num_samples = len(all_samples)
+        layout = metadata.get(vcf2avro.GENOTYPE_LAYOUT_KEY,
+                vcf2avro.COLUMN_LAYOUT.encode()).decode()
+        self.__sample_layout = layout == vcf2avro.SAMPLE_LAYOUT
+        self.__header = metadata.get(vcf2avro.HEADER_KEY)
+        flags = set()
+        if self.__header is not None:
+            for line in self.__header.splitlines():
+                if line.startswith(b"##INFO") and b"Type=Flag" in line:
+                    flags.add(vcf2avro.get_header_id(line).decode())
+        separator = vcf2avro.COLUMN_SEPARATOR.decode()
+        info_prefix = vcf2avro.INFO.decode() + separator
+        self.__info = [(name, name[len(info_prefix):].encode(),
+            name[len(info_prefix):] in flags) for name in names
+            if name.startswith(info_prefix)]
+        if self.__sample_layout:
+            prefix = vcf2avro.FORMAT_NAME.decode() + separator
+        elif len(all_samples) > 0:
+            prefix = all_samples[0] + separator
+        else:
+            prefix = None
+        keys = []
+        if prefix is not None:
+            keys = [name[len(prefix):] for name in names
+                    if name.startswith(prefix)]
+        if not self.__sample_layout:
+            keys = [k for k in keys if all(s + separator + k in names
+                for s in all_samples)]
+        # GT must be the first FORMAT key.
+        gt = vcf2avro.GT_NAME.decode()
+        keys = [k for k in keys if k == gt] + [k for k in keys if k != gt]
+        self.__format = []
+        for key in keys:
+            if self.__sample_layout:
+                columns = prefix + key
+            else:
+                columns = [s + separator + key for s in self.__samples]
+            self.__format.append((key.encode(), columns))
+        self.__columns = [name for name in names
+                if name in FIXED_COLUMNS]
+        self.__columns += [name for name, key, flag in self.__info]
+        for key, columns in self.__format:
+            if self.__sample_layout:
+                self.__columns.append(columns)
+            else:
+                self.__columns.extend(columns)
+
+    def get_columns(self):
+        """
+        Returns the list of columns that must be decoded to format records.
+        """
+        return list(self.__columns)
+
+    def get_header(self):
+        """
+        Returns the VCF header as bytes. If the metadata does not include
+        the original meta-information lines, minimal ##INFO and ##FORMAT
+        lines are generated from the schema.
+        """
+        lines = []
+        if self.__header is not None:
+            lines.append(self.__header)
+        else:
+            types = dict((f["name"], f["type"]) for f in self.__fields)
+            lines.append(b"##fileformat=VCFv4.2\n")
+            for name, key, flag in self.__info:
+                number, vcf_type = get_vcf_type(types[name])
+                lines.append(b"##INFO=<ID=" + key + b",Number=" + number +
+                        b",Type=" + vcf_type + b",Description=\"\">\n")
+            for key, columns in self.__format:
+                if self.__sample_layout:
+                    t = vcf2avro.get_value_type(types[columns])["items"]
+                else:
+                    t = types[columns[0]]
+                number, vcf_type = get_vcf_type(t)
+                if key == vcf2avro.GT_NAME:
+                    number, vcf_type = b"1", vcf2avro.STRING
+                lines.append(b"##FORMAT=<ID=" + key + b",Number=" + number +
+                        b",Type=" + vcf_type + b",Description=\"\">\n")
+        columns = [b"#CHROM", b"POS", b"ID", b"REF", b"ALT", b"QUAL",
+                b"FILTER", b"INFO"]
+        if len(self.__samples) > 0:
+            columns.append(vcf2avro.FORMAT_NAME)
+            columns += [s.encode() for s in self.__samples]
+        lines.append(b"\t".join(columns) + b"\n")
+        return b"".join(lines)
+
+    def __sample_values(self, record, columns):
+        """
+        Returns the list of the values of the selected samples for the
+        FORMAT key stored in the specified columns, or None if the record
+        has no values for the key.
+        """
+        if not self.__sample_layout:
+            values = [record[c] for c in columns]
+            return None if all(v is None for v in values) else values
+        values = record[columns]
+        if values is None:
+            return None
+        if isinstance(values, bytes):
+            # A packed GT value.
+            values = [vcf2avro.format_genotype(alleles, phased)
+                for alleles, phased in vcf2avro.unpack_genotypes(values,
+                    self.__num_samples)]
+        return [values[j] for j in self.__sample_indexes]
+
+    def format(self, record):
+        """
+        Returns the VCF line for the specified record, as bytes.
+        """
+        tokens = [format_value(record.get(name))
+                for name in FIXED_COLUMNS]
+        info = []
+        for name, key, flag in self.__info:
+            value = record[name]
+            if value is None:
+                continue
+            if flag:
+                if value:
+                    info.append(key)
+            else:
+                info.append(key + b"=" + format_value(value))
+        tokens.append(b";".join(info) if len(info) > 0
+                else vcf2avro.MISSING_VALUE)
+        if len(self.__samples) > 0:
+            keys = []
+            values = []
+            for key, columns in self.__format:
+                v = self.__sample_values(record, columns)
+                if v is not None:
+                    keys.append(key)
+                    values.append(v)
+            if len(keys) == 0:
+                tokens.append(vcf2avro.MISSING_VALUE)
+                tokens += [vcf2avro.MISSING_VALUE] * len(self.__samples)
+            else:
+                tokens.append(b":".join(keys))
+                for sample_values in zip(*values):
+                    tokens.append(b":".join(format_value(v)
+                        for v in sample_values))
+        return b"\t".join(tokens) + b"\n"
+
+
+class BlockFormatter(object):
+    """
+    Class that decompresses, decodes and formats the records in the
+    Avro data blocks of files with the specified metadata. Only the
+    records overlapping the specified region are formatted.
+    """
+    def __init__(self, metadata, samples=None, region=None, bgzf=False):
+        self.__formatter = VCFFormatter(metadata, samples)
+        codec = metadata.get(vcf2avro.AVRO_CODEC_KEY, b"null").decode()
+        self.__decompress = vcf2avro.get_decompressor(codec)
+        dictionaries = {}
+        if vcf2avro.DICTIONARIES_KEY in metadata:
+            d = json.loads(metadata[vcf2avro.DICTIONARIES_KEY].decode())
+            for name, values in d.items():
+                dictionaries[name] = [v.encode() for v in values]
+        self.__decoder = vcf2avro.RecordDecoder(
+                metadata[vcf2avro.AVRO_SCHEMA_KEY].decode(),
+                self.__formatter.get_columns(), dictionaries)
+        self.__query = None
+        if region is not None:
+            chrom, start, end = vcf2avro.parse_region(region)
+            self.__query = chrom.decode(), start, end
+        self.__bgzf = bgzf
+
+    def get_header(self):
+        """
+        Returns the VCF header, compressed if requested.
+        """
+        return self.__compress(self.__formatter.get_header())
+
+    def __compress(self, data):
+        return vcf2avro.bgzf_compress(data) if self.__bgzf else data
+
+    def format_block(self, count, data):
+        """
+        Returns the VCF lines for the count records in the specified
+        compressed data block, compressed if requested.
+        """
+        lines = []
+        for record in self.__decoder.decode(self.__decompress(data), count):
+            if (self.__query is None or
+                    vcf2avro.record_overlaps(record, *self.__query)):
+                lines.append(self.__formatter.format(record))
+        return self.__compress(b"".join(lines))
+
+# The BlockFormatter used by each worker process.
+_block_formatter = None
+
+def _init_worker(metadata, samples, region, bgzf):
+    global _block_formatter
+    _block_formatter = BlockFormatter(metadata, samples, region, bgzf)
+
+def _format_block(block):
+    return _block_formatter.format_block(*block)
+
+
+def write_vcf(filename, out, region=None, samples=None, jobs=1,
+        bgzf=False):
+    """
+    Writes the records of the specified Avro file, or directory of shards
+    written with --shard-by, to the specified binary file object as VCF.
+    With more than one job, the blocks are formatted in a pool of worker
+    processes, with at most BLOCKS_PER_JOB blocks queued for each.
+    """
+    files = [filename]
+    if os.path.isdir(filename):
+        # The header is taken from the first shard, even if it is skipped.
+        files = vcf2avro.find_shards(filename)
+        if len(files) == 0:
+            raise ValueError("No shards in " + filename)
+        first = files[0]
+        files = vcf2avro.find_shards(filename, region)
+    else:
+        first = filename
+    reader = vcf2avro.AvroFileReader(first)
+    metadata = reader.get_metadata()
+    reader.close()
+    formatter = BlockFormatter(metadata, samples, region, bgzf)
+    out.write(formatter.get_header())
+    pool = None
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, _init_worker,
+                (metadata, samples, region, bgzf))
+    try:
+        pending = collections.deque()
+        for f in files:
+            reader = vcf2avro.AvroFileReader(f)
+            if reader.get_schema() != metadata[
+                    vcf2avro.AVRO_SCHEMA_KEY].decode():
+                raise ValueError("Schema of {0} does not match".format(f))
+            try:
+                for block in reader.blocks(region, decompress=False):
+                    if pool is None:
+                        out.write(formatter.format_block(*block))
+                        continue
+                    pending.append(pool.apply_async(_format_block, (block,)))
+                    if len(pending) >= BLOCKS_PER_JOB * jobs:
+                        out.write(pending.popleft().get())
+            finally:
+                reader.close()
+        while len(pending) > 0:
+            out.write(pending.popleft().get())
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    if bgzf:
+        out.write(vcf2avro.BGZF_EOF)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert an Avro encoded VCF back to VCF.")
+    parser.add_argument("FILE", help="""Avro file written by vcf2avro, or
+        directory of shards written with --shard-by""")
+    parser.add_argument("--output", "-o", default="-",
+        help="""Write the VCF to this file rather than stdout. Files ending
+            in .gz are BGZF compressed.""")
+    parser.add_argument("--bgzf", "-z", action="store_true", default=False,
+        help="BGZF compress the output, so that it can be indexed by tabix")
+    parser.add_argument("--region", "-r", default=None,
+        help="""Only output records overlapping the specified region, of
+            the form chrom, chrom:start or chrom:start-end. This uses the
+            block index written alongside the file, if present.""")
+    parser.add_argument("--samples", "-s", default=None,
+        help="""Comma separated list of the samples to output. Samples are
+            output in the order they were stored.""")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+        help="""Number of worker processes decoding and formatting the data
+            blocks. Blocks are written in file order.""")
+    args = parser.parse_args()
+    samples = None
+    if args.samples is not None:
+        samples = args.samples.split(",")
+    bgzf = args.bgzf or args.output.endswith(".gz")
+    try:
+        if args.output == "-":
+            write_vcf(args.FILE, sys.stdout.buffer, args.region, samples,
+                    args.jobs, bgzf)
+            sys.stdout.flush()
+        else:
+            with open(args.output, "wb") as out:
+                write_vcf(args.FILE, out, args.region, samples, args.jobs,
+                        bgzf)
+    except ValueError as e:
+        parser.error(str(e))
+
+if __name__ == "__main__":
+    main()
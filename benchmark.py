@@ -0,0 +1,293 @@
+"""
+Benchmarks for vcf2avro. Generates a synthetic VCF with the requested
+numbers of variants, samples, INFO fields and FORMAT keys, times each
+stage of the conversion and the read path, and writes the results as JSON.
+"""
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import vcf2avro
+
+# The types cycled through for the synthetic INFO fields, as (Number, Type)
+INFO_TYPES = [
+    ("1", "Integer"), ("1", "Float"), ("0", "Flag"), ("A", "Float"),
+    (".", "String"), ("1", "Integer")]
+
+# The FORMAT keys that may be used in addition to GT, in order.
+FORMAT_KEYS = [
+    ("DP", "1", "Integer"), ("GQ", "1", "Integer"), ("AD", "R", "Integer"),
+    ("PL", "G", "Integer"), ("HQ", "2", "Float"), ("FT", "1", "String")]
+
+BASES = "ACGT"
+
+def generate_vcf(filename, num_variants, num_samples, num_info, num_format,
+        seed=1):
+    """
+    Writes a synthetic VCF with the specified numbers of variants,
+    samples, INFO fields and FORMAT keys (including GT) to filename.
+    """
+    rng = random.Random(seed)
+    num_format = max(1, min(num_format, len(FORMAT_KEYS) + 1))
+    format_keys = [("GT", "1", "String")] + FORMAT_KEYS[:num_format - 1]
+    info = []
+    for j in range(num_info):
+        number, vcf_type = INFO_TYPES[j % len(INFO_TYPES)]
+        info.append(("I{0}".format(j), number, vcf_type))
+    with open(filename, "w") as f:
+        f.write("##fileformat=VCFv4.2\n")
+        f.write("##contig=<ID=1,length=249250621>\n")
+        f.write("##FILTER=<ID=q10,Description=\"Quality below 10\">\n")
+        for key, number, vcf_type in info:
+            f.write(("##INFO=<ID={0},Number={1},Type={2},"
+                "Description=\"Synthetic field\">\n").format(
+                    key, number, vcf_type))
+        for key, number, vcf_type in format_keys:
+            f.write(("##FORMAT=<ID={0},Number={1},Type={2},"
+                "Description=\"Synthetic field\">\n").format(
+                    key, number, vcf_type))
+        header = ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO"]
+        if num_samples > 0:
+            header.append("FORMAT")
+            header += ["S{0}".format(j) for j in range(num_samples)]
+        f.write("\t".join(header) + "\n")
+        pos = 0
+        for j in range(num_variants):
+            pos += rng.randint(1, 200)
+            ref = rng.choice(BASES)
+            num_alt = 1 if rng.random() < 0.9 else 2
+            alts = rng.sample([b for b in BASES if b != ref], num_alt)
+            fields = []
+            for key, number, vcf_type in info:
+                if vcf_type == "Flag":
+                    if rng.random() < 0.5:
+                        fields.append(key)
+                    continue
+                if vcf_type == "Integer":
+                    value = str(rng.randint(0, 1000))
+                elif vcf_type == "Float":
+                    n = num_alt if number == "A" else 1
+                    value = ",".join("{0:.3f}".format(rng.random())
+                            for k in range(n))
+                else:
+                    value = "v{0}".format(rng.randint(0, 20))
+                fields.append(key + "=" + value)
+            row = ["1", str(pos), ".", ref, ",".join(alts),
+                "{0:.1f}".format(rng.uniform(0, 100)),
+                "PASS" if rng.random() < 0.8 else "q10",
+                ";".join(fields) if len(fields) > 0 else "."]
+            if num_samples > 0:
+                row.append(":".join(k[0] for k in format_keys))
+                for k in range(num_samples):
+                    row.append(":".join(generate_sample_values(rng,
+                        format_keys, num_alt)))
+            f.write("\t".join(row) + "\n")
+
+def generate_sample_values(rng, format_keys, num_alt):
+    """
+    Returns the list of synthetic values for one sample.
+    """
+    num_alleles = num_alt + 1
+    values = []
+    for key, number, vcf_type in format_keys:
+        if key == "GT":
+            sep = "|" if rng.random() < 0.5 else "/"
+            value = sep.join(str(rng.randint(0, num_alt)) for k in range(2))
+        elif number == "R":
+            value = ",".join(str(rng.randint(0, 50))
+                    for k in range(num_alleles))
+        elif number == "G":
+            n = num_alleles * (num_alleles + 1) // 2
+            value = ",".join(str(rng.randint(0, 255)) for k in range(n))
+        elif vcf_type == "Float":
+            value = ",".join("{0:.1f}".format(rng.uniform(0, 60))
+                    for k in range(int(number)))
+        elif vcf_type == "Integer":
+            value = "." if rng.random() < 0.05 else str(rng.randint(0, 99))
+        else:
+            value = "PASS"
+        values.append(value)
+    return values
+
+
+class Benchmark(object):
+    """
+    Class that times the stages of converting and reading a VCF file.
+    Each stage is run the specified number of times and the fastest run
+    is reported.
+    """
+    def __init__(self, vcf_file, work_dir, repeats=3, layout="column"):
+        self.__vcf_file = vcf_file
+        self.__work_dir = work_dir
+        self.__repeats = repeats
+        self.__layout = layout
+        self.__input_bytes = os.path.getsize(vcf_file)
+        self.__num_rows = None
+        self.__results = {}
+
+    def time(self, name, f, num_bytes=None):
+        """
+        Runs f the specified number of times, records the fastest time
+        under the specified name and returns the value from the last call.
+        """
+        best = None
+        for j in range(self.__repeats):
+            before = time.time()
+            ret = f()
+            elapsed = time.time() - before
+            if best is None or elapsed < best:
+                best = elapsed
+        result = {"seconds": best}
+        if self.__num_rows is not None and best > 0:
+            result["rows_per_sec"] = self.__num_rows / best
+        if num_bytes is not None and best > 0:
+            result["mb_per_sec"] = num_bytes / best / 2**20
+        self.__results[name] = result
+        return ret
+
+    def __reader(self):
+        reader = vcf2avro.VCFReader(self.__vcf_file)
+        reader.set_genotype_layout(self.__layout)
+        return reader
+
+    def run(self):
+        """
+        Runs all the benchmarks and returns the results.
+        """
+        n = self.__input_bytes
+        self.time("read_header", lambda: self.__reader().close())
+        reader = self.__reader()
+        schema, columns = self.time("generate_schema",
+                reader.generate_schema)
+        reader.close()
+
+        def parse():
+            reader = self.__reader()
+            reader.generate_schema()
+            rows = list(reader.rows(columns))
+            reader.close()
+            return rows
+        rows = parse()
+        self.__num_rows = len(rows)
+        self.time("parse_rows", parse, n)
+
+        def encode():
+            encoder = vcf2avro.RecordEncoder(schema)
+            buf = bytearray()
+            for r in rows:
+                encoder.encode(buf, r)
+            return len(buf)
+        encoded_bytes = self.time("encode", encode)
+        self.__results["encode"]["mb_per_sec"] = (
+                encoded_bytes / self.__results["encode"]["seconds"] / 2**20)
+
+        dest = os.path.join(self.__work_dir, "benchmark.avro")
+        def convert():
+            vcf2avro.main(["-q", "-f", "-l", self.__layout,
+                self.__vcf_file, dest])
+        self.time("convert", convert, n)
+        output_bytes = os.path.getsize(dest)
+
+        def read(columns=None):
+            reader = vcf2avro.AvroFileReader(dest)
+            num_records = sum(1 for r in reader.records(columns=columns))
+            reader.close()
+            return num_records
+        self.time("read_all_columns", read, output_bytes)
+        self.time("read_pos_column", lambda: read(["POS"]), output_bytes)
+
+        if vcf2avro.np is not None:
+            columns_dir = os.path.join(self.__work_dir, "benchmark.columns")
+            def convert_columnar():
+                vcf2avro.main(["-q", "-f", "-l", self.__layout, 
+                    "--columnar", "only", self.__vcf_file, columns_dir])
+            self.time("convert_columnar", convert_columnar, n)
+
+            def read_columnar():
+                reader = vcf2avro.ColumnarReader(columns_dir)
+                num_values = len(reader.read_column("POS"))
+                reader.close()
+                return num_values
+            self.time("read_pos_columnar", read_columnar)
+
+        def dump():
+            # The dump.py read path, as run from the command line.
+            with open(os.devnull, "w") as null:
+                subprocess.check_call([sys.executable,
+                    os.path.join(os.path.dirname(__file__), "dump.py"), dest],
+                    stdout=null)
+        self.time("dump", dump, output_bytes)
+        return {
+            "input_bytes": self.__input_bytes,
+            "output_bytes": output_bytes,
+            "num_rows": self.__num_rows,
+            "results": self.__results}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark vcf2avro on a synthetic VCF.")
+    parser.add_argument("--variants", "-n", type=int, default=10000,
+        help="Number of variants in the synthetic VCF")
+    parser.add_argument("--samples", "-s", type=int, default=10,
+        help="Number of samples in the synthetic VCF")
+    parser.add_argument("--info-fields", "-i", type=int, default=6,
+        help="Number of INFO fields in the synthetic VCF")
+    parser.add_argument("--format-keys", "-k", type=int, default=4,
+        help="""Number of FORMAT keys in the synthetic VCF, including GT;
+            at most {0}""".format(len(FORMAT_KEYS) + 1))
+    parser.add_argument("--seed", type=int, default=1,
+        help="Random seed for the synthetic VCF")
+    parser.add_argument("--repeats", "-r", type=int, default=3,
+        help="Number of times each stage is run; the fastest is reported")
+    parser.add_argument("--genotype-layout", "-l",
+        default=vcf2avro.COLUMN_LAYOUT, choices=vcf2avro.GENOTYPE_LAYOUTS,
+        help="Genotype layout used for the conversion")
+    parser.add_argument("--vcf", default=None,
+        help="Benchmark this VCF file rather than a synthetic one")
+    parser.add_argument("--output", "-o", default=None,
+        help="Write the JSON results to this file rather than stdout")
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp(prefix="vcf2avro_benchmark_")
+    try:
+        vcf_file = args.vcf
+        if vcf_file is None:
+            vcf_file = os.path.join(work_dir, "synthetic.vcf")
+            generate_vcf(vcf_file, args.variants, args.samples,
+                    args.info_fields, args.format_keys, args.seed)
+        benchmark = Benchmark(vcf_file, work_dir, args.repeats,
+                args.genotype_layout)
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": {
+                "vcf": args.vcf,
+                "variants": args.variants,
+                "samples": args.samples,
+                "info_fields": args.info_fields,
+                "format_keys": args.format_keys,
+                "seed": args.seed,
+                "repeats": args.repeats,
+                "genotype_layout": args.genotype_layout}}
+        report.update(benchmark.run())
+    finally:
+        shutil.rmtree(work_dir)
+    s = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print(s)
+    else:
+        with open(args.output, "w") as f:
+            f.write(s + "\n")
+
+if __name__ == "__main__":
+    main()
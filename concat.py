@@ -0,0 +1,107 @@
+"""
+Concatenates Avro encoded VCFs written by vcf2avro into a single file,
+for example the outputs of converting each chromosome separately. The
+compressed data blocks are copied as they are, without being decoded
+or re-encoded, and only the header and sync markers are rewritten. The
+block indexes and per-sample statistics of the inputs are merged.
+"""
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import argparse
+
+import vcf2avro
+
+def expand_inputs(inputs):
+    """
+    Returns the list of Avro files for the specified list of files and
+    directories of shards written with --shard-by, in order. The shards
+    of a directory are taken in manifest order.
+    """
+    files = []
+    for name in inputs:
+        if os.path.isdir(name):
+            shards = vcf2avro.find_shards(name)
+            if len(shards) == 0:
+                raise ValueError("No shards in " + name)
+            files.extend(shards)
+        elif os.path.isfile(name):
+            files.append(name)
+        else:
+            raise ValueError("'{0}' does not exist".format(name))
+    return files
+
+def merge_sample_stats(inputs, filename):
+    """
+    Writes the sum of the per-sample statistics of the specified inputs
+    to the specified file, and returns True. If any of the inputs has
+    no statistics, nothing is written and False is returned.
+    """
+    stats_files = [vcf2avro.sample_stats_file_name(name.rstrip(os.sep))
+            for name in inputs]
+    if not all(os.path.exists(f) for f in stats_files):
+        return False
+    samples, num_variants, counts = vcf2avro.read_sample_stats(stats_files[0])
+    for f in stats_files[1:]:
+        other_samples, n, other_counts = vcf2avro.read_sample_stats(f)
+        if other_samples != samples:
+            raise ValueError("the samples of '{0}' do not match".format(f))
+        num_variants += n
+        counts = [[a + b for a, b in zip(c, d)]
+                for c, d in zip(counts, other_counts)]
+    vcf2avro.write_sample_stats(filename, samples, num_variants, counts)
+    return True
+
+def concatenate(inputs, output):
+    """
+    Concatenates the specified inputs into the specified output file,
+    writing its block index and per-sample statistics alongside.
+    Returns the number of records written.
+    """
+    files = expand_inputs(inputs)
+    for f in files:
+        if os.path.exists(output) and os.path.samefile(f, output):
+            raise ValueError("'{0}' is one of the inputs".format(output))
+    stats_file = vcf2avro.sample_stats_file_name(output)
+    try:
+        with open(output, "wb") as out:
+            num_records = vcf2avro.concatenate_avro_files(files, out,
+                    vcf2avro.index_file_name(output))
+        if os.path.exists(stats_file):
+            os.unlink(stats_file)
+        if not merge_sample_stats(inputs, stats_file):
+            if any(os.path.exists(vcf2avro.sample_stats_file_name(
+                    name.rstrip(os.sep))) for name in inputs):
+                print("Warning: not all inputs have per-sample statistics; "
+                        "they are not merged", file=sys.stderr)
+    except Exception:
+        for f in [output, vcf2avro.index_file_name(output), stats_file]:
+            if os.path.exists(f):
+                os.unlink(f)
+        raise
+    return num_records
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="""Concatenate Avro encoded VCFs without re-encoding
+            them.""")
+    parser.add_argument("FILE", nargs="+", help="""Avro files written by
+        vcf2avro, or directories of shards written with --shard-by. These
+        must have the same schema, codec and VCF metadata, and their
+        blocks are written in the order given.""")
+    parser.add_argument("--output", "-o", required=True,
+        help="Write the concatenated file to this file")
+    parser.add_argument("--force", "-f", action="store_true", default=False,
+        help="Overwrite the output file if it exists")
+    args = parser.parse_args()
+    if os.path.exists(args.output) and not args.force:
+        parser.error("'{0}' exists; use -f to overwrite".format(args.output))
+    try:
+        concatenate(args.FILE, args.output)
+    except (IOError, OSError, ValueError) as e:
+        parser.error(str(e))
+
+if __name__ == "__main__":
+    main()
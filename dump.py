@@ -2,26 +2,111 @@
 Short script to dump an Avro encoded VCF.
 """
 from __future__ import print_function
-from __future__ import division 
+from __future__ import division
 
+import os
 import sys
+import json
+import errno
+import argparse
 
-import avro
-import avro.io
-import avro.schema
-import avro.datafile
+import vcf2avro
 
-def dump_file(f):
-    reader = avro.datafile.DataFileReader(f, avro.io.DatumReader())
-    for record in reader:
-        print(record["POS"])
+def format_value(value):
+    """
+    Returns the string representation of the specified column value.
+    """
+    if value is None:
+        s = "NA"
+    elif isinstance(value, bytes):
+        s = value.decode(errors="backslashreplace")
+    elif isinstance(value, list):
+        s = ",".join(format_value(v) for v in value)
+    else:
+        s = str(value)
+    return s
+
+def get_converters(metadata, columns):
+    """
+    Returns a list of the functions applied to the values of the specified
+    columns before they are formatted, or None for columns that are 
+    formatted as they are. Packed GT values are unpacked into the list of
+    GT strings of the samples.
+    """
+    encoding = metadata.get(vcf2avro.GT_ENCODING_KEY, b"").decode()
+    gt_name = (vcf2avro.FORMAT_NAME + vcf2avro.COLUMN_SEPARATOR + 
+            vcf2avro.GT_NAME).decode()
+    num_samples = len(json.loads(metadata.get(vcf2avro.SAMPLES_KEY, 
+        b"[]").decode()))
+    def unpack(value):
+        if value is None:
+            return None
+        return [vcf2avro.format_genotype(alleles, phased) for alleles, phased
+                in vcf2avro.unpack_genotypes(value, num_samples)]
+    return [unpack if c == gt_name and 
+            encoding == vcf2avro.PACKED_GT_ENCODING else None 
+            for c in columns]
+
+def dump_file(filename, region=None, columns=["POS"], where=[]):
+    reader = vcf2avro.AvroFileReader(filename)
+    try:
+        predicates = [vcf2avro.parse_predicate(s) for s in where]
+        converters = get_converters(reader.get_metadata(), columns)
+        if vcf2avro.np is None:
+            for record in reader.records(region, columns, predicates):
+                values = [record[c] for c in columns]
+                print("\t".join(format_value(v if f is None else f(v)) 
+                    for v, f in zip(values, converters)))
+            return
+        # Decode a block at a time, using the C decoder if it is built.
+        for block in reader.column_blocks(region, columns, predicates):
+            values = [vcf2avro.get_column_values(block[c]) for c in columns]
+            values = [v if f is None else [f(x) for x in v] 
+                    for v, f in zip(values, converters)]
+            for row in zip(*values):
+                print("\t".join(format_value(v) for v in row))
+    finally:
+        reader.close()
+
+def dump_directory(directory, region=None, columns=["POS"], where=[]):
+    """
+    Dumps the shards in a directory written with --shard-by, skipping 
+    those that the manifest shows cannot overlap the region.
+    """
+    for filename in vcf2avro.find_shards(directory, region):
+        dump_file(filename, region, columns, where)
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: dump <avro_vcf>")
-        sys.exit()
-    with open(sys.argv[1]) as f:
-        dump_file(f)
+    parser = argparse.ArgumentParser(description="Dump an Avro encoded VCF.")
+    parser.add_argument("FILE", help="""Avro file written by vcf2avro, or 
+        directory of shards written with --shard-by""")
+    parser.add_argument("--region", "-r", default=None,
+        help="""Only dump records overlapping the specified region,
+            of the form chrom, chrom:start or chrom:start-end. This
+            uses the block index written alongside the file, if present.""")
+    parser.add_argument("--columns", "-c", default="POS",
+        help="""Comma separated list of the columns to dump. Only these
+            columns are decoded. Defaults to POS.""")
+    parser.add_argument("--where", "-w", action="append", default=[],
+        help="""Only dump records satisfying the condition COLUMN OP VALUE,
+            where OP is one of ==, !=, <, <=, > or >=; for example,
+            'QUAL>30' or 'FILTER==PASS'. May be repeated, in which case
+            all conditions must hold. Blocks whose statistics show that
+            no record can match are not read.""")
+    args = parser.parse_args()
+    columns = args.columns.split(",")
+    dump = dump_directory if os.path.isdir(args.FILE) else dump_file
+    try:
+        dump(args.FILE, args.region, columns, args.where)
+        sys.stdout.flush()
+    except ValueError as e:
+        parser.error(str(e))
+    except IOError as e:
+        if e.errno != errno.EPIPE:
+            raise
+        # The reader of our output has exited, as when piping into head. 
+        # Stdout is redirected so that flushing it at exit does not fail.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
 
 if __name__ == "__main__":
     main()
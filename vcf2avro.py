@@ -35,66 +35,2989 @@ import os
 import sys
 import gzip
 import time
+import zlib
+import struct
+import binascii
+import hashlib
+import collections
+import concurrent.futures
 import shutil 
+import json
+import mmap
+import queue
+import array
 import argparse
+import functools
+import itertools
 import tempfile
+import threading
 
-import avro
-import avro.io
-import avro.schema
-import avro.datafile
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    # The C block decoder, built with "make"; see ColumnDecoder.
+    import _vcf2avro
+except ImportError:
+    _vcf2avro = None
+import multiprocessing
 
 # VCF Fixed columns
 
-CHROM_NAME = b"CHROM"
-POS_NAME = b"POS"
-ID_NAME = b"ID"
-REF_NAME = b"REF"
-ALT_NAME = b"ALT"
-QUAL_NAME = b"QUAL"
-FILTER_NAME = b"FILTER"
-INFO_NAME = b"INFO"
+CHROM_NAME = b"CHROM"
+POS_NAME = b"POS"
+ID_NAME = b"ID"
+REF_NAME = b"REF"
+ALT_NAME = b"ALT"
+QUAL_NAME = b"QUAL"
+FILTER_NAME = b"FILTER"
+INFO_NAME = b"INFO"
+FORMAT_NAME = b"FORMAT"
+
+VCF_FIXED_COLUMNS = [CHROM_NAME, POS_NAME, ID_NAME, REF_NAME, ALT_NAME, 
+        QUAL_NAME, FILTER_NAME]
+
+# Descriptions taken from 
+# http://www.1000genomes.org/wiki/Analysis/Variant%20Call%20Format/vcf-variant-call-format-version-41 
+CHROM_DESCRIPTION = b"""chromosome: an identifier from the reference genome or an \
+angle-bracketed ID String ("<ID>") pointing to a contig in the assembly file"""
+POS_DESCRIPTION = b"""position: The reference position, with the 1st base having \
+position 1"""
+ID_DESCRIPTION = b"""semi-colon separated list of unique identifiers where \
+available"""
+REF_DESCRIPTION = b"""reference base(s): Each base must be one of A,C,G,T,N \
+(case insensitive)""" 
+ALT_DESCRIPTION = b"""comma separated list of alternate non-reference alleles\
+called on at least one of the samples"""
+QUAL_DESCRIPTION = b"""phred-scaled quality score for the assertion made in \
+ALT. i.e. -10log_10 prob(call in ALT is wrong)."""
+FILTER_DESCRIPTION = b"""PASS if this position has passed all filters, i.e. \
+a call is made at this position. Otherwise, if the site has not passed all \
+filters, a semicolon-separated list of codes for filters that fail. """
+# char used to seperate VCF columns from their prefix, e.g INFO.AF
+COLUMN_SEPARATOR = b"_"
+
+# Special values in VCF
+MISSING_VALUE = b"."
+
+# Strings used in the header for identifiers
+ID = b"ID"
+INFO = b"INFO"
+DESCRIPTION = b"Description"
+NUMBER = b"Number"
+TYPE = b"Type"
+INTEGER = b"Integer"
+FLOAT = b"Float"
+FLAG = b"Flag"
+CHARACTER = b"Character"
+STRING = b"String"
+
+VARIABLE_SIZE = 0 
+
+# The per-variant statistics computed from the GT column with 
+# --compute-stats, as (name, description, type, number of elements).
+STATS_COLUMNS = [
+    (b"STATS_AC", b"number of called REF and ALT alleles, in order", "int",
+        VARIABLE_SIZE),
+    (b"STATS_AN", b"total number of called alleles", "int", 1),
+    (b"STATS_CALL_RATE", b"fraction of samples with a fully called GT", 
+        "float", 1),
+    (b"STATS_MISSING", b"number of samples without a fully called GT", 
+        "int", 1),
+    (b"STATS_HET_RATE", b"fraction of called samples that are heterozygous",
+        "float", 1)]
+STATS_COLUMN_NAMES = [c[0] for c in STATS_COLUMNS]
+# The per-sample counts written to the sidecar with --compute-stats.
+SAMPLE_STATS_SUFFIX = ".samples.json"
+SAMPLE_STATS_COUNTS = ["called", "het", "hom_ref", "hom_alt"]
+
+# Sentinel values used for missing values in NumPy genotype arrays. 
+INT_MISSING = -2**31
+GT_MISSING = -1
+GT_PAD = -2
+GT_NAME = b"GT"
+
+# The maximum number of distinct FORMAT strings and INFO key sets for 
+# which we keep compiled parse plans.
+PARSE_PLAN_CACHE_SIZE = 256
+
+# Genotype layouts. In the column layout, each (sample, FORMAT key) pair 
+# is stored in its own field, e.g. NA12878_GT. In the sample layout, each 
+# FORMAT key is stored in a single array field, e.g. FORMAT_GT, with one 
+# entry per sample in header order.
+COLUMN_LAYOUT = "column"
+SAMPLE_LAYOUT = "sample"
+GENOTYPE_LAYOUTS = [COLUMN_LAYOUT, SAMPLE_LAYOUT]
+
+# Keys used for the VCF specific metadata in the Avro file header
+SAMPLES_KEY = "vcf.samples"
+GENOTYPE_LAYOUT_KEY = "vcf.genotype_layout"
+GT_ENCODING_KEY = "vcf.gt_encoding"
+DICTIONARIES_KEY = "vcf.dictionaries"
+HEADER_KEY = "vcf.header"
+
+# Columns that may be dictionary encoded. Each value is written either as
+# the int code of the value in the column's dictionary or, the first time 
+# it appears in a block, as the bytes value itself, which is then added 
+# to the dictionary. The dictionaries are reset to the initial values 
+# stored in the vcf.dictionaries metadata at the start of each block, so
+# that blocks can be decoded independently.
+DICTIONARY_COLUMNS = [CHROM_NAME, REF_NAME, ALT_NAME, FILTER_NAME]
+DICTIONARY_TYPE = ["int", "bytes", "null"]
+# Initial dictionary for the REF and ALT columns
+DICTIONARY_BASES = [b"A", b"C", b"G", b"T", b"N"]
+
+# Incremented whenever the generated schemas change, to invalidate the 
+# schemas in the cache.
+SCHEMA_CACHE_VERSION = 1
+
+# GT encodings. In the packed encoding, which requires the sample layout,
+# the GT values of all samples in a row are stored in a single bytes 
+# value; see pack_genotypes for the format.
+STRING_GT_ENCODING = "string"
+PACKED_GT_ENCODING = "packed"
+GT_ENCODINGS = [STRING_GT_ENCODING, PACKED_GT_ENCODING]
+
+# Avro object container constants
+AVRO_MAGIC = b"Obj\x01"
+AVRO_SYNC_SIZE = 16
+AVRO_SCHEMA_KEY = "avro.schema"
+AVRO_CODEC_KEY = "avro.codec"
+AVRO_CODECS = ["null", "deflate", "snappy", "zstandard"]
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+# The manifest listing the shards in a directory written with --shard-by
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+SHARD_MODES = ["chrom", "bp", "records"]
+# The columnar sidecar written with --columnar; see ColumnarWriter.
+COLUMNAR_SUFFIX = ".columns"
+COLUMNAR_INDEX_FILE = "columns.json"
+COLUMNAR_VERSION = 1
+COLUMNAR_CHUNK_ROWS = 64 * 1024
+COLUMNAR_MODES = ["alongside", "only"]
+# The ways ColumnDecoder decodes each field; these must match the modes
+# in _vcf2avro.c.
+COLUMN_SKIP = 0
+COLUMN_FIXED = 1
+COLUMN_OBJECT = 2
+COLUMN_DICTIONARY = 3
+# The NumPy types of the fixed size column values, and the values that 
+# stand for null.
+COLUMNAR_DTYPES = {"int": "<i4", "long": "<i8", "float": "<f4", 
+        "double": "<f8", "boolean": "i1"}
+COLUMNAR_NULLS = {"int": INT_MISSING, "long": INT_MISSING, 
+        "float": float("nan"), "double": float("nan"), "boolean": -1}
+# Blocks with more distinct FILTER values than this do not record them
+STATS_MAX_DISTINCT = 16
+PREDICATE_OPERATORS = ["==", "!=", "<=", ">=", "<", ">"]
+DEFAULT_CODEC = "deflate"
+DEFAULT_SYNC_INTERVAL = 64 * 1024
+# The maximum number of blocks waiting to be compressed and written if
+# no buffer size is given
+WRITE_QUEUE_SIZE = 8
+# The stages reported by ConversionStats. Reading includes the 
+# decompression of gzip input; BGZF blocks are decompressed in parallel 
+# and timed separately.
+STATS_STAGES = ["read", "decompress", "tokenize", "convert", "encode", 
+        "compress", "write"]
+# The memory budget shared by the stages of the conversion pipeline, and 
+# the maximum size of the chunks of lines passed from the read stage.
+DEFAULT_CACHE_SIZE = "64M"
+LINE_CHUNK_SIZE = 256 * 1024
+
+def encode_long(n):
+    """
+    Returns the Avro zig-zag varint encoding of the specified integer.
+    """
+    n = (n << 1) ^ (n >> 63)
+    b = bytearray()
+    while n & ~0x7F:
+        b.append((n & 0x7F) | 0x80)
+        n >>= 7
+    b.append(n)
+    return bytes(b)
+
+def write_long(buf, n):
+    """
+    Appends the Avro zig-zag varint encoding of the specified integer to 
+    the specified bytearray.
+    """
+    if 0 <= n < SMALL_LONG_CACHE_SIZE:
+        buf += _small_longs[n]
+    else:
+        n = (n << 1) ^ (n >> 63)
+        while n & ~0x7F:
+            buf.append((n & 0x7F) | 0x80)
+            n >>= 7
+        buf.append(n)
+
+# Precomputed encodings for the small non-negative integers that make up 
+# most of the values in a VCF.
+SMALL_LONG_CACHE_SIZE = 4096
+_small_longs = [encode_long(n) for n in range(SMALL_LONG_CACHE_SIZE)]
+
+def read_long(f):
+    """
+    Reads a zig-zag varint encoded integer from the specified file. Returns 
+    None if we are at the end of the file.
+    """
+    c = f.read(1)
+    if len(c) == 0:
+        return None
+    b = ord(c)
+    n = b & 0x7F
+    shift = 7
+    while b & 0x80:
+        b = ord(f.read(1))
+        n |= (b & 0x7F) << shift
+        shift += 7
+    return (n >> 1) ^ -(n & 1)
+
+def read_avro_header(f):
+    """
+    Reads the header of the Avro object container file f and returns 
+    the tuple (metadata, sync_marker). Metadata is a dictionary mapping
+    string keys to bytes values.
+    """
+    if f.read(len(AVRO_MAGIC)) != AVRO_MAGIC:
+        raise ValueError("Not an Avro data file")
+    meta = {}
+    count = read_long(f)
+    while count != 0:
+        if count < 0:
+            # A negative count is followed by the size of the block in bytes.
+            count = -count
+            read_long(f)
+        for j in range(count):
+            key = f.read(read_long(f)).decode()
+            meta[key] = f.read(read_long(f))
+        count = read_long(f)
+    sync = f.read(AVRO_SYNC_SIZE)
+    return meta, sync
+
+def write_avro_header(f, meta, sync):
+    """
+    Writes an Avro object container header with the specified metadata 
+    and sync marker to the specified file.
+    """
+    f.write(AVRO_MAGIC)
+    if len(meta) > 0:
+        f.write(encode_long(len(meta)))
+        for key, value in meta.items():
+            k = key.encode()
+            f.write(encode_long(len(k)))
+            f.write(k)
+            f.write(encode_long(len(value)))
+            f.write(value)
+    f.write(encode_long(0))
+    f.write(sync)
+
+def read_avro_blocks(f, sync):
+    """
+    Returns an iterator over the (record count, data) tuples for the raw 
+    data blocks in the specified Avro file, which must be positioned just 
+    after the header. The data is returned exactly as stored in the file,
+    i.e., it is still compressed with the file's codec.
+    """
+    count = read_long(f)
+    while count is not None:
+        size = read_long(f)
+        data = f.read(size)
+        if f.read(AVRO_SYNC_SIZE) != sync:
+            raise ValueError("Avro sync marker mismatch")
+        yield count, data
+        count = read_long(f)
+
+def decode_long(data, pos):
+    """
+    Decodes the zig-zag varint encoded integer starting at the specified 
+    position in data, and returns the tuple (value, next_position).
+    """
+    b = data[pos]
+    n = b & 0x7F
+    shift = 7
+    pos += 1
+    while b & 0x80:
+        b = data[pos]
+        n |= (b & 0x7F) << shift
+        shift += 7
+        pos += 1
+    return (n >> 1) ^ -(n & 1), pos
+
+def skip_varints(data, pos, n):
+    """
+    Returns the position immediately after the n varints starting at the 
+    specified position in data.
+    """
+    while n > 0:
+        if data[pos] < 0x80:
+            n -= 1
+        pos += 1
+    return pos
+
+def write_avro_block(f, count, data, sync):
+    """
+    Writes a raw data block containing count records to the specified file.
+    """
+    f.write(encode_long(count))
+    f.write(encode_long(len(data)))
+    f.write(data)
+    f.write(sync)
+
+def parse_size(s):
+    """
+    Parses the specified size string, which may have one of the suffixes 
+    K, M or G, and returns the number of bytes.
+    """
+    multipliers = {"K": 2**10, "M": 2**20, "G": 2**30}
+    s = s.strip().upper()
+    if s[-1:] in multipliers:
+        return int(float(s[:-1]) * multipliers[s[-1]])
+    return int(s)
+
+def get_compressor(codec):
+    """
+    Returns a function compressing a bytes value using the specified Avro
+    codec. The snappy and zstandard codecs require the python-snappy and 
+    zstandard packages.
+    """
+    if codec == "null":
+        f = bytes
+    elif codec == "deflate":
+        def f(data):
+            c = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            return c.compress(data) + c.flush()
+    elif codec == "snappy":
+        import snappy
+        def f(data):
+            crc = zlib.crc32(data) & 0xFFFFFFFF
+            return snappy.compress(bytes(data)) + struct.pack(">I", crc)
+    elif codec == "zstandard":
+        import zstandard
+        compressor = zstandard.ZstdCompressor()
+        # ZstdCompressor objects are not thread safe, but each writer only 
+        # compresses in its own background thread. 
+        f = compressor.compress
+    else:
+        raise ValueError("Unknown codec:", codec)
+    return f
+
+def get_decompressor(codec):
+    """
+    Returns a function decompressing a data block written with the 
+    specified Avro codec.
+    """
+    if codec == "null":
+        f = bytes
+    elif codec == "deflate":
+        def f(data):
+            return zlib.decompress(data, -15)
+    elif codec == "snappy":
+        import snappy
+        def f(data):
+            return snappy.decompress(data[:-4])
+    elif codec == "zstandard":
+        import zstandard
+        decompressor = zstandard.ZstdDecompressor()
+        def f(data):
+            return decompressor.decompressobj().decompress(data)
+    else:
+        raise ValueError("Unknown codec:", codec)
+    return f
+
+
+def get_value_type(avro_type):
+    """
+    Returns the type of the non-null values of a column with the specified 
+    Avro type; dictionary encoded columns hold bytes values.
+    """
+    if avro_type == DICTIONARY_TYPE:
+        return "bytes"
+    if isinstance(avro_type, list) and len(avro_type) == 2:
+        if avro_type[1] == "null":
+            return avro_type[0]
+    return avro_type
+
+def _concatenate_rows(parts, mask):
+    """
+    Returns a list with one bytes value for each row of the 3D uint8 array
+    parts, containing the bytes of that row selected by the boolean array 
+    mask in row-major order.
+    """
+    num_rows = parts.shape[0]
+    data = parts[mask].tobytes()
+    lengths = mask.reshape((num_rows, -1)).sum(axis=1)
+    offsets = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return [data[offsets[j]:offsets[j + 1]] for j in range(num_rows)]
+
+def _encode_varint_sequence(seq, row_lengths):
+    """
+    Returns a list with one bytes value for each row, containing the 
+    zig-zag varint encodings of the values in the 1D int64 array seq. 
+    Row j consists of the next row_lengths[j] values of seq. 
+    """
+    zigzag = ((seq << 1) ^ (seq >> 63)).astype(np.uint64)
+    width = 1
+    if len(seq) > 0:
+        width = max(1, (int(zigzag.max()).bit_length() + 6) // 7)
+    parts = np.zeros((len(seq), width), dtype=np.uint8)
+    mask = np.zeros(parts.shape, dtype=bool)
+    more = np.ones(len(seq), dtype=bool)
+    for j in range(width):
+        b = (zigzag >> np.uint64(7 * j)) & np.uint64(0x7F)
+        mask[:, j] = more 
+        more = more & (zigzag >= np.uint64(1) << np.uint64(7 * (j + 1)))
+        parts[:, j] = b | np.where(more, 0x80, 0).astype(np.uint64)
+    data = parts[mask].tobytes()
+    offsets = np.zeros(len(seq) + 1, dtype=np.int64)
+    np.cumsum(mask.sum(axis=1), out=offsets[1:])
+    bounds = np.zeros(len(row_lengths) + 1, dtype=np.int64)
+    np.cumsum(row_lengths, out=bounds[1:])
+    offsets = offsets[bounds]
+    return [data[offsets[j]:offsets[j + 1]] for j in range(len(row_lengths))]
+
+def _encode_int_matrix(values, counts, missing):
+    """
+    Returns the encodings of the rows of a 2D array of nullable int or 
+    int array values as a list of bytes. Values is a 1D array of the 
+    items of the non-missing elements in row-major order. If counts is 
+    None, each element is a single int; otherwise, counts gives the number 
+    of items in the array for each element.
+
+    Each element is encoded as the branch of a union with null, followed
+    by the value if not missing. Since a union branch, the count of a 
+    single array block and the array terminator are all encoded as 
+    varints, the encoding of each row is a sequence of varints.
+    """
+    num_rows, num_samples = missing.shape
+    m = missing.ravel()
+    p = ~m
+    if counts is None:
+        num_items = p.astype(np.int64)
+        lengths = np.where(m, 1, 2)
+        item_offset = 1
+    else:
+        num_items = np.where(m, 0, counts.ravel()).astype(np.int64)
+        lengths = np.where(m, 1, num_items + 3)
+        item_offset = 2
+    starts = np.zeros(len(m), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    seq = np.zeros(lengths.sum(), dtype=np.int64)
+    seq[starts[m]] = 1
+    if counts is not None:
+        seq[starts[p] + 1] = num_items[p]
+    item_starts = np.repeat(starts + item_offset, num_items)
+    first_item = np.repeat(np.cumsum(num_items) - num_items, num_items)
+    seq[item_starts + np.arange(len(item_starts)) - first_item] = values
+    row_lengths = lengths.reshape((num_rows, num_samples)).sum(axis=1)
+    return _encode_varint_sequence(seq, row_lengths)
+
+def _encode_float_matrix(values, missing):
+    """
+    Returns the encodings of the rows of the specified 2D array of 
+    nullable floats as a list of bytes. 
+    """
+    parts = np.zeros(values.shape + (5,), dtype=np.uint8)
+    mask = np.zeros(parts.shape, dtype=bool)
+    parts[..., 0] = np.where(missing, 2, 0)
+    mask[..., 0] = True
+    f = np.ascontiguousarray(values, dtype="<f4")
+    parts[..., 1:] = f.view(np.uint8).reshape(values.shape + (4,))
+    mask[..., 1:] = ~missing[..., np.newaxis]
+    return _concatenate_rows(parts, mask)
+
+
+class RecordEncoder(object):
+    """
+    Class that encodes records in the Avro binary format. The encoder is 
+    compiled once from a record schema into a list of encoding functions,
+    one for each field, so that no schema resolution is needed when 
+    encoding. The output is identical to that of avro.io.DatumWriter.
+    The columns in the dictionaries argument, a dictionary mapping names 
+    to lists of initial values, are dictionary encoded; see 
+    DICTIONARY_COLUMNS.
+    """
+    def __init__(self, schema, dictionaries={}):
+        fields = json.loads(schema)["fields"]
+        self.__types = [f["type"] for f in fields]
+        self.__dictionaries = []
+        self.__encoders = []
+        for f in fields:
+            if f["name"] in dictionaries:
+                self.__encoders.append(self.compile_dictionary(
+                    dictionaries[f["name"]]))
+            else:
+                self.__encoders.append(self.compile(f["type"]))
+
+    def compile_dictionary(self, values):
+        """
+        Returns an encoding function for a dictionary encoded column with 
+        the specified initial values.
+        """
+        initial = dict((v, j) for j, v in enumerate(values))
+        codes = dict(initial)
+        self.__dictionaries.append((codes, initial))
+        code_tag = encode_long(DICTIONARY_TYPE.index("int"))
+        value_tag = encode_long(DICTIONARY_TYPE.index("bytes"))
+        null_tag = encode_long(DICTIONARY_TYPE.index("null"))
+        def f(buf, value):
+            if value is None:
+                buf += null_tag
+            else:
+                code = codes.get(value)
+                if code is None:
+                    codes[value] = len(codes)
+                    buf += value_tag
+                    write_long(buf, len(value))
+                    buf += value
+                else:
+                    buf += code_tag
+                    write_long(buf, code)
+        return f
+
+    def reset(self):
+        """
+        Resets the dictionaries to their initial values. This must be 
+        called at the start of each block.
+        """
+        for codes, initial in self.__dictionaries:
+            codes.clear()
+            codes.update(initial)
+
+    def compile(self, avro_type):
+        """
+        Returns a function f(buf, value) that appends the encoding of value
+        for the specified Avro type to the bytearray buf.
+        """
+        if isinstance(avro_type, dict):
+            if avro_type["type"] != "array":
+                return self.compile(avro_type["type"])
+            g = self.compile(avro_type["items"])
+            def f(buf, value):
+                if len(value) > 0:
+                    write_long(buf, len(value))
+                    for v in value:
+                        g(buf, v)
+                buf.append(0)
+        elif isinstance(avro_type, list):
+            f = self.compile_union(avro_type)
+        elif avro_type in ("int", "long"):
+            f = write_long
+        elif avro_type == "float":
+            pack = struct.Struct("<f").pack
+            def f(buf, value):
+                buf += pack(value)
+        elif avro_type == "double":
+            pack = struct.Struct("<d").pack
+            def f(buf, value):
+                buf += pack(value)
+        elif avro_type == "boolean":
+            def f(buf, value):
+                buf.append(1 if value else 0)
+        elif avro_type == "bytes":
+            def f(buf, value):
+                write_long(buf, len(value))
+                buf += value
+        elif avro_type == "string":
+            def f(buf, value):
+                value = value.encode()
+                write_long(buf, len(value))
+                buf += value
+        elif avro_type == "null":
+            def f(buf, value):
+                pass
+        else:
+            raise ValueError("Unsupported Avro type:", avro_type)
+        return f
+
+    def compile_union(self, branches):
+        """
+        Returns an encoding function for the specified union type. Only 
+        unions of a single type with null are supported, which are all 
+        that we generate.
+        """
+        if len(branches) != 2 or "null" not in branches:
+            raise ValueError("Unsupported Avro union:", branches)
+        null_index = branches.index("null")
+        g = self.compile(branches[1 - null_index])
+        null_tag = encode_long(null_index)
+        value_tag = encode_long(1 - null_index)
+        def f(buf, value):
+            if value is None:
+                buf += null_tag
+            else:
+                buf += value_tag
+                g(buf, value)
+        return f
+
+    def encode(self, buf, record):
+        """
+        Appends the encoding of the specified record, a list of the values 
+        of the fields in schema order, to the bytearray buf. 
+        """
+        for f, value in zip(self.__encoders, record):
+            f(buf, value)
+
+    def encode_array_column(self, slot, values, missing, present, kind, 
+            converter=None):
+        """
+        Returns a list containing the encoding of the per-sample array 
+        field in the specified slot for each row of the specified 
+        VariantBatch arrays. Integer and float values are encoded 
+        using vectorised NumPy operations; other values are encoded 
+        once for each distinct token.
+        """
+        num_rows, num_samples = missing.shape
+        if kind == "packed_gt":
+            # This is a union of bytes with null rather than an array.
+            packed = pack_genotype_matrix(*values)
+            null = encode_long(1)
+            return [b"\x00" + encode_long(len(packed[j])) + packed[j] 
+                    if present[j] else null for j in range(num_rows)]
+        if kind == "int":
+            items = _encode_int_matrix(values[~missing], None, missing)
+        elif kind == "int_list":
+            items = _encode_int_matrix(values[0], values[1], missing)
+        elif kind == "float":
+            items = _encode_float_matrix(values, missing)
+        else:
+            element = self.compile(self.__types[slot][0]["items"])
+            def encode_token(tok):
+                buf = bytearray()
+                if tok == MISSING_VALUE or tok == b".,.":
+                    element(buf, None)
+                else:
+                    element(buf, tok if converter is None else converter(tok))
+                return bytes(buf)
+            lookup = TokenTable(encode_token).__getitem__
+            items = [b"".join(map(lookup, row)) for row in values.tolist()]
+        # The field is a union of the array with null, and the array 
+        # consists of a single block of num_samples items.
+        header = b"\x00"
+        if num_samples > 0:
+            header += encode_long(num_samples)
+        null = encode_long(1)
+        return [header + items[j] + b"\x00" if present[j] else null 
+                for j in range(num_rows)]
+
+    def encode_batch(self, batch):
+        """
+        Returns an iterator over the encoding of each record in the 
+        specified VariantBatch. The per-sample columns are encoded in 
+        bulk up front, but the other fields of each record are only 
+        encoded when it is requested, so that the dictionaries may be 
+        reset between records.
+        """
+        columns = {}
+        for slot, arrays in batch.arrays.items():
+            columns[slot] = self.encode_array_column(slot, *arrays)
+        for j, row in enumerate(batch.rows):
+            buf = bytearray()
+            slot = 0
+            for f, value in zip(self.__encoders, row):
+                if slot in columns:
+                    buf += columns[slot][j]
+                else:
+                    f(buf, value)
+                slot += 1
+            yield buf
+
+
+class ByteBudget(object):
+    """
+    Class limiting the total size in bytes of the items held by a stage of
+    the conversion pipeline. A single item larger than the limit is 
+    admitted when nothing else is held, so that the pipeline cannot 
+    deadlock.
+    """
+    def __init__(self, limit):
+        self.__limit = limit
+        self.__used = 0
+        self.__closed = False
+        self.__condition = threading.Condition()
+
+    def acquire(self, size):
+        """
+        Waits until size bytes are available and reserves them. Returns 
+        False if the budget has been closed.
+        """
+        with self.__condition:
+            while (not self.__closed and self.__used > 0 
+                    and self.__used + size > self.__limit):
+                self.__condition.wait()
+            self.__used += size
+            return not self.__closed
+
+    def release(self, size):
+        """
+        Returns size bytes to the budget.
+        """
+        with self.__condition:
+            self.__used -= size
+            self.__condition.notify_all()
+
+    def close(self):
+        """
+        Wakes up any threads waiting for the budget, which will then fail
+        to acquire it.
+        """
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+
+class AvroFileWriter(object):
+    """
+    Class that writes records to an Avro object container file. Records 
+    are encoded by a RecordEncoder into an in-memory block, which is 
+    handed to a background thread for compression and writing when it 
+    reaches the sync interval. Blocks never span more than one CHROM 
+    value, and if an index file is given, an entry recording the offset, 
+    number of records, CHROM and POS range of each block is written to it,
+    along with the BlockStats of the block. The total size of the blocks 
+    waiting to be written is limited to buffer_size bytes. If a 
+    ConversionStats is given, the time spent encoding, compressing and 
+    writing is recorded in it. If a ShardSet is given, the records are 
+    instead written to a sequence of files, each with its own header and
+    index, and output_file and index_file are ignored. If a sync marker 
+    is given, the output file must be an existing Avro file with this 
+    sync marker positioned at its end, and blocks are appended to it and
+    to its index.
+    """
+    def __init__(self, output_file, schema, metadata={}, codec=DEFAULT_CODEC, 
+            sync_interval=DEFAULT_SYNC_INTERVAL, index_file=None, 
+            buffer_size=None, stats=None, shards=None, sync=None):
+        self.__output_file = None
+        self.__index = None
+        self.__shards = shards
+        self.__shard_key = None
+        self.__input = None
+        self.__checkpoint = None
+        self.__stats = stats
+        self.__closed_bytes = 0
+        if buffer_size is None:
+            buffer_size = WRITE_QUEUE_SIZE * sync_interval
+        self.__budget = ByteBudget(buffer_size)
+        self.__sync_interval = sync_interval
+        self.__compress = get_compressor(codec)
+        dictionaries = {}
+        if DICTIONARIES_KEY in metadata:
+            d = json.loads(metadata[DICTIONARIES_KEY].decode())
+            for name, values in d.items():
+                dictionaries[name] = [v.encode() for v in values]
+        self.__encoder = RecordEncoder(schema, dictionaries)
+        self.__buffer = bytearray()
+        self.__block_count = 0
+        self.__error = None
+        names = [f["name"] for f in json.loads(schema)["fields"]]
+        self.__slots = [names.index(name.decode()) 
+                if name.decode() in names else None
+                for name in [CHROM_NAME, POS_NAME, REF_NAME]]
+        self.__block_position = BlockPosition()
+        self.__stats_columns = get_stats_columns(schema)
+        self.__block_stats = BlockStats(self.__stats_columns)
+        self.__meta = dict(metadata)
+        self.__meta[AVRO_SCHEMA_KEY] = schema.encode()
+        self.__meta[AVRO_CODEC_KEY] = codec.encode()
+        if shards is None:
+            self.__open(output_file, index_file, sync)
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(target=self.__write_blocks)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __open(self, output_file, index_file, sync=None):
+        """
+        Writes the header of the specified output file with a new sync 
+        marker, and makes it the destination of subsequent blocks. If a 
+        sync marker is given, the file already has a header and we append
+        to it.
+        """
+        self.__output_file = output_file
+        self.__sync = os.urandom(AVRO_SYNC_SIZE) if sync is None else sync
+        self.__index = None
+        if index_file is not None:
+            self.__index = IndexWriter(index_file, self.__sync, 
+                    sync is not None)
+        if sync is None:
+            write_avro_header(output_file, self.__meta, self.__sync)
+
+    def set_input(self, reader):
+        """
+        Records a checkpoint with each block from which the conversion 
+        from the specified FileReader can be resumed: the offset reached 
+        in its input after the block's last record, as returned by 
+        get_input_offset, or for batches the offset of the start of the 
+        batch and the number of lines of it that have been written.
+        """
+        self.__input = reader
+
+    def __write_blocks(self):
+        """
+        Compresses and writes the blocks in the queue until we receive None.
+        Each item is the tuple (output_file, index, sync, block), where 
+        block is None if the file is complete and should be closed.
+        """
+        item = self.__queue.get()
+        while item is not None:
+            output_file, index, sync, block = item
+            if block is None:
+                self.__closed_bytes += output_file.tell()
+                output_file.close()
+                if index is not None:
+                    index.close()
+            elif self.__error is None:
+                count, data, position, block_stats, checkpoint = block
+                try:
+                    if self.__stats is not None:
+                        t = self.__stats.start()
+                    compressed = self.__compress(data)
+                    if self.__stats is not None:
+                        t = self.__stats.lap("compress", t)
+                    offset = output_file.tell()
+                    write_avro_block(output_file, count, compressed, sync)
+                    if index is not None:
+                        # The block must be in the file before the index
+                        # entry that makes its checkpoint visible.
+                        output_file.flush()
+                        index.write(offset, count, position, 
+                                block_stats.summary(), checkpoint)
+                    if self.__stats is not None:
+                        self.__stats.lap("write", t)
+                        self.__stats.output_bytes = (self.__closed_bytes + 
+                                output_file.tell())
+                except Exception as e:
+                    self.__error = e
+            if block is not None:
+                self.__budget.release(len(block[1]))
+            item = self.__queue.get()
+
+    def __check_error(self):
+        if self.__error is not None:
+            raise self.__error
+
+    def flush(self):
+        """
+        Hands the current block to the writer thread, if it is not empty.
+        """
+        if self.__block_count > 0:
+            self.__check_error()
+            data = bytes(self.__buffer)
+            self.__budget.acquire(len(data))
+            self.__queue.put((self.__output_file, self.__index, self.__sync,
+                (self.__block_count, data, self.__block_position, 
+                    self.__block_stats, self.__checkpoint)))
+            del self.__buffer[:]
+            self.__block_count = 0
+            self.__block_position = BlockPosition()
+            self.__block_stats = BlockStats(self.__stats_columns)
+            self.__encoder.reset()
+
+    def __close_file(self):
+        """
+        Flushes the current block and queues the current output file to be
+        closed once its blocks have been written.
+        """
+        if self.__output_file is not None:
+            self.flush()
+            self.__queue.put((self.__output_file, self.__index, self.__sync,
+                None))
+            self.__output_file = None
+            self.__index = None
+
+    def __start_record(self, record):
+        """
+        Flushes the current block if the specified record is on a different
+        chromosome, and updates the position range of the block. If we are
+        writing shards, a new shard is started if the record's shard key
+        differs from the current one.
+        """
+        chrom_slot, pos_slot, ref_slot = self.__slots
+        chrom = None if chrom_slot is None else record[chrom_slot]
+        pos = None if pos_slot is None else record[pos_slot]
+        ref = None if ref_slot is None else record[ref_slot] 
+        if self.__shards is not None:
+            key = self.__shards.get_key(chrom, pos)
+            if self.__output_file is None or key != self.__shard_key:
+                self.__close_file()
+                self.__open(*self.__shards.open_shard())
+                self.__shard_key = key
+            self.__shards.update(chrom, pos, ref)
+        if chrom_slot is not None:
+            if self.__block_count > 0 and chrom != self.__block_position.chrom:
+                self.flush()
+            self.__block_position.chrom = chrom
+        if pos is not None:
+            self.__block_position.update(pos, ref)
+        self.__block_stats.update(record)
+
+    def append(self, record):
+        """
+        Appends the specified record to the file.
+        """
+        if self.__stats is not None:
+            t = self.__stats.start()
+        self.__start_record(record)
+        self.__encoder.encode(self.__buffer, record)
+        if self.__stats is not None:
+            self.__stats.lap("encode", t)
+        if self.__input is not None:
+            offset = self.__input.get_input_offset()
+            self.__checkpoint = None if offset is None else (offset, 0)
+        self.__block_count += 1
+        if len(self.__buffer) >= self.__sync_interval:
+            self.flush()
+
+    def append_batch(self, batch):
+        """
+        Appends the records in the specified VariantBatch to the file.
+        """
+        if self.__stats is not None:
+            t = self.__stats.start()
+        encoded = self.__encoder.encode_batch(batch)
+        offset = None
+        if self.__input is not None:
+            offset = batch.input_offset
+        for j, record in enumerate(batch.rows):
+            # Any flush must happen before the record is encoded.
+            self.__start_record(record)
+            self.__buffer += next(encoded)
+            if offset is not None:
+                self.__checkpoint = (offset, j + 1)
+            self.__block_count += 1
+            if len(self.__buffer) >= self.__sync_interval:
+                self.flush()
+        if self.__stats is not None:
+            self.__stats.lap("encode", t)
+
+    def close(self):
+        """
+        Flushes any remaining records, waits for the writer thread to finish
+        and closes the output file.
+        """
+        if self.__thread is not None:
+            self.__close_file()
+            self.__queue.put(None)
+            self.__thread.join()
+            self.__thread = None
+            self.__check_error()
+
+
+class BlockPosition(object):
+    """
+    Class recording the CHROM and the range of positions covered by the 
+    records in a data block. The end of a record is POS + len(REF) - 1.
+    """
+    def __init__(self, chrom=None, min_pos=None, max_pos=None, max_end=None):
+        self.chrom = chrom
+        self.min_pos = min_pos
+        self.max_pos = max_pos
+        self.max_end = max_end
+
+    def update(self, pos, ref):
+        """
+        Updates the range to include a record with the specified POS and REF.
+        """
+        end = pos if ref is None else pos + len(ref) - 1
+        if self.min_pos is None:
+            self.min_pos = self.max_pos = pos
+            self.max_end = end
+        else:
+            self.min_pos = min(self.min_pos, pos)
+            self.max_pos = max(self.max_pos, pos)
+            self.max_end = max(self.max_end, end)
+
+    def overlaps(self, chrom, start, end):
+        """
+        Returns True if the block may contain records overlapping the 
+        one-based closed interval [start, end] on the specified chrom.
+        """
+        return (self.chrom == chrom and self.min_pos is not None 
+                and self.min_pos <= end and self.max_end >= start)
+
+
+def get_stats_columns(schema):
+    """
+    Returns the list of (name, slot, kind) tuples describing the columns 
+    of the specified schema for which block statistics are kept. These 
+    are the scalar numeric fixed and INFO columns, of kind "int" or 
+    "float", and the FILTER column, of kind "filter". 
+    """
+    columns = []
+    fixed = [POS_NAME.decode(), QUAL_NAME.decode()]
+    prefix = (INFO_NAME + COLUMN_SEPARATOR).decode()
+    for slot, field in enumerate(json.loads(schema)["fields"]):
+        name = field["name"]
+        t = get_value_type(field["type"])
+        if name == FILTER_NAME.decode() and t == "bytes":
+            columns.append((name, slot, "filter"))
+        elif name in fixed or name.startswith(prefix):
+            if t in ("int", "long"):
+                columns.append((name, slot, "int"))
+            elif t in ("float", "double"):
+                columns.append((name, slot, "float"))
+    return columns
+
+
+class BlockStats(object):
+    """
+    Class accumulating the statistics of the values in a data block for 
+    the specified list of (name, slot, kind) columns: the number of nulls 
+    and the minimum and maximum of numeric columns, and the distinct 
+    values of the FILTER column. Float values are rounded to single 
+    precision first so that the statistics bound the stored values.
+    """
+    def __init__(self, columns):
+        self.__columns = columns
+        self.__nulls = [0 for c in columns]
+        self.__min = [None for c in columns]
+        self.__max = [None for c in columns]
+        self.__values = [set() for c in columns]
+        self.__round = struct.Struct("<f")
+
+    def update(self, record):
+        """
+        Updates the statistics with the values in the specified record.
+        """
+        j = 0
+        for name, slot, kind in self.__columns:
+            v = record[slot]
+            if v is None:
+                self.__nulls[j] += 1
+            elif kind == "filter":
+                values = self.__values[j]
+                if values is not None:
+                    values.add(v)
+                    if len(values) > STATS_MAX_DISTINCT:
+                        self.__values[j] = None
+            elif v == v:
+                # NaN values are not included in the range.
+                if kind == "float":
+                    v = self.__round.unpack(self.__round.pack(v))[0]
+                if self.__min[j] is None:
+                    self.__min[j] = self.__max[j] = v
+                elif v < self.__min[j]:
+                    self.__min[j] = v
+                elif v > self.__max[j]:
+                    self.__max[j] = v
+            j += 1
+
+    def summary(self):
+        """
+        Returns a dictionary mapping column names to dictionaries of 
+        their statistics, suitable for encoding as JSON.
+        """
+        ret = {}
+        for j, (name, slot, kind) in enumerate(self.__columns):
+            d = {"nulls": self.__nulls[j]}
+            if kind == "filter":
+                # Too many distinct values are recorded as null.
+                d["values"] = None
+                if self.__values[j] is not None:
+                    d["values"] = sorted(v.decode() for v in self.__values[j])
+            elif self.__min[j] is not None:
+                d["min"] = self.__min[j]
+                d["max"] = self.__max[j]
+            ret[name] = d
+        return ret
+
+
+class Predicate(object):
+    """
+    Class representing the condition "column op value" on the records 
+    of an Avro file, where op is one of PREDICATE_OPERATORS. Null values 
+    never satisfy a predicate.
+    """
+    def __init__(self, column, op, value):
+        if op not in PREDICATE_OPERATORS:
+            raise ValueError("Unknown operator: " + op)
+        self.column = column
+        self.op = op
+        self.value = value
+
+    def __compare(self, x):
+        op = self.op
+        v = self.value
+        if op == "==":
+            ret = x == v
+        elif op == "!=":
+            ret = x != v
+        elif op == "<":
+            ret = x < v
+        elif op == "<=":
+            ret = x <= v
+        elif op == ">":
+            ret = x > v
+        else:
+            ret = x >= v
+        return ret
+
+    def matches(self, value):
+        """
+        Returns True if the specified column value satisfies this predicate.
+        """
+        return value is not None and self.__compare(value)
+
+    def may_match(self, stats):
+        """
+        Returns False if no value in a block with the specified statistics
+        for the column can satisfy this predicate. 
+        """
+        if stats is None:
+            return True
+        if "values" in stats:
+            if stats["values"] is None:
+                return True
+            values = [v.encode() for v in stats["values"]]
+            return any(self.__compare(v) for v in values)
+        if "min" not in stats:
+            # The column is null throughout the block.
+            return False
+        low = stats["min"]
+        high = stats["max"]
+        op = self.op
+        v = self.value
+        if op == "==":
+            ret = low <= v <= high
+        elif op == "!=":
+            ret = not (low == high == v)
+        elif op in ("<", "<="):
+            ret = self.__compare(low)
+        else:
+            ret = self.__compare(high)
+        return ret
+
+def parse_predicate(s):
+    """
+    Parses the specified string of the form "column op value" and returns
+    the corresponding Predicate, with the value as a string.
+    """
+    for op in PREDICATE_OPERATORS:
+        k = s.find(op)
+        if k > 0:
+            return Predicate(s[:k].strip(), op, s[k + len(op):].strip())
+    raise ValueError("Cannot parse predicate: " + s)
+
+
+def index_file_name(filename):
+    """
+    Returns the name of the block index sidecar file for the specified 
+    Avro file.
+    """
+    return filename + INDEX_SUFFIX
+
+class IndexWriter(object):
+    """
+    Class that writes a block index sidecar file. The index is a text file
+    of JSON objects, one per line. The first line records the version and
+    the sync marker of the Avro file; each subsequent line describes a
+    data block, in file order. If append is True, entries are appended 
+    to an existing index. Each entry is flushed as it is written, so 
+    that the index describes the blocks that are durably in the file.
+    """
+    def __init__(self, filename, sync, append=False):
+        if append:
+            self.__file = open(filename, "a")
+        else:
+            self.__file = open(filename, "w")
+            header = {"version": INDEX_VERSION, 
+                    "sync": binascii.hexlify(sync).decode()}
+            self.__file.write(json.dumps(header) + "\n")
+
+    def write(self, offset, count, position, stats=None, checkpoint=None):
+        """
+        Writes the entry for the block at the specified file offset with 
+        the specified record count, BlockPosition and summary of the 
+        block statistics. The checkpoint is the tuple (input_offset, 
+        skip_lines) from which the conversion can be resumed after this
+        block; see recover_avro_file.
+        """
+        entry = {"offset": offset, "records": count}
+        if position.chrom is not None:
+            entry["chrom"] = position.chrom.decode()
+        if position.min_pos is not None:
+            entry["min_pos"] = position.min_pos
+            entry["max_pos"] = position.max_pos
+            entry["max_end"] = position.max_end
+        if stats is not None:
+            entry["stats"] = stats
+        if checkpoint is not None:
+            entry["checkpoint"] = {"offset": checkpoint[0], 
+                    "lines": checkpoint[1]}
+        self.__file.write(json.dumps(entry) + "\n")
+        self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+def read_index(filename):
+    """
+    Reads the specified block index file and returns the tuple (sync, 
+    entries), where entries is a list of (offset, records, BlockPosition,
+    stats) tuples. The block statistics are None if they were not recorded.
+    """
+    entries = []
+    with open(filename) as f:
+        header = json.loads(f.readline())
+        if header.get("version") != INDEX_VERSION:
+            raise ValueError("Unsupported index version")
+        sync = binascii.unhexlify(header["sync"])
+        for line in f:
+            d = json.loads(line)
+            chrom = d.get("chrom")
+            position = BlockPosition(None if chrom is None else chrom.encode(),
+                    d.get("min_pos"), d.get("max_pos"), d.get("max_end"))
+            entries.append((d["offset"], d["records"], position, 
+                d.get("stats")))
+    return sync, entries
+
+def recover_avro_file(filename):
+    """
+    Truncates the specified Avro file, and its block index, after the last
+    block that was completely written and indexed, discarding anything 
+    left by an interrupted conversion. Returns the tuple (num_blocks, 
+    checkpoint), where checkpoint is the (input_offset, skip_lines) 
+    recorded for the last block, or None if it has none. The conversion 
+    can be resumed by skipping skip_lines data lines after the uncompressed
+    input_offset of the source.
+    """
+    index_file = index_file_name(filename)
+    with open(index_file, "rb") as f:
+        lines = f.readlines()
+    with open(filename, "rb") as f:
+        meta, sync = read_avro_header(f)
+        end = f.tell()
+        header = json.loads(lines[0].decode())
+        if header.get("version") != INDEX_VERSION:
+            raise ValueError("Unsupported index version")
+        if binascii.unhexlify(header["sync"]) != sync:
+            raise ValueError("Block index does not match " + filename)
+        num_blocks = 0
+        checkpoint = None
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line.decode())
+                if not line.endswith(b"\n") or entry["offset"] != end:
+                    break
+                f.seek(end)
+                read_long(f)
+                size = read_long(f)
+                if len(f.read(size)) != size or f.read(AVRO_SYNC_SIZE) != sync:
+                    break
+            except (ValueError, TypeError):
+                break
+            end = f.tell()
+            num_blocks += 1
+            checkpoint = entry.get("checkpoint")
+            if checkpoint is not None:
+                checkpoint = checkpoint["offset"], checkpoint["lines"]
+    with open(filename, "r+b") as f:
+        f.truncate(end)
+    with open(index_file, "r+b") as f:
+        f.truncate(sum(len(line) for line in lines[:num_blocks + 1]))
+    return num_blocks, checkpoint
+
+def check_concatenable(meta, other, filename):
+    """
+    Raises a ValueError if the blocks of the Avro file with the specified
+    header metadata cannot be copied into a file with the header metadata
+    meta: the schema, codec and all the VCF metadata apart from the
+    original header lines must be the same.
+    """
+    if (json.loads(meta[AVRO_SCHEMA_KEY].decode()) !=
+            json.loads(other[AVRO_SCHEMA_KEY].decode())):
+        raise ValueError("the schema of '{0}' does not match".format(filename))
+    for key in set(meta) | set(other):
+        if (key not in (AVRO_SCHEMA_KEY, HEADER_KEY) and
+                meta.get(key) != other.get(key)):
+            raise ValueError("the {0} metadata of '{1}' does not match".format(
+                key, filename))
+
+def _block_position_decoder(meta):
+    """
+    Returns a function f(count, data) returning the BlockPosition of a
+    data block stored in an Avro file with the specified header metadata,
+    found by decoding its CHROM, POS and REF columns.
+    """
+    schema = meta[AVRO_SCHEMA_KEY].decode()
+    decompress = get_decompressor(meta.get(AVRO_CODEC_KEY, b"null").decode())
+    names = [f["name"] for f in json.loads(schema)["fields"]]
+    columns = [name for name in ["CHROM", "POS", "REF"] if name in names]
+    dictionaries = {}
+    if DICTIONARIES_KEY in meta:
+        d = json.loads(meta[DICTIONARIES_KEY].decode())
+        for name, values in d.items():
+            dictionaries[name] = [v.encode() for v in values]
+    decoder = RecordDecoder(schema, columns, dictionaries)
+    def f(count, data):
+        position = BlockPosition()
+        for record in decoder.decode(decompress(data), count):
+            position.chrom = record.get("CHROM")
+            if record.get("POS") is not None:
+                position.update(record["POS"], record.get("REF"))
+        return position
+    return f
+
+def concatenate_avro_files(filenames, output_file, index_file=None):
+    """
+    Writes the data blocks of the specified Avro files, in order, to the
+    specified output file under a new sync marker. Blocks are copied as
+    they are stored, without being decompressed or decoded, so the files
+    must all satisfy check_concatenable; the header of the first file
+    is written. If index_file is given, the block index of the output is
+    written to it from the entries of each file's own index. Blocks that
+    are not in an index are decoded to find their positions, and have no
+    statistics. Checkpoints are not kept, since they refer to the sources
+    of the individual files. Returns the number of records written.
+    """
+    sync = os.urandom(AVRO_SYNC_SIZE)
+    index = None
+    if index_file is not None:
+        index = IndexWriter(index_file, sync)
+    first = None
+    num_records = 0
+    try:
+        for filename in filenames:
+            with open(filename, "rb") as f:
+                meta, file_sync = read_avro_header(f)
+                if first is None:
+                    first = meta
+                    write_avro_header(output_file, meta, sync)
+                else:
+                    check_concatenable(first, meta, filename)
+                entries = {}
+                if index is not None and os.path.exists(
+                        index_file_name(filename)):
+                    index_sync, l = read_index(index_file_name(filename))
+                    if index_sync == file_sync:
+                        entries = dict((entry[0], entry) for entry in l)
+                decode_position = None
+                offset = f.tell()
+                for count, data in read_avro_blocks(f, file_sync):
+                    if index is not None:
+                        entry = entries.get(offset)
+                        if entry is not None and entry[1] == count:
+                            position, stats = entry[2], entry[3]
+                        else:
+                            if decode_position is None:
+                                decode_position = _block_position_decoder(
+                                        meta)
+                            position = decode_position(count, data)
+                            stats = None
+                        index.write(output_file.tell(), count, position,
+                                stats)
+                    write_avro_block(output_file, count, data, sync)
+                    num_records += count
+                    offset = f.tell()
+    finally:
+        if index is not None:
+            index.close()
+    return num_records
+
+
+def parse_shard_by(s):
+    """
+    Parses a shard specification of the form chrom, bp:N or records:N
+    and returns the tuple (mode, size), where size is None for chrom.
+    """
+    mode, sep, size = s.partition(":")
+    if mode not in SHARD_MODES or (mode == "chrom") == (sep != ""):
+        raise ValueError("Cannot parse shard specification: " + s)
+    if mode == "chrom":
+        return mode, None
+    try:
+        n = int(size)
+    except ValueError:
+        n = 0
+    if n <= 0:
+        raise ValueError("Invalid shard size: " + s)
+    return mode, n
+
+class ShardSet(object):
+    """
+    Class that allocates the shard files in a directory written with 
+    --shard-by, and records the record count and the regions covered 
+    by each. Shards are named after the specified prefix and numbered 
+    in order. A new shard is started whenever the key returned by 
+    get_key changes: the CHROM value, the CHROM and the N bp bin of POS,
+    or the record number divided by N.
+    """
+    def __init__(self, directory, shard_by, prefix="shard"):
+        self.__directory = directory
+        self.__prefix = prefix
+        self.__mode, self.__size = parse_shard_by(shard_by)
+        self.__num_records = 0
+        self.__shards = []
+        self.__regions = None
+
+    def get_key(self, chrom, pos):
+        """
+        Returns the key of the shard that a record with the specified 
+        CHROM and POS belongs in.
+        """
+        if self.__mode == "chrom":
+            return chrom
+        elif self.__mode == "bp":
+            return chrom, None if pos is None else (pos - 1) // self.__size
+        return self.__num_records // self.__size
+
+    def open_shard(self):
+        """
+        Starts a new shard and returns the tuple (file, index_file) 
+        giving the opened Avro file and the name of its block index.
+        """
+        name = "{0}_{1:05d}.avro".format(self.__prefix, len(self.__shards))
+        filename = os.path.join(self.__directory, name)
+        self.__regions = []
+        self.__shards.append({"file": name, "records": 0, 
+            "regions": self.__regions})
+        return open(filename, "wb"), index_file_name(filename)
+
+    def update(self, chrom, pos, ref):
+        """
+        Adds a record with the specified CHROM, POS and REF to the 
+        current shard.
+        """
+        self.__num_records += 1
+        self.__shards[-1]["records"] += 1
+        if len(self.__regions) == 0 or self.__regions[-1].chrom != chrom:
+            self.__regions.append(BlockPosition(chrom))
+        if pos is not None:
+            self.__regions[-1].update(pos, ref)
+
+    def get_shards(self):
+        """
+        Returns the list of manifest entries for the shards written, in
+        order. Each is a dictionary giving the file name relative to the
+        directory, the number of records and the list of regions covered.
+        """
+        ret = []
+        for shard in self.__shards:
+            regions = []
+            for position in shard["regions"]:
+                region = {"chrom": None if position.chrom is None 
+                        else position.chrom.decode()}
+                if position.min_pos is not None:
+                    region["start"] = position.min_pos
+                    region["end"] = position.max_end
+                regions.append(region)
+            ret.append({"file": shard["file"], "records": shard["records"],
+                "regions": regions})
+        return ret
+
+def manifest_file_name(directory):
+    """
+    Returns the name of the manifest file in the specified shard directory.
+    """
+    return os.path.join(directory, MANIFEST_FILE)
+
+def write_manifest(directory, shard_by, shards):
+    """
+    Writes the manifest for the specified list of shard entries, as 
+    returned by ShardSet.get_shards, to the specified directory.
+    """
+    manifest = {"version": MANIFEST_VERSION, "shard_by": shard_by,
+        "records": sum(shard["records"] for shard in shards), 
+        "shards": shards}
+    with open(manifest_file_name(directory), "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+
+def read_manifest(directory):
+    """
+    Reads the manifest of the specified shard directory and returns it as
+    a dictionary.
+    """
+    with open(manifest_file_name(directory)) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError("Unsupported manifest version")
+    return manifest
+
+def find_shards(directory, region=None):
+    """
+    Returns the list of the paths of the shards in the specified directory
+    that may contain records overlapping the specified region, in order.
+    All shards are returned if region is None.
+    """
+    query = None if region is None else parse_region(region)
+    ret = []
+    for shard in read_manifest(directory)["shards"]:
+        if query is not None:
+            chrom, start, end = query
+            if not any(r["chrom"] is not None and r["chrom"].encode() == chrom
+                    and "start" in r and r["start"] <= end and r["end"] >= start
+                    for r in shard["regions"]):
+                continue
+        ret.append(os.path.join(directory, shard["file"]))
+    return ret
+
+
+class RecordDecoder(object):
+    """
+    Class that decodes records in the Avro binary format written with 
+    the specified schema. As for the RecordEncoder, the schema is compiled 
+    into a list of decoding functions, one for each field. If a list of 
+    columns is specified, only those fields are materialised; the others
+    are skipped without building any values, and runs of adjacent 
+    skipped fields are merged into a single function. Dictionary encoded
+    columns are decoded using the initial values in dictionaries. 
+    """
+    def __init__(self, schema, columns=None, dictionaries={}):
+        fields = json.loads(schema)["fields"]
+        self.__dictionaries = []
+        self.__names = [f["name"] for f in fields]
+        if columns is None:
+            columns = self.__names
+        for name in columns:
+            if name not in self.__names:
+                raise ValueError("Unknown column: " + name)
+        self.__columns = [name for name in self.__names if name in columns]
+        self.__steps = []
+        skippers = []
+        for f in fields:
+            if f["name"] in columns:
+                if len(skippers) > 0:
+                    self.__steps.append((None, self.__merge(skippers)))
+                    skippers = []
+                if f["name"] in dictionaries:
+                    g = self.compile_dictionary(dictionaries[f["name"]])
+                else:
+                    g = self.compile(f["type"])
+                self.__steps.append((f["name"], g))
+            else:
+                skippers.append(self.compile_skip(f["type"]))
+        # Trailing skipped fields must still be consumed to find the 
+        # start of the next record.
+        if len(skippers) > 0:
+            self.__steps.append((None, self.__merge(skippers)))
+
+    def get_names(self):
+        """
+        Returns the list of field names in the order they are encoded.
+        """
+        return list(self.__names)
+
+    def get_columns(self):
+        """
+        Returns the list of field names materialised by this decoder.
+        """
+        return list(self.__columns)
+
+    def __merge(self, skippers):
+        """
+        Returns a single function skipping over the fields skipped by the 
+        specified list of functions.
+        """
+        if len(skippers) == 1:
+            return skippers[0]
+        def f(data, pos):
+            for g in skippers:
+                pos = g(data, pos)
+            return pos
+        return f
+
+    def compile_dictionary(self, values):
+        """
+        Returns a decoding function for a dictionary encoded column with 
+        the specified initial values.
+        """
+        values = list(values)
+        self.__dictionaries.append((values, len(values)))
+        def f(data, pos):
+            branch = data[pos] >> 1
+            pos += 1
+            if branch == 0:
+                code, pos = decode_long(data, pos)
+                return values[code], pos
+            elif branch == 1:
+                n, pos = decode_long(data, pos)
+                value = bytes(data[pos:pos + n])
+                values.append(value)
+                return value, pos + n
+            return None, pos
+        return f
+
+    def compile_skip(self, avro_type):
+        """
+        Returns a function f(data, pos) that returns the position 
+        immediately after the value of the specified Avro type starting at
+        position pos in data, without decoding it.
+        """
+        if isinstance(avro_type, dict):
+            if avro_type["type"] != "array":
+                return self.compile_skip(avro_type["type"])
+            g = self.compile_skip(avro_type["items"])
+            varint_items = avro_type["items"] in ("int", "long")
+            def f(data, pos):
+                count, pos = decode_long(data, pos)
+                while count != 0:
+                    if count < 0:
+                        # The block size lets us jump over the items. 
+                        size, pos = decode_long(data, pos)
+                        pos += size
+                    elif varint_items:
+                        pos = skip_varints(data, pos, count)
+                    else:
+                        for j in range(count):
+                            pos = g(data, pos)
+                    count, pos = decode_long(data, pos)
+                return pos
+        elif isinstance(avro_type, list):
+            branches = [self.compile_skip(t) for t in avro_type]
+            f = None
+            if len(avro_type) == 2 and avro_type[1] == "null":
+                f = self.compile_skip_nullable(avro_type[0], branches[0])
+            if f is None:
+                def f(data, pos):
+                    # Union indexes are always small, so fit in one byte.
+                    return branches[data[pos] >> 1](data, pos + 1)
+        elif avro_type in ("int", "long"):
+            def f(data, pos):
+                return skip_varints(data, pos, 1)
+        elif avro_type in ("float", "double", "boolean", "null"):
+            size = {"float": 4, "double": 8, "boolean": 1, "null": 0}[avro_type]
+            def f(data, pos):
+                return pos + size
+        elif avro_type in ("bytes", "string"):
+            def f(data, pos):
+                n, pos = decode_long(data, pos)
+                return pos + n
+        else:
+            raise ValueError("Unsupported Avro type:", avro_type)
+        return f
+
+    def compile_skip_nullable(self, avro_type, g):
+        """
+        Returns a skipping function for the union [avro_type, "null"] that 
+        avoids calling g, the skipping function for avro_type, in the 
+        common cases of the unions we generate; or None if avro_type is not 
+        one of these. Skipping over these values dominates the cost of 
+        reading a few columns from a wide file.
+        """
+        if avro_type in ("int", "long"):
+            def f(data, pos):
+                if data[pos] == 0:
+                    pos += 1
+                    while data[pos] & 0x80:
+                        pos += 1
+                return pos + 1
+        elif avro_type in ("bytes", "string"):
+            def f(data, pos):
+                if data[pos] != 0:
+                    return pos + 1
+                b = data[pos + 1]
+                if b & 0x80:
+                    return g(data, pos + 1)
+                return pos + 2 + (b >> 1)
+        elif (isinstance(avro_type, dict) and avro_type["type"] == "array"
+                and avro_type["items"] in ("int", "long")):
+            def f(data, pos):
+                if data[pos] != 0:
+                    return pos + 1
+                b = data[pos + 1]
+                if b == 0:
+                    return pos + 2
+                if b & 0x81:
+                    return g(data, pos + 1)
+                # A single block of fewer than 64 items, followed by the 
+                # terminating zero count.
+                return skip_varints(data, pos + 2, b >> 1) + 1
+        else:
+            f = None
+        return f
+
+    def compile(self, avro_type):
+        """
+        Returns a function f(data, pos) that decodes a value of the 
+        specified Avro type starting at position pos in data, and returns 
+        the tuple (value, next_position).
+        """
+        if isinstance(avro_type, dict):
+            if avro_type["type"] != "array":
+                return self.compile(avro_type["type"])
+            g = self.compile(avro_type["items"])
+            def f(data, pos):
+                value = []
+                count, pos = decode_long(data, pos)
+                while count != 0:
+                    if count < 0:
+                        count = -count
+                        size, pos = decode_long(data, pos)
+                    for j in range(count):
+                        v, pos = g(data, pos)
+                        value.append(v)
+                    count, pos = decode_long(data, pos)
+                return value, pos
+        elif isinstance(avro_type, list):
+            branches = [self.compile(t) for t in avro_type]
+            def f(data, pos):
+                index, pos = decode_long(data, pos)
+                return branches[index](data, pos)
+        elif avro_type in ("int", "long"):
+            f = decode_long
+        elif avro_type == "float":
+            unpack = struct.Struct("<f").unpack_from
+            def f(data, pos):
+                return unpack(data, pos)[0], pos + 4
+        elif avro_type == "double":
+            unpack = struct.Struct("<d").unpack_from
+            def f(data, pos):
+                return unpack(data, pos)[0], pos + 8
+        elif avro_type == "boolean":
+            def f(data, pos):
+                return data[pos] != 0, pos + 1
+        elif avro_type == "bytes":
+            def f(data, pos):
+                n, pos = decode_long(data, pos)
+                return bytes(data[pos:pos + n]), pos + n
+        elif avro_type == "string":
+            def f(data, pos):
+                n, pos = decode_long(data, pos)
+                return bytes(data[pos:pos + n]).decode(), pos + n
+        elif avro_type == "null":
+            def f(data, pos):
+                return None, pos
+        else:
+            raise ValueError("Unsupported Avro type:", avro_type)
+        return f
+
+    def decode(self, data, count):
+        """
+        Returns an iterator over the count records encoded in the specified
+        decompressed data block. Each record is a dictionary mapping field
+        names to values.
+        """
+        for values, size in self.__dictionaries:
+            del values[size:]
+        pos = 0
+        for j in range(count):
+            record = {}
+            for name, f in self.__steps:
+                if name is None:
+                    pos = f(data, pos)
+                else:
+                    record[name], pos = f(data, pos)
+            yield record
+
+
+def record_overlaps(record, chrom, start, end):
+    """
+    Returns True if the specified decoded record overlaps the region on 
+    the specified chromosome name (a str) from start to end inclusive.
+    """
+    record_chrom = record.get("CHROM")
+    if isinstance(record_chrom, bytes):
+        record_chrom = record_chrom.decode()
+    pos = record.get("POS")
+    if record_chrom != chrom or pos is None:
+        return False
+    ref = record.get("REF")
+    record_end = pos if ref is None else pos + len(ref) - 1
+    return pos <= end and record_end >= start
+
+
+class ColumnDecoder(object):
+    """
+    Class that decodes the specified columns of all the records in a 
+    data block at once. Columns of type int, long, float and double are 
+    returned as NumPy arrays of the corresponding COLUMNAR_DTYPES, with
+    nulls replaced by COLUMNAR_NULLS, and the other columns as lists of
+    values as returned by the RecordDecoder. The records are decoded by
+    the C extension module _vcf2avro if it has been built, so that no 
+    Python objects are created for the rows of the numeric columns, and 
+    by a RecordDecoder otherwise.
+    """
+    def __init__(self, schema, columns=None, dictionaries={}):
+        fields = json.loads(schema)["fields"]
+        names = [f["name"] for f in fields]
+        if columns is None:
+            columns = names
+        for name in columns:
+            if name not in names:
+                raise ValueError("Unknown column: " + name)
+        self.__columns = [name for name in names if name in columns]
+        self.__dtypes = {}
+        spec = []
+        for f in fields:
+            mode = COLUMN_SKIP
+            if f["name"] in dictionaries:
+                mode = COLUMN_DICTIONARY
+            elif get_value_type(f["type"]) in ("int", "long", "float", 
+                    "double"):
+                mode = COLUMN_FIXED
+                self.__dtypes[f["name"]] = (COLUMNAR_DTYPES[
+                    get_value_type(f["type"])], 
+                    COLUMNAR_NULLS[get_value_type(f["type"])])
+            elif f["name"] in columns:
+                mode = COLUMN_OBJECT
+            if f["name"] not in columns:
+                mode = COLUMN_SKIP
+            spec.append((f["type"], mode, dictionaries.get(f["name"])))
+        if _vcf2avro is not None:
+            self.__decoder = _vcf2avro.BlockDecoder(spec)
+        else:
+            self.__decoder = RecordDecoder(schema, columns, dictionaries)
+
+    def get_columns(self):
+        """
+        Returns the list of the decoded columns, in schema order.
+        """
+        return list(self.__columns)
+
+    def decode(self, data, count):
+        """
+        Returns a dictionary mapping the names of the decoded columns to 
+        their values in the count records in the specified decompressed 
+        data block.
+        """
+        if _vcf2avro is not None:
+            values = self.__decoder.decode(data, count)
+            ret = dict(zip(self.__columns, values))
+            for name, (dtype, null) in self.__dtypes.items():
+                if name in ret:
+                    ret[name] = np.frombuffer(ret[name], dtype=dtype)
+            return ret
+        records = list(self.__decoder.decode(data, count))
+        ret = {}
+        for name in self.__columns:
+            ret[name] = [r[name] for r in records]
+            if name in self.__dtypes:
+                dtype, null = self.__dtypes[name]
+                ret[name] = np.array([null if v is None else v 
+                    for v in ret[name]], dtype=dtype)
+        return ret
+
+
+def get_column_values(column):
+    """
+    Returns the list of values in the specified column returned by a 
+    ColumnDecoder, with None for nulls.
+    """
+    if isinstance(column, list):
+        return column
+    values = column.tolist()
+    if column.dtype.kind == "f":
+        return [None if v != v else v for v in values]
+    return [None if v == INT_MISSING else v for v in values]
+
+
+class AvroFileReader(object):
+    """
+    Class that reads records from an Avro file written by vcf2avro. If 
+    a block index for the file exists, region queries seek directly to 
+    the blocks that may contain overlapping records; otherwise the whole 
+    file is scanned.
+    """
+    def __init__(self, filename):
+        self.__file = open(filename, "rb")
+        self.__metadata, self.__sync = read_avro_header(self.__file)
+        self.__data_offset = self.__file.tell()
+        self.__schema = self.__metadata[AVRO_SCHEMA_KEY].decode()
+        codec = self.__metadata.get(AVRO_CODEC_KEY, b"null").decode()
+        self.__decompress = get_decompressor(codec)
+        self.__names = RecordDecoder(self.__schema, []).get_names()
+        self.__dictionaries = {}
+        if DICTIONARIES_KEY in self.__metadata:
+            d = json.loads(self.__metadata[DICTIONARIES_KEY].decode())
+            for name, values in d.items():
+                self.__dictionaries[name] = [v.encode() for v in values]
+        self.__index = None
+        index_file = index_file_name(filename)
+        if os.path.exists(index_file):
+            sync, entries = read_index(index_file)
+            # An index left over from a different file is ignored.
+            if sync == self.__sync:
+                self.__index = entries
+
+    def get_schema(self):
+        return self.__schema
+
+    def get_names(self):
+        """
+        Returns the list of column names in this file.
+        """
+        return list(self.__names)
+
+    def get_metadata(self):
+        return self.__metadata
+
+    def get_index(self):
+        """
+        Returns the list of (offset, records, BlockPosition) entries in the 
+        block index, or None if the file is not indexed.
+        """
+        return self.__index
+
+    def __read_block(self, offset, decompress=True):
+        """
+        Reads the data block at the specified offset and returns the tuple
+        (count, data), where data has been decompressed if requested.
+        """
+        self.__file.seek(offset)
+        count = read_long(self.__file)
+        data = self.__file.read(read_long(self.__file))
+        if self.__file.read(AVRO_SYNC_SIZE) != self.__sync:
+            raise ValueError("Avro sync marker mismatch")
+        return count, self.__decompress(data) if decompress else data
+
+    def blocks(self, region=None, filter=None, decompress=True):
+        """
+        Returns an iterator over the decompressed (count, data) tuples for 
+        the data blocks in this file. If the file is indexed, only blocks 
+        that may contain records overlapping the specified region and 
+        satisfying all the Predicates in the list filter are returned.
+        If decompress is False, the data is returned as stored, to be
+        decompressed elsewhere using get_decompressor for the file's codec.
+        """
+        if self.__index is None:
+            self.__file.seek(self.__data_offset)
+            for count, data in read_avro_blocks(self.__file, self.__sync):
+                yield count, self.__decompress(data) if decompress else data
+        else:
+            query = None if region is None else parse_region(region)
+            predicates = self.__resolve_filter(filter)
+            for offset, records, position, stats in self.__index:
+                if query is not None and not position.overlaps(*query):
+                    continue
+                if stats is not None and not all(
+                        p.may_match(stats.get(p.column)) for p in predicates):
+                    continue
+                yield self.__read_block(offset, decompress)
+
+    def __resolve_filter(self, filter):
+        """
+        Returns a list of Predicates equivalent to the specified list of 
+        Predicates or (column, op, value) tuples, with each value converted
+        to the type of its column.
+        """
+        types = {}
+        for field in json.loads(self.__schema)["fields"]:
+            types[field["name"]] = get_value_type(field["type"])
+        ret = []
+        for p in filter or []:
+            if not isinstance(p, Predicate):
+                p = Predicate(*p)
+            if p.column not in types:
+                raise ValueError("Unknown column: " + p.column)
+            t = types[p.column]
+            value = p.value
+            if t in ("int", "long", "float", "double"):
+                value = float(value)
+            elif t in ("bytes", "string"):
+                if not isinstance(value, bytes):
+                    value = str(value).encode()
+                if t == "string":
+                    value = value.decode()
+            else:
+                raise ValueError("Cannot filter on column: " + p.column)
+            ret.append(Predicate(p.column, p.op, value))
+        return ret
+
+    def records(self, region=None, columns=None, filter=None):
+        """
+        Returns an iterator over the records in this file, as dictionaries
+        mapping column names to values. If a region is specified, only 
+        the records overlapping it are returned. If a list of columns is
+        specified, only those columns are decoded and returned. If filter
+        is a list of Predicates or (column, op, value) tuples, only the 
+        records satisfying all of them are returned; blocks whose 
+        statistics show that none of their records can do so are skipped.
+        """
+        query = None 
+        needed = []
+        predicates = self.__resolve_filter(filter)
+        if region is not None:
+            chrom, start, end = parse_region(region)
+            query = chrom.decode(), start, end
+            # The position columns are needed to filter the records. 
+            needed = [name for name in ["CHROM", "POS", "REF"]
+                    if name in self.__names]
+        needed += [p.column for p in predicates]
+        extra = []
+        if columns is not None:
+            extra = [name for name in self.__names 
+                    if name in needed and name not in columns]
+            columns = list(columns) + extra
+        decoder = RecordDecoder(self.__schema, columns, self.__dictionaries)
+        for count, data in self.blocks(region, predicates):
+            for record in decoder.decode(data, count):
+                if query is not None and not self.__overlaps(record, *query):
+                    continue
+                if all(p.matches(record[p.column]) for p in predicates):
+                    for name in extra:
+                        del record[name]
+                    yield record
+
+    def column_blocks(self, region=None, columns=None, filter=None):
+        """
+        Returns an iterator over the blocks of this file, each decoded by
+        a ColumnDecoder into a dictionary mapping the specified columns 
+        (by default, all of them) to their values in the block's records. 
+        The region and filter select the records as for records(), and
+        blocks without any selected records are skipped. Requires NumPy.
+        """
+        if np is None:
+            raise ValueError("column_blocks requires NumPy")
+        query = None 
+        needed = []
+        predicates = self.__resolve_filter(filter)
+        if region is not None:
+            chrom, start, end = parse_region(region)
+            query = chrom.decode(), start, end
+            needed = [name for name in ["CHROM", "POS", "REF"]
+                    if name in self.__names]
+        needed += [p.column for p in predicates]
+        if columns is None:
+            columns = self.__names
+        columns = list(columns)
+        decoder = ColumnDecoder(self.__schema, 
+                columns + [name for name in needed if name not in columns],
+                self.__dictionaries)
+        for count, data in self.blocks(region, predicates):
+            block = decoder.decode(data, count)
+            if len(needed) > 0:
+                values = [get_column_values(block[name]) for name in needed]
+                keep = []
+                for row in zip(*values):
+                    record = dict(zip(needed, row))
+                    keep.append((query is None or 
+                        self.__overlaps(record, *query)) and 
+                        all(p.matches(record[p.column]) for p in predicates))
+                if not any(keep):
+                    continue
+                if not all(keep):
+                    mask = np.array(keep, dtype=bool)
+                    for name, column in block.items():
+                        if isinstance(column, list):
+                            block[name] = list(itertools.compress(column, 
+                                keep))
+                        else:
+                            block[name] = column[mask]
+            yield dict((name, block[name]) for name in columns)
+
+    def __overlaps(self, record, chrom, start, end):
+        return record_overlaps(record, chrom, start, end)
+
+    def close(self):
+        self.__file.close()
+
+
+def columnar_directory_name(filename):
+    """
+    Returns the name of the directory holding the columnar sidecar of the
+    specified Avro file.
+    """
+    return filename + COLUMNAR_SUFFIX
+
+def get_column_layout(avro_type):
+    """
+    Returns the tuple (item_type, depth) describing how a column of the
+    specified Avro type is stored in columnar form, where depth is the 
+    number of nested arrays holding the values: 0 for scalar columns, 1
+    for arrays and 2 for arrays of arrays, such as the per-sample lists
+    of the sample genotype layout. Raises a ValueError for types that 
+    cannot be stored.
+    """
+    t = get_value_type(avro_type)
+    depth = 0
+    while isinstance(t, dict) and t.get("type") == "array":
+        t = get_value_type(t["items"])
+        depth += 1
+    if t not in COLUMNAR_DTYPES and t not in ("bytes", "string"):
+        raise ValueError("Cannot store type {0} in columns".format(
+            json.dumps(avro_type)))
+    return t, depth
+
+def _flatten_column_values(values, depth):
+    """
+    Returns the tuple (items, lengths) for the specified list of values 
+    nested in the specified number of arrays, where items is the list of 
+    the values in all the arrays and lengths is the list of int32 arrays 
+    holding the number of items in the arrays at each level, -1 for null.
+    """
+    lengths = []
+    for j in range(depth):
+        lengths.append(np.array([-1 if v is None else len(v) 
+            for v in values], dtype="<i4"))
+        values = [x for v in values if v is not None for x in v]
+    return values, lengths
+
+def _encode_column_values(values, item_type):
+    """
+    Returns the list of streams encoding the specified list of values of
+    the specified type: an array of the values, with nulls replaced by 
+    the null value of the type, or for bytes and strings an int32 array 
+    of the lengths of the values, -1 for null, and their concatenation.
+    """
+    if item_type in COLUMNAR_DTYPES:
+        null = COLUMNAR_NULLS[item_type]
+        return [np.array([null if v is None else v for v in values], 
+            dtype=COLUMNAR_DTYPES[item_type]).tobytes()]
+    if item_type == "string":
+        values = [None if v is None else v.encode() for v in values]
+    lengths = np.array([-1 if v is None else len(v) for v in values], 
+            dtype="<i4")
+    return [lengths.tobytes(), b"".join(v for v in values if v is not None)]
+
+def _decode_column_values(streams, item_type):
+    """
+    Returns a NumPy array of the values encoded in the specified streams 
+    by _encode_column_values. Bytes and string values are returned in an
+    object array, with None for nulls.
+    """
+    if item_type in COLUMNAR_DTYPES:
+        return np.frombuffer(streams[0], dtype=COLUMNAR_DTYPES[item_type])
+    lengths = np.frombuffer(streams[0], dtype="<i4")
+    data = bytes(streams[1])
+    ends = np.cumsum(np.maximum(lengths, 0)).tolist()
+    values = np.empty(len(lengths), dtype=object)
+    start = 0
+    for j, (length, end) in enumerate(zip(lengths.tolist(), ends)):
+        if length >= 0:
+            v = data[start:end]
+            values[j] = v.decode() if item_type == "string" else v
+        start = end
+    return values
+
+
+class ColumnarWriter(object):
+    """
+    Class that writes the records to a directory holding one file for 
+    each field of the schema, for scans that only need a few columns. 
+    The rows are divided into chunks of about chunk_rows rows, which are 
+    the same for all columns. Each chunk of a column is stored as a 
+    sequence of streams, each compressed with the specified codec: for
+    array columns, an int32 array of the number of items in each array, 
+    -1 for null, for each level of nesting, followed by the streams 
+    written by _encode_column_values for the concatenated items. The 
+    index file records the number of rows in each chunk and the offset 
+    and size of each stream. Per-sample columns of VariantBatches stored
+    as int or float arrays are written without converting the values.
+    """
+    def __init__(self, directory, schema, metadata={}, codec=DEFAULT_CODEC,
+            chunk_rows=COLUMNAR_CHUNK_ROWS, stats=None):
+        fields = json.loads(schema)["fields"]
+        self.__layouts = [get_column_layout(f["type"]) for f in fields]
+        self.__directory = directory
+        self.__codec = codec
+        self.__compress = get_compressor(codec)
+        self.__chunk_rows = chunk_rows
+        self.__stats = stats
+        self.__metadata = dict((k, v.decode()) for k, v in metadata.items())
+        self.__columns = []
+        self.__files = []
+        os.mkdir(directory)
+        for j, field in enumerate(fields):
+            name = "{0:05d}.col".format(j)
+            item_type, depth = self.__layouts[j]
+            self.__columns.append({"name": field["name"], "type": item_type,
+                "depth": depth, "file": name, "chunks": []})
+            self.__files.append(open(os.path.join(directory, name), "wb"))
+        self.__chunks = []
+        self.__rows = []
+        self.__segments = [[] for f in fields]
+        self.__num_rows = 0
+
+    def set_input(self, reader):
+        """
+        Checkpoints are not recorded for columnar output.
+        """
+        pass
+
+    def append(self, record):
+        """
+        Appends the specified record.
+        """
+        self.__rows.append(record)
+        self.__num_rows += 1
+        if self.__num_rows >= self.__chunk_rows:
+            self.flush()
+
+    def append_batch(self, batch):
+        """
+        Appends the records in the specified VariantBatch.
+        """
+        if self.__stats is not None:
+            t = self.__stats.start()
+        self.__move_rows()
+        columns = list(zip(*batch.rows))
+        for j, segments in enumerate(self.__segments):
+            if j not in batch.arrays:
+                segments.append(list(columns[j]))
+                continue
+            values, missing, present, kind, converter = batch.arrays[j]
+            item_type, depth = self.__layouts[j]
+            if kind in ("int", "float") and depth == 1 and values.dtype == \
+                    np.dtype(COLUMNAR_DTYPES[item_type]):
+                lengths = np.where(present, missing.shape[1], -1)
+                segments.append((values[present].ravel(), 
+                    [lengths.astype("<i4")]))
+            else:
+                segments.append(batch.get_column(j))
+        self.__num_rows += len(batch)
+        if self.__stats is not None:
+            self.__stats.lap("encode", t)
+        if self.__num_rows >= self.__chunk_rows:
+            self.flush()
+
+    def __move_rows(self):
+        """
+        Moves the values of the rows appended individually into the 
+        segments of each column.
+        """
+        if len(self.__rows) > 0:
+            for segments, values in zip(self.__segments, zip(*self.__rows)):
+                segments.append(list(values))
+            self.__rows = []
+
+    def __encode_segments(self, segments, item_type, depth):
+        """
+        Returns the list of uncompressed streams for the specified list of 
+        segments of a column, each of which is a list of values or a 
+        tuple (items, lengths) as returned by _flatten_column_values, with
+        the items in an array of the column's NumPy type.
+        """
+        if depth == 0:
+            return _encode_column_values(
+                    list(itertools.chain.from_iterable(segments)), item_type)
+        lengths = [[] for j in range(depth)]
+        items = []
+        for segment in segments:
+            if not isinstance(segment, tuple):
+                values, segment_lengths = _flatten_column_values(segment, 
+                        depth)
+                if item_type in COLUMNAR_DTYPES:
+                    values = np.frombuffer(_encode_column_values(values, 
+                        item_type)[0], dtype=COLUMNAR_DTYPES[item_type])
+                segment = values, segment_lengths
+            items.append(segment[0])
+            for level, a in zip(lengths, segment[1]):
+                level.append(a)
+        streams = [np.concatenate(level).tobytes() for level in lengths]
+        if item_type in COLUMNAR_DTYPES:
+            streams.append(np.concatenate(items).tobytes())
+        else:
+            streams.extend(_encode_column_values(
+                list(itertools.chain.from_iterable(items)), item_type))
+        return streams
+
+    def flush(self):
+        """
+        Writes the current chunk, if it is not empty.
+        """
+        if self.__num_rows == 0:
+            return
+        self.__move_rows()
+        for column, segments, f, layout in zip(self.__columns, 
+                self.__segments, self.__files, self.__layouts):
+            if self.__stats is not None:
+                t = self.__stats.start()
+            streams = self.__encode_segments(segments, *layout)
+            del segments[:]
+            if self.__stats is not None:
+                t = self.__stats.lap("encode", t)
+            chunk = []
+            for stream in streams:
+                data = self.__compress(stream)
+                if self.__stats is not None:
+                    t = self.__stats.lap("compress", t)
+                chunk.append([f.tell(), len(data)])
+                f.write(data)
+                if self.__stats is not None:
+                    t = self.__stats.lap("write", t)
+            column["chunks"].append(chunk)
+        self.__chunks.append(self.__num_rows)
+        self.__num_rows = 0
+
+    def close(self):
+        """
+        Writes any remaining rows and the index file.
+        """
+        if self.__files is not None:
+            self.flush()
+            for f in self.__files:
+                f.close()
+            self.__files = None
+            index = {"version": COLUMNAR_VERSION, "codec": self.__codec, 
+                "num_rows": sum(self.__chunks), "chunks": self.__chunks,
+                "metadata": self.__metadata, "columns": self.__columns}
+            filename = os.path.join(self.__directory, COLUMNAR_INDEX_FILE)
+            with open(filename, "w") as f:
+                json.dump(index, f)
+
+
+class ColumnarReader(object):
+    """
+    Class that reads the columns written by a ColumnarWriter. The column
+    files are memory mapped; streams written with the null codec are 
+    returned as NumPy arrays over the mapped file without copying, and 
+    other streams are decompressed one chunk at a time.
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, COLUMNAR_INDEX_FILE)) as f:
+            self.__index = json.load(f)
+        if self.__index.get("version") != COLUMNAR_VERSION:
+            raise ValueError("Unsupported columnar version")
+        self.__directory = directory
+        self.__codec = self.__index["codec"]
+        self.__decompress = get_decompressor(self.__codec)
+        self.__columns = collections.OrderedDict(
+                (c["name"], c) for c in self.__index["columns"])
+        self.__maps = {}
+
+    def get_names(self):
+        """
+        Returns the list of column names.
+        """
+        return list(self.__columns.keys())
+
+    def get_num_rows(self):
+        """
+        Returns the total number of rows.
+        """
+        return self.__index["num_rows"]
+
+    def get_chunks(self):
+        """
+        Returns the list of the number of rows in each chunk.
+        """
+        return list(self.__index["chunks"])
+
+    def get_metadata(self):
+        """
+        Returns the VCF metadata of the Avro file written alongside the 
+        columns, as a dictionary of strings.
+        """
+        return dict(self.__index["metadata"])
+
+    def __get_column(self, name):
+        if name not in self.__columns:
+            raise ValueError("Unknown column: " + name)
+        return self.__columns[name]
+
+    def __map(self, column):
+        filename = column["file"]
+        if filename not in self.__maps:
+            path = os.path.join(self.__directory, filename)
+            if os.path.getsize(path) == 0:
+                self.__maps[filename] = b""
+            else:
+                with open(path, "rb") as f:
+                    self.__maps[filename] = mmap.mmap(f.fileno(), 0, 
+                            access=mmap.ACCESS_READ)
+        return self.__maps[filename]
+
+    def read_chunk(self, name, chunk):
+        """
+        Returns the values of the specified column in the specified chunk. 
+        Scalar columns are returned as a NumPy array, with the null values
+        INT_MISSING for integers, NaN for floats and -1 for booleans, and 
+        None for bytes and strings in an object array. Array columns are 
+        returned as the tuple (items, lengths), where items holds the 
+        concatenated items of all the rows as for scalar columns, and 
+        lengths is an array of the number of items in each row, with -1 
+        for null rows. Arrays of arrays are returned as the tuple (items,
+        lengths, item_lengths), where item_lengths holds the number of 
+        items in each of the inner arrays in the same way.
+        """
+        column = self.__get_column(name)
+        data = memoryview(self.__map(column))
+        streams = []
+        for offset, size in column["chunks"][chunk]:
+            stream = data[offset:offset + size]
+            if self.__codec != "null":
+                stream = self.__decompress(stream)
+            streams.append(stream)
+        depth = column["depth"]
+        values = _decode_column_values(streams[depth:], column["type"])
+        if depth > 0:
+            return (values,) + tuple(np.frombuffer(stream, dtype="<i4") 
+                    for stream in streams[:depth])
+        return values
+
+    def read_column(self, name):
+        """
+        Returns the values of the specified column in all rows, in the form
+        described in read_chunk.
+        """
+        column = self.__get_column(name)
+        chunks = [self.read_chunk(name, j) 
+                for j in range(len(column["chunks"]))]
+        if len(chunks) == 1:
+            return chunks[0]
+        if len(chunks) == 0:
+            item_type = column["type"]
+            values = np.empty(0, dtype=COLUMNAR_DTYPES.get(item_type, object))
+            lengths = np.empty(0, dtype="<i4")
+            if column["depth"] > 0:
+                return (values,) + (lengths,) * column["depth"]
+            return values
+        if column["depth"] > 0:
+            return tuple(np.concatenate(parts) for parts in zip(*chunks))
+        return np.concatenate(chunks)
+
+    def close(self):
+        """
+        Closes the memory mapped files. Arrays returned without copying 
+        must not be used after this.
+        """
+        for m in self.__maps.values():
+            if isinstance(m, mmap.mmap):
+                try:
+                    m.close()
+                except BufferError:
+                    # Arrays over the mapping still exist; it is closed 
+                    # when they are garbage collected.
+                    pass
+        self.__maps = {}
+
+
+class TeeWriter(object):
+    """
+    Class that appends the records to each of a list of writers.
+    """
+    def __init__(self, writers):
+        self.__writers = writers
+
+    def set_input(self, reader):
+        for writer in self.__writers:
+            writer.set_input(reader)
+
+    def append(self, record):
+        for writer in self.__writers:
+            writer.append(record)
+
+    def append_batch(self, batch):
+        for writer in self.__writers:
+            writer.append_batch(batch)
+
+    def close(self):
+        for writer in self.__writers:
+            writer.close()
+
+
+# BGZF constants
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+BGZF_HEADER_SIZE = 12
+BGZF_THREADS = 4
+BGZF_READ_AHEAD = 64
+BGZF_MAX_BLOCK_SIZE = 64 * 1024
+# The maximum amount of data compressed into a block by bgzf_compress, 
+# as in htslib, so that the compressed block always fits.
+BGZF_MAX_INPUT_SIZE = 0xff00
+BGZF_EOF = binascii.unhexlify(
+        "1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+def is_bgzf(filename):
+    """
+    Returns True if the specified file is BGZF compressed.
+    """
+    with open(filename, "rb") as f:
+        header = f.read(18)
+    return (len(header) == 18 and header[:4] == BGZF_MAGIC 
+            and header[12:14] == b"BC")
 
-VCF_FIXED_COLUMNS = [CHROM_NAME, POS_NAME, ID_NAME, REF_NAME, ALT_NAME, 
-        QUAL_NAME, FILTER_NAME]
+def _inflate_bgzf_block(data):
+    """
+    Decompresses the deflated payload of a BGZF block. This is run in the
+    worker threads of a BGZFReader; zlib releases the GIL while it works.
+    """
+    s = zlib.decompress(data[:-8], -15)
+    size = struct.unpack("<I", data[-4:])[0]
+    if len(s) != size:
+        raise ValueError("Corrupt BGZF block")
+    return s
 
-# Descriptions taken from 
-# http://www.1000genomes.org/wiki/Analysis/Variant%20Call%20Format/vcf-variant-call-format-version-41 
-CHROM_DESCRIPTION = b"""chromosome: an identifier from the reference genome or an \
-angle-bracketed ID String ("<ID>") pointing to a contig in the assembly file"""
-POS_DESCRIPTION = b"""position: The reference position, with the 1st base having \
-position 1"""
-ID_DESCRIPTION = b"""semi-colon separated list of unique identifiers where \
-available"""
-REF_DESCRIPTION = b"""reference base(s): Each base must be one of A,C,G,T,N \
-(case insensitive)""" 
-ALT_DESCRIPTION = b"""comma separated list of alternate non-reference alleles\
-called on at least one of the samples"""
-QUAL_DESCRIPTION = b"""phred-scaled quality score for the assertion made in \
-ALT. i.e. -10log_10 prob(call in ALT is wrong)."""
-FILTER_DESCRIPTION = b"""PASS if this position has passed all filters, i.e. \
-a call is made at this position. Otherwise, if the site has not passed all \
-filters, a semicolon-separated list of codes for filters that fail. """
+class BGZFReader(object):
+    """
+    A file-like object for reading BGZF compressed files. Compressed blocks
+    are read ahead of the current position and decompressed in parallel 
+    by a pool of threads. Positions returned by tell and accepted by 
+    seek are BGZF virtual offsets, i.e., the file offset of the start of 
+    the compressed block shifted left by 16 bits plus the offset within 
+    the uncompressed block.
+    """
+    def __init__(self, filename, num_threads=BGZF_THREADS, 
+            read_ahead=BGZF_READ_AHEAD):
+        self.fileobj = open(filename, "rb")
+        self.__executor = concurrent.futures.ThreadPoolExecutor(num_threads)
+        self.__read_ahead = read_ahead 
+        self.__pending = collections.deque()
+        self.__block_offset = 0
+        self.__buffer = b""
+        self.__buffer_pos = 0
+        self.__stats = None
 
-# char used to seperate VCF columns from their prefix, e.g INFO.AF
-COLUMN_SEPARATOR = b"_"
+    def set_stats(self, stats):
+        """
+        Records the time spent decompressing blocks in the specified 
+        ConversionStats.
+        """
+        self.__stats = stats
 
-# Special values in VCF
-MISSING_VALUE = b"."
+    def __timed_inflate(self, data):
+        t = self.__stats.start()
+        s = _inflate_bgzf_block(data)
+        self.__stats.lap("decompress", t)
+        return s
 
-# Strings used in the header for identifiers
-ID = b"ID"
-INFO = b"INFO"
-DESCRIPTION = b"Description"
-NUMBER = b"Number"
-TYPE = b"Type"
-INTEGER = b"Integer"
-FLOAT = b"Float"
-FLAG = b"Flag"
-CHARACTER = b"Character"
-STRING = b"String"
+    def __read_raw_block(self):
+        """
+        Reads the next compressed block from the underlying file and returns
+        the tuple (file_offset, payload), or None at the end of the file.
+        """
+        offset = self.fileobj.tell()
+        header = self.fileobj.read(BGZF_HEADER_SIZE)
+        if len(header) == 0:
+            return None
+        if len(header) != BGZF_HEADER_SIZE or header[:4] != BGZF_MAGIC:
+            raise ValueError("Not a BGZF file")
+        xlen = struct.unpack("<H", header[10:])[0]
+        extra = self.fileobj.read(xlen)
+        block_size = None
+        j = 0
+        while j < xlen:
+            slen = struct.unpack("<H", extra[j + 2: j + 4])[0]
+            if extra[j: j + 2] == b"BC":
+                block_size = struct.unpack("<H", extra[j + 4: j + 6])[0] + 1
+            j += 4 + slen
+        if block_size is None:
+            raise ValueError("Missing BGZF block size")
+        data = self.fileobj.read(block_size - BGZF_HEADER_SIZE - xlen)
+        return offset, data
+
+    def __next_block(self):
+        """
+        Makes the next decompressed block the current buffer, scheduling
+        decompression of blocks further ahead. Returns False at the end 
+        of the file.
+        """
+        while len(self.__pending) < self.__read_ahead:
+            raw = self.__read_raw_block()
+            if raw is None:
+                break
+            inflate = _inflate_bgzf_block
+            if self.__stats is not None:
+                inflate = self.__timed_inflate
+            future = self.__executor.submit(inflate, raw[1])
+            self.__pending.append((raw[0], future))
+        if len(self.__pending) == 0:
+            return False
+        offset, future = self.__pending.popleft()
+        self.__block_offset = offset
+        self.__buffer = future.result()
+        self.__buffer_pos = 0
+        return True
+
+    def set_read_ahead(self, read_ahead):
+        """
+        Sets the number of blocks that are read and decompressed ahead of
+        the current position.
+        """
+        self.__read_ahead = read_ahead
+
+    def tell(self):
+        """
+        Returns the virtual offset of the next byte to be read.
+        """
+        if self.__buffer_pos == len(self.__buffer) and len(self.__pending) > 0:
+            return self.__pending[0][0] << 16
+        return (self.__block_offset << 16) | self.__buffer_pos
+
+    def seek_uncompressed(self, offset):
+        """
+        Seeks to the specified offset in the uncompressed data. The 
+        compressed blocks before it are skipped using the uncompressed 
+        size recorded at the end of each, without decompressing them.
+        """
+        self.fileobj.seek(0)
+        position = 0
+        while True:
+            block_offset = self.fileobj.tell()
+            raw = self.__read_raw_block()
+            if raw is None:
+                break
+            size = struct.unpack("<I", raw[1][-4:])[0]
+            if position + size > offset:
+                break
+            position += size
+        self.seek((block_offset << 16) | (offset - position))
+
+    def seek(self, virtual_offset):
+        """
+        Seeks to the specified virtual offset.
+        """
+        for offset, future in self.__pending:
+            future.cancel()
+        self.__pending.clear()
+        self.fileobj.seek(virtual_offset >> 16)
+        self.__buffer = b""
+        self.__buffer_pos = 0
+        self.__block_offset = virtual_offset >> 16
+        if self.__next_block():
+            self.__buffer_pos = virtual_offset & 0xFFFF
+
+    def read(self, size=-1):
+        """
+        Reads up to size bytes, or until the end of the file if size is 
+        negative.
+        """
+        pieces = []
+        while size != 0:
+            if self.__buffer_pos == len(self.__buffer):
+                if not self.__next_block():
+                    break
+                continue
+            end = len(self.__buffer)
+            if size > 0:
+                end = min(end, self.__buffer_pos + size)
+                size -= end - self.__buffer_pos
+            pieces.append(self.__buffer[self.__buffer_pos:end])
+            self.__buffer_pos = end
+        return b"".join(pieces)
+
+    def readline(self):
+        """
+        Reads and returns the next line, including the trailing newline.
+        """
+        pieces = []
+        while True:
+            if self.__buffer_pos == len(self.__buffer):
+                if not self.__next_block():
+                    break
+                continue
+            k = self.__buffer.find(b"\n", self.__buffer_pos)
+            if k >= 0:
+                pieces.append(self.__buffer[self.__buffer_pos:k + 1])
+                self.__buffer_pos = k + 1
+                break
+            pieces.append(self.__buffer[self.__buffer_pos:])
+            self.__buffer_pos = len(self.__buffer)
+        return b"".join(pieces)
+
+    def __iter__(self):
+        s = self.readline()
+        while s:
+            yield s
+            s = self.readline()
+
+    def close(self):
+        """
+        Closes the underlying file and shuts down the decompression threads.
+        """
+        for offset, future in self.__pending:
+            future.cancel()
+        self.__pending.clear()
+        self.__executor.shutdown()
+        self.fileobj.close()
+
+
+def bgzf_compress(data, level=zlib.Z_DEFAULT_COMPRESSION):
+    """
+    Returns the specified data compressed as a sequence of complete BGZF 
+    blocks, which can be concatenated with the blocks for other data. 
+    The BGZF_EOF block must be written at the end of the file.
+    """
+    blocks = []
+    view = memoryview(data)
+    for start in range(0, len(view), BGZF_MAX_INPUT_SIZE):
+        chunk = view[start:start + BGZF_MAX_INPUT_SIZE]
+        c = zlib.compressobj(level, zlib.DEFLATED, -15)
+        payload = c.compress(chunk) + c.flush()
+        # The header has the gzip magic, the FEXTRA flag, no mtime, the 
+        # unknown OS, and the BC extra subfield holding the block size - 1.
+        header = BGZF_MAGIC + struct.pack("<IBBHBBHH", 0, 0, 0xff, 6, 
+                ord("B"), ord("C"), 2, 
+                BGZF_HEADER_SIZE + 6 + len(payload) + 8 - 1)
+        blocks.append(header + payload + struct.pack("<II", 
+            zlib.crc32(chunk) & 0xffffffff, len(chunk)))
+    return b"".join(blocks)
+
+
+def reg2bins(beg, end, min_shift, depth):
+    """
+    Returns the list of bins that may overlap the zero-based half open 
+    interval [beg, end) in a binning index with the specified parameters.
+    """
+    bins = []
+    end -= 1
+    s = min_shift + depth * 3
+    t = 0
+    for l in range(depth + 1):
+        bins.extend(range(t + (beg >> s), t + (end >> s) + 1))
+        s -= 3
+        t += 1 << (l * 3)
+    return bins
+
+class TabixIndex(object):
+    """
+    Class representing a tabix (.tbi) or CSI (.csi) index of a BGZF 
+    compressed VCF file.
+    """
+    def __init__(self, index_file):
+        with gzip.open(index_file, "rb") as f:
+            self.__data = f.read()
+        self.__pos = 0
+        magic = self.__data[:4]
+        self.__pos = 4
+        self.__names = []
+        if magic == b"TBI\x01":
+            self.__min_shift = 14
+            self.__depth = 5
+            self.__read_names()
+            self.__read_tbi_refs()
+        elif magic == b"CSI\x01":
+            self.__min_shift, self.__depth, l_aux = self.__unpack("<3i")
+            aux_end = self.__pos + l_aux
+            # The sequence names are optional in CSI, but we cannot map
+            # a region to a reference without them.
+            if l_aux == 0:
+                raise ValueError("CSI index has no sequence names")
+            self.__read_names()
+            self.__pos = aux_end
+            self.__read_csi_refs()
+        else:
+            raise ValueError("Unknown index format")
+        self.__data = None
+
+    def __unpack(self, fmt):
+        ret = struct.unpack_from(fmt, self.__data, self.__pos)
+        self.__pos += struct.calcsize(fmt)
+        return ret
+
+    def __read_names(self):
+        if self.__data[:4] == b"TBI\x01":
+            n_ref, = self.__unpack("<i")
+        fmt, col_seq, col_beg, col_end, meta, skip, l_nm = self.__unpack("<7i")
+        names = self.__data[self.__pos: self.__pos + l_nm]
+        self.__pos += l_nm
+        self.__names = names.rstrip(b"\0").split(b"\0")
+
+    def __read_chunks(self):
+        n_chunk, = self.__unpack("<i")
+        chunks = self.__unpack("<{0}Q".format(2 * n_chunk))
+        return list(zip(chunks[0::2], chunks[1::2]))
+
+    def __read_tbi_refs(self):
+        self.__bins = []
+        self.__linear = []
+        for name in self.__names:
+            n_bin, = self.__unpack("<i")
+            bins = {}
+            for j in range(n_bin):
+                b, = self.__unpack("<I")
+                bins[b] = self.__read_chunks()
+            n_intv, = self.__unpack("<i")
+            self.__bins.append(bins)
+            self.__linear.append(self.__unpack("<{0}Q".format(n_intv)))
+
+    def __read_csi_refs(self):
+        n_ref, = self.__unpack("<i")
+        self.__bins = []
+        self.__linear = []
+        for j in range(n_ref):
+            n_bin, = self.__unpack("<i")
+            bins = {}
+            for k in range(n_bin):
+                b, loffset = self.__unpack("<IQ")
+                bins[b] = self.__read_chunks()
+            self.__bins.append(bins)
+            self.__linear.append(())
+
+    def get_names(self):
+        """
+        Returns the list of reference sequence names in this index.
+        """
+        return list(self.__names)
+
+    def query(self, chrom, start, end):
+        """
+        Returns a sorted list of non-overlapping (start, end) virtual offset
+        chunks that contain all records on the specified chromosome that 
+        overlap the one-based closed interval [start, end].
+        """
+        if chrom not in self.__names:
+            return []
+        j = self.__names.index(chrom)
+        beg = max(0, start - 1)
+        end = min(end, 2**(self.__min_shift + 3 * self.__depth))
+        min_offset = 0
+        linear = self.__linear[j]
+        if len(linear) > 0:
+            min_offset = linear[min(beg >> self.__min_shift, len(linear) - 1)]
+        chunks = []
+        for b in reg2bins(beg, end, self.__min_shift, self.__depth):
+            for chunk in self.__bins[j].get(b, []):
+                if chunk[1] > min_offset:
+                    chunks.append(chunk)
+        chunks.sort()
+        merged = []
+        for cbeg, cend in chunks:
+            if len(merged) > 0 and cbeg <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], cend))
+            else:
+                merged.append((cbeg, cend))
+        return merged
+
+def find_index(filename):
+    """
+    Returns the path of the tabix or CSI index for the specified file, or 
+    None if there is no index.
+    """
+    for suffix in [".tbi", ".csi"]:
+        if os.path.exists(filename + suffix):
+            return filename + suffix
+    return None
+
+def parse_region(region):
+    """
+    Parses a region string of the form chrom, chrom:start or 
+    chrom:start-end, with one-based inclusive coordinates, and returns 
+    the tuple (chrom, start, end) with chrom as bytes.
+    """
+    chrom = region
+    start = 1
+    end = 2**31 - 1
+    k = region.rfind(":")
+    if k >= 0:
+        tokens = region[k + 1:].replace(",", "").split("-")
+        try:
+            start = int(tokens[0])
+            if len(tokens) == 2 and tokens[1] != "":
+                end = int(tokens[1])
+            chrom = region[:k]
+        except ValueError:
+            pass
+    return chrom.encode(), start, end
+
+
+class ConversionStats(object):
+    """
+    Class accumulating the wall clock and CPU time spent in each stage of 
+    a conversion, along with the numbers of rows and bytes processed. CPU 
+    time is measured for the thread doing the work, so that the times of 
+    stages running in parallel can be compared. Stages are timed using 
+    start and lap:
+
+        t = stats.start()
+        ...
+        t = stats.lap("tokenize", t)
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__stages = collections.OrderedDict()
+        for stage in STATS_STAGES:
+            self.__stages[stage] = [0.0, 0.0]
+        self.__start_time = time.time()
+        self.__start_cpu = time.process_time()
+        self.rows = 0
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.__reporter = None
+        self.__stop = threading.Event()
+
+    def start(self):
+        """
+        Returns the current (wall, cpu) times for use with lap.
+        """
+        return time.perf_counter(), time.thread_time()
+
+    def lap(self, stage, t):
+        """
+        Adds the time since the specified start time to the specified stage
+        and returns the current time.
+        """
+        now = time.perf_counter(), time.thread_time()
+        self.add(stage, now[0] - t[0], now[1] - t[1])
+        return now
+
+    def add(self, stage, wall, cpu):
+        """
+        Adds the specified wall clock and CPU times to the specified stage.
+        """
+        with self.__lock:
+            times = self.__stages.setdefault(stage, [0.0, 0.0])
+            times[0] += wall
+            times[1] += cpu
+
+    def merge(self, report):
+        """
+        Adds the stage times, rows and bytes from the specified report,
+        returned by another ConversionStats, to this one.
+        """
+        for stage, d in report["stages"].items():
+            self.add(stage, d["wall_seconds"], d["cpu_seconds"])
+        with self.__lock:
+            self.rows += report["rows"]
+            self.input_bytes += report["input_bytes"]
+
+    def report(self):
+        """
+        Returns a dictionary describing the statistics so far, suitable for
+        encoding as JSON.
+        """
+        elapsed = time.time() - self.__start_time
+        with self.__lock:
+            stages = collections.OrderedDict()
+            for stage, (wall, cpu) in self.__stages.items():
+                stages[stage] = {"wall_seconds": wall, "cpu_seconds": cpu}
+        d = collections.OrderedDict()
+        d["elapsed_seconds"] = elapsed
+        d["cpu_seconds"] = time.process_time() - self.__start_cpu
+        if resource is not None:
+            # Include the CPU time of worker processes that have finished.
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            d["cpu_seconds"] += usage.ru_utime + usage.ru_stime
+        d["rows"] = self.rows
+        d["rows_per_sec"] = self.rows / elapsed if elapsed > 0 else 0.0
+        d["input_bytes"] = self.input_bytes
+        d["output_bytes"] = self.output_bytes
+        d["peak_rss_bytes"] = None
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux; we include any worker 
+            # processes that have finished.
+            rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+            d["peak_rss_bytes"] = rss * 1024
+        d["stages"] = stages
+        return d
+
+    def write_report(self, f, final=False):
+        """
+        Writes the current report to the specified file as a line of JSON.
+        """
+        d = self.report()
+        d["final"] = final
+        f.write(json.dumps(d) + "\n")
+        f.flush()
+
+    def start_reporting(self, f, interval):
+        """
+        Starts a thread writing a report to the specified file every 
+        interval seconds until stop_reporting is called.
+        """
+        def run():
+            while not self.__stop.wait(interval):
+                self.write_report(f)
+        self.__reporter = threading.Thread(target=run)
+        self.__reporter.daemon = True
+        self.__reporter.start()
+
+    def stop_reporting(self):
+        if self.__reporter is not None:
+            self.__stop.set()
+            self.__reporter.join()
+            self.__reporter = None
 
-VARIABLE_SIZE = 0 
 
 class ProgressMonitor(object):
     """
@@ -106,7 +3029,7 @@ class ProgressMonitor(object):
         self.__progress_width = 40
         self.__bar_index = 0
         self.__bars = "/-\\|"
-        self.__start_time = time.clock()
+        self.__start_time = time.time()
 
     def update(self, processed):
         """
@@ -118,7 +3041,7 @@ class ProgressMonitor(object):
         spaces = self.__progress_width - filled 
         bar = self.__bars[self.__bar_index]
         self.__bar_index = (self.__bar_index + 1) % len(self.__bars)
-        elapsed = max(1, time.clock() - self.__start_time)
+        elapsed = max(1, time.time() - self.__start_time)
         rate = processed / elapsed
         s = '\r[{0}{1}] {2:5.1f}% @{3:8.1E} {4}/s {5}'.format('#' * filled, 
             ' ' * spaces, complete * 100, rate, self.__units, bar)
@@ -138,7 +3061,8 @@ class FileReader(object):
     A class for reading data files from a variety of sources and 
     with progress updating.
     """
-    def __init__(self, in_file):
+    def __init__(self, in_file, num_threads=BGZF_THREADS):
+        self.__index = None
         if in_file == '-':
             self.__input_file = sys.stdin
             if sys.version_info[:2] >= (3, 1):
@@ -153,18 +3077,13 @@ class FileReader(object):
             self.__input_file_size = None
             self.__progress_file = None
         else:
-            if in_file.endswith(".gz"):
-                # Detect broken GZIP handling in 2.7/3.2 and others and abort
-                # TODO this has been fixed upstream and can be removed at 
-                # some point.
-                f = gzip.open(in_file, "rb")
-                try:
-                    s = f.readline()
-                except Exception as e:
-                    print(BROKEN_GZIP_MESSAGE)
-                    sys.exit(1)
-                f.close() 
-                # Carry on as before
+            if is_bgzf(in_file):
+                self.__input_file = BGZFReader(in_file, num_threads)
+                self.__progress_file = self.__input_file.fileobj
+                index_file = find_index(in_file)
+                if index_file is not None:
+                    self.__index = TabixIndex(index_file)
+            elif in_file.endswith(".gz"):
                 self.__input_file = gzip.open(in_file, "rb")
                 self.__progress_file = self.__input_file.fileobj
             else:
@@ -174,6 +3093,261 @@ class FileReader(object):
             self.__input_file_size = statinfo.st_size 
         self.__progress_update_rows = 2**32 
         self.__progress_monitor = None
+        self.__range_end = None
+        self.__line_offset = 0
+        self.__chunks = None
+        self.__buffer_size = None
+        self.__stats = None
+
+    def set_stats(self, stats):
+        """
+        Records the time spent reading and decompressing the input, and the
+        number of bytes read, in the specified ConversionStats.
+        """
+        self.__stats = stats
+        if isinstance(self.__input_file, BGZFReader):
+            self.__input_file.set_stats(stats)
+
+    def get_stats(self):
+        """
+        Returns the ConversionStats for this reader, or None.
+        """
+        return self.__stats
+
+    def set_buffer_size(self, buffer_size):
+        """
+        Reads lines in a background thread, which runs ahead of the 
+        consumer by at most buffer_size bytes of lines. The same amount is
+        used for the blocks decompressed ahead of time for BGZF input.
+        """
+        self.__buffer_size = buffer_size
+        if isinstance(self.__input_file, BGZFReader):
+            self.__input_file.set_read_ahead(
+                    max(1, buffer_size // BGZF_MAX_BLOCK_SIZE))
+
+    def get_index(self):
+        """
+        Returns the TabixIndex for the input file, or None if the input 
+        is not indexed.
+        """
+        return self.__index
+
+    def set_chunks(self, chunks):
+        """
+        Restricts the lines returned by this reader to those beginning within
+        the specified list of (start, end) virtual offset chunks.
+        """
+        self.__chunks = chunks
+
+    def is_seekable(self):
+        """
+        Returns True if we can seek to arbitrary byte offsets within 
+        the input of this reader. 
+        """
+        return self.__progress_file is self.__input_file
+
+    def get_input_file_size(self):
+        """
+        Returns the size of the input file in bytes, or None if it is not 
+        known.
+        """
+        return self.__input_file_size
+
+    def set_range(self, start, end):
+        """
+        Restricts the lines returned by this reader to those beginning within
+        the byte range [start, end). The start offset must be the beginning 
+        of a line.
+        """
+        self.__input_file.seek(start)
+        self.__line_offset = start
+        self.__range_end = end
+
+    def get_input_offset(self):
+        """
+        Returns the offset in the uncompressed input of the end of the last
+        line returned by readline or lines, or None if the lines are 
+        restricted to a list of chunks and so are not contiguous.
+        """
+        if self.__chunks is not None:
+            return None
+        return self.__line_offset
+
+    def seek_input(self, offset):
+        """
+        Seeks to the specified offset in the uncompressed input, as 
+        returned by get_input_offset. This must be the start of a line.
+        """
+        f = self.__input_file
+        if isinstance(f, BGZFReader):
+            f.seek_uncompressed(offset)
+        elif self.__input_file_size is None:
+            raise ValueError("Cannot seek in standard input")
+        else:
+            f.seek(offset)
+        self.__line_offset = offset
+
+    def readline(self):
+        """
+        Reads and returns the next line of the input directly, without 
+        any buffering.
+        """
+        s = self.__input_file.readline()
+        self.__line_offset += len(s)
+        return s
+
+    def lines(self):
+        """
+        Returns an iterator over the remaining lines in the input file, 
+        respecting any range set using set_range.
+        """
+        if self.__buffer_size is None:
+            return self.__counted_lines(self.__read_lines())
+        return self.__buffered_lines()
+
+    def __counted_lines(self, lines):
+        for s in lines:
+            self.__line_offset += len(s)
+            yield s
+
+    def line_spans(self, max_lines):
+        """
+        Returns an iterator over the remaining lines of a plain, 
+        uncompressed input file, which is memory mapped rather than read. 
+        Each item is the tuple (data, starts, ends) for at most max_lines
+        lines, where data is a NumPy uint8 array over the whole file and 
+        starts and ends are arrays of the offsets of the lines, excluding 
+        the line terminators. Empty lines are skipped. Returns None if 
+        the input cannot be memory mapped.
+        """
+        if (np is None or not self.is_seekable() or self.__chunks is not None
+                or not self.__input_file_size):
+            return None
+        m = mmap.mmap(self.__input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.__mapped_lines(np.frombuffer(m, dtype=np.uint8), 
+                max_lines)
+
+    def __mapped_lines(self, data, max_lines):
+        f = self.__input_file
+        size = len(data)
+        pos = f.tell()
+        end = size if self.__range_end is None else min(self.__range_end, size)
+        stats = self.__stats
+        while pos < end:
+            if stats is not None:
+                t = stats.start()
+            found = []
+            num_found = 0
+            scan = pos
+            while num_found < max_lines and scan < size:
+                newlines = np.flatnonzero(
+                        data[scan:scan + LINE_CHUNK_SIZE] == 10) + scan
+                found.append(newlines)
+                num_found += len(newlines)
+                scan += LINE_CHUNK_SIZE
+            ends = np.concatenate(found)[:max_lines]
+            if len(ends) < max_lines and (len(ends) == 0 or ends[-1] < size - 1):
+                # The last line has no newline.
+                ends = np.append(ends, size)
+            starts = np.empty_like(ends)
+            starts[0] = pos
+            starts[1:] = ends[:-1] + 1
+            keep = starts < end
+            starts = starts[keep]
+            ends = ends[keep]
+            pos = min(int(ends[-1]) + 1, size)
+            if stats is not None:
+                stats.lap("read", t)
+                stats.input_bytes += pos - int(starts[0])
+            ends -= data[np.maximum(ends - 1, 0)] == 13
+            nonempty = ends > starts
+            self.__line_offset = pos
+            # Keep the file position up to date for the progress monitor.
+            f.seek(pos)
+            yield data, starts[nonempty], ends[nonempty]
+
+    def __buffered_lines(self):
+        """
+        Returns an iterator over the lines read by a background thread in 
+        chunks, subject to the buffer size.
+        """
+        budget = ByteBudget(self.__buffer_size)
+        chunks = queue.Queue()
+        chunk_size = max(1, min(LINE_CHUNK_SIZE, self.__buffer_size // 4))
+        stats = self.__stats
+        def read_chunks():
+            try:
+                chunk = []
+                size = 0
+                if stats is not None:
+                    t = stats.start()
+                for s in self.__read_lines():
+                    chunk.append(s)
+                    size += len(s)
+                    if size >= chunk_size:
+                        if stats is not None:
+                            stats.lap("read", t)
+                            stats.input_bytes += size
+                        if not budget.acquire(size):
+                            return
+                        chunks.put((chunk, size))
+                        chunk = []
+                        size = 0
+                        if stats is not None:
+                            t = stats.start()
+                if stats is not None:
+                    stats.lap("read", t)
+                    stats.input_bytes += size
+                budget.acquire(size)
+                chunks.put((chunk, size))
+                chunks.put(None)
+            except Exception as e:
+                chunks.put(e)
+        thread = threading.Thread(target=read_chunks)
+        thread.daemon = True
+        thread.start()
+        try:
+            item = chunks.get()
+            while item is not None:
+                if isinstance(item, Exception):
+                    raise item
+                chunk, size = item
+                for s in chunk:
+                    self.__line_offset += len(s)
+                    yield s
+                budget.release(size)
+                item = chunks.get()
+        finally:
+            # If we stop early the reader thread must be allowed to finish 
+            # before anything else uses the input file.
+            budget.close()
+            thread.join()
+
+    def __read_lines(self):
+        """
+        Returns an iterator over the remaining lines in the input file, 
+        respecting any range or chunks that have been set.
+        """
+        f = self.__input_file
+        if self.__chunks is not None:
+            for start, end in self.__chunks:
+                f.seek(start)
+                while f.tell() < end:
+                    s = f.readline()
+                    if len(s) == 0:
+                        break
+                    yield s
+        elif self.__range_end is None:
+            for s in f:
+                yield s
+        else:
+            offset = f.tell()
+            end = self.__range_end
+            for s in f:
+                if offset >= end:
+                    break
+                offset += len(s)
+                yield s
 
     def get_progress_update_rows(self):
         """
@@ -235,15 +3409,239 @@ class FileReader(object):
 
  
 
-class VCFReader(FileReader):
-    """
-    A class for reading VCF files. 
-    """
-    def __init__(self, vcf_file):
-        super(VCFReader, self).__init__(vcf_file)
-        self.__genotypes = []
-        self.__truncate = False
-        self.read_header()
+class VCFReader(FileReader):
+    """
+    A class for reading VCF files. 
+    """
+    def __init__(self, vcf_file, num_threads=BGZF_THREADS):
+        super(VCFReader, self).__init__(vcf_file, num_threads)
+        self.__genotypes = []
+        self.__truncate = False
+        self.__region = None
+        self.__skip_lines = 0
+        self.__memory_map = False
+        self.__layout = COLUMN_LAYOUT
+        self.__gt_encoding = STRING_GT_ENCODING
+        self.__info_include = None
+        self.__info_exclude = set()
+        self.__format_keys = None
+        self.__sample_columns = None
+        self.__max_split = -1
+        self.__dictionary_encoding = False
+        self.__compute_stats = False
+        self.__schema_cache = None
+        self.__fields = None
+        self.read_header()
+        self.__all_genotypes = self.__genotypes
+
+    def set_genotype_layout(self, layout):
+        """
+        Sets the layout used for genotype columns in the schema to either
+        COLUMN_LAYOUT or SAMPLE_LAYOUT. 
+        """
+        if layout not in GENOTYPE_LAYOUTS:
+            raise ValueError("Unknown genotype layout:", layout)
+        self.__layout = layout
+
+    def set_gt_encoding(self, encoding):
+        """
+        Sets the encoding used for the GT column to either 
+        STRING_GT_ENCODING or PACKED_GT_ENCODING. The packed encoding is 
+        only used in the sample genotype layout.
+        """
+        if encoding not in GT_ENCODINGS:
+            raise ValueError("Unknown GT encoding:", encoding)
+        self.__gt_encoding = encoding
+
+    def set_dictionary_encoding(self, dictionary_encoding):
+        """
+        If true, the DICTIONARY_COLUMNS are dictionary encoded, with initial
+        dictionaries taken from the ##contig and ##FILTER header lines.
+        """
+        self.__dictionary_encoding = dictionary_encoding
+
+    def set_compute_stats(self, compute_stats):
+        """
+        If true, the STATS_COLUMNS are added to the schema, to be filled in
+        by a GenotypeStats.
+        """
+        self.__compute_stats = compute_stats
+
+    def get_dictionaries(self):
+        """
+        Returns a dictionary mapping the names of the dictionary encoded 
+        columns to their initial lists of values. 
+        """
+        d = {}
+        if self.__dictionary_encoding:
+            filters = [b"PASS"] + [f for f in self.__header_ids(b"##FILTER")
+                    if f != b"PASS"]
+            d = {
+                CHROM_NAME: self.__header_ids(b"##contig"),
+                REF_NAME: list(DICTIONARY_BASES),
+                ALT_NAME: list(DICTIONARY_BASES),
+                FILTER_NAME: filters}
+        return d
+
+    def __header_ids(self, prefix):
+        """
+        Returns the list of IDs declared in the header lines starting with 
+        the specified prefix.
+        """
+        return [get_header_id(s) for s in self.__header if s.startswith(prefix)]
+
+    def set_info_keys(self, include=None, exclude=None):
+        """
+        Restricts the INFO columns in the schema to the keys in the list 
+        include, if specified, and removes the keys in the list exclude. 
+        Raises a ValueError if a key is not declared in the header.
+        """
+        declared = self.__header_ids(b"##INFO")
+        for key in (include or []) + (exclude or []):
+            if key not in declared:
+                raise ValueError("Unknown INFO key: " + key.decode())
+        self.__info_include = None if include is None else set(include)
+        self.__info_exclude = set(exclude or [])
+
+    def set_format_keys(self, keys):
+        """
+        Restricts the genotype columns in the schema to the FORMAT keys in
+        the specified list. Raises a ValueError if a key is not declared 
+        in the header.
+        """
+        declared = self.__header_ids(b"##FORMAT")
+        for key in keys:
+            if key not in declared:
+                raise ValueError("Unknown FORMAT key: " + key.decode())
+        self.__format_keys = set(keys)
+
+    def set_samples(self, samples):
+        """
+        Restricts the genotype columns to the specified list of samples, 
+        which are kept in the order they appear in the VCF. The columns of 
+        the samples after the last selected one are never split. Raises a 
+        ValueError if a sample is not in the header.
+        """
+        for sample in samples:
+            if sample not in self.__all_genotypes:
+                raise ValueError("Unknown sample: " + sample.decode())
+        selected = set(samples)
+        self.__sample_columns = [9 + j 
+                for j, g in enumerate(self.__all_genotypes) if g in selected]
+        self.__genotypes = [g for g in self.__all_genotypes if g in selected]
+        self.__max_split = 9
+        if len(self.__sample_columns) > 0:
+            self.__max_split = self.__sample_columns[-1] + 1
+
+    def __split_line(self, s):
+        """
+        Splits the specified VCF line into its tokens, keeping only the 
+        columns of the selected samples, if any.
+        """
+        if self.__sample_columns is None:
+            return s.split()
+        l = s.split(b"\t", self.__max_split)
+        l[-1] = l[-1].rstrip()
+        if len(l) <= 9:
+            return l
+        return l[:9] + [l[j] for j in self.__sample_columns]
+
+    def __packed_gt(self):
+        return (self.__layout == SAMPLE_LAYOUT 
+                and self.__gt_encoding == PACKED_GT_ENCODING)
+
+    def get_samples(self):
+        """
+        Returns the list of sample names in the VCF header.
+        """
+        return list(self.__genotypes)
+
+    def get_metadata(self):
+        """
+        Returns a dictionary of the VCF specific metadata to be stored in 
+        the header of the Avro file.
+        """
+        samples = [g.decode() for g in self.__genotypes]
+        gt_encoding = STRING_GT_ENCODING
+        if self.__packed_gt():
+            gt_encoding = PACKED_GT_ENCODING
+        meta = {
+            SAMPLES_KEY: json.dumps(samples).encode(),
+            GENOTYPE_LAYOUT_KEY: self.__layout.encode(),
+            GT_ENCODING_KEY: gt_encoding.encode(),
+            HEADER_KEY: b"".join(self.__header)}
+        if self.__dictionary_encoding:
+            d = {}
+            for name, values in self.get_dictionaries().items():
+                d[name.decode()] = [v.decode() for v in values]
+            meta[DICTIONARIES_KEY] = json.dumps(d).encode()
+        return meta
+
+    def set_region(self, region):
+        """
+        Restricts the rows returned by this reader to those overlapping the
+        specified region string. If the input is indexed, only the parts 
+        of the file that may contain the region are decompressed; 
+        otherwise, the whole file is scanned.
+        """
+        self.__set_query(*parse_region(region))
+
+    def set_contig(self, chrom):
+        """
+        Restricts the rows returned by this reader to those on the specified
+        contig, whose name is taken as it is rather than parsed as a region
+        string, since contig names may contain ':'.
+        """
+        self.__set_query(chrom.encode(), 1, 2**31 - 1)
+
+    def __set_query(self, chrom, start, end):
+        self.__region = chrom, start, end
+        index = self.get_index()
+        if index is not None:
+            self.set_chunks(index.query(*self.__region))
+
+    def set_memory_map(self, memory_map):
+        """
+        If True, batches are read from plain uncompressed input by memory 
+        mapping the file; see batches.
+        """
+        self.__memory_map = memory_map
+
+    def resume(self, checkpoint):
+        """
+        Positions the reader at the specified (input_offset, skip_lines) 
+        checkpoint recorded by an AvroFileWriter, so that the rows 
+        returned are those after the last row written.
+        """
+        offset, skip_lines = checkpoint
+        self.seek_input(offset)
+        self.__skip_lines = skip_lines
+
+    def lines(self):
+        """
+        Returns an iterator over the data lines in the input file, 
+        restricted to the current region, if any.
+        """
+        lines = super(VCFReader, self).lines()
+        if self.__region is not None:
+            lines = self.__region_lines(lines)
+        if self.__skip_lines > 0:
+            # Skip eagerly, so that get_input_offset is past these lines.
+            collections.deque(itertools.islice(lines, self.__skip_lines), 
+                    maxlen=0)
+            self.__skip_lines = 0
+        return lines
+
+    def __region_lines(self, lines):
+        chrom, start, end = self.__region
+        for s in lines:
+            l = s.split(b"\t", 4)
+            if l[0] == chrom:
+                pos = int(l[1])
+                if pos > end:
+                    break
+                if pos + len(l[3]) > start:
+                    yield s
 
     def set_truncate_REF_ALT(self, truncate):
         """
@@ -280,7 +3678,7 @@ class VCFReader(FileReader):
             g = d[avro_type] 
             def conv(s):
                 ret = []
-                for tok in s.split(","):
+                for tok in s.split(b","):
                     ret.append(g(tok))
                 return ret
             if g is None:
@@ -289,16 +3687,32 @@ class VCFReader(FileReader):
                 f = conv
         return f
 
-    def add_column_definition(self, name, description, avro_type, num_elements=1):
-        s = """{{"name": "{0}", """.format(name)
+    def _get_sample_converter(self, avro_type, num_elements):
+        """
+        Returns a conversion function for a list of per-sample values of the
+        specified type and number of elements, in which missing values 
+        are None.
+        """
+        g = self._get_converter(avro_type, num_elements)
+        f = None
+        if g is not None:
+            def f(values):
+                return [None if v is None else g(v) for v in values]
+        return f
+
+    def add_column_definition(self, name, description, avro_type, 
+            num_elements=1, per_sample=False):
+        """
+        Adds a field for a column with the specified element type and number 
+        of elements to the Avro schema. 
+        """
         if num_elements == 1 or avro_type == "bytes":
-            t = "\"{0}\"".format(avro_type)
+            t = avro_type
         else:
-            t = """{{"type":"array", "items":"{0}"}}""".format(avro_type)
-        s += """"type": [{0}, "null"]}}, """.format(t)
-        f = self._get_converter(avro_type, num_elements)
-        self.__columns[name] = f 
-        self.__schema += s + "\n"
+            t = {"type": "array", "items": avro_type}
+        if per_sample:
+            t = {"type": "array", "items": [t, "null"]}
+        self.__fields.append({"name": name.decode(), "type": [t, "null"]})
 
     def add_int_column(self, name, description):
         """
@@ -306,12 +3720,23 @@ class VCFReader(FileReader):
         """
         self.add_column_definition(name, description, "int")
 
+    def add_dictionary_column(self, name, description):
+        """
+        Adds a dictionary encoded bytes column to the Avro schema.
+        """
+        self.__fields.append({"name": name.decode(), 
+            "type": list(DICTIONARY_TYPE)})
+
     def add_char_column(self, name, description):
         """
-        Adds a char column to the Avro schema.
+        Adds a char column to the Avro schema, which is dictionary encoded
+        if requested.
         """
-        self.add_column_definition(name, description, "bytes")
-    
+        if self.__dictionary_encoding and name in DICTIONARY_COLUMNS:
+            self.add_dictionary_column(name, description)
+        else:
+            self.add_column_definition(name, description, "bytes")
+
     def add_float_column(self, name, description):
         """
         Adds a float column to the Avro schema.
@@ -319,10 +3744,19 @@ class VCFReader(FileReader):
         self.add_column_definition(name, description, "float")
 
 
-    def add_column(self, prefix, line):
+    def add_column(self, prefix, line, per_sample=False):
         """
         Adds a VCF column using the specified metadata line with the specified 
-        name prefix to the specified table.
+        name prefix to the specified table. If per_sample is True, the column
+        holds an array of values, one for each sample.
+        """
+        self.add_parsed_column(prefix, self.parse_column_line(line), 
+                per_sample)
+
+    def parse_column_line(self, line):
+        """
+        Parses the specified ##INFO or ##FORMAT metadata line and returns 
+        the tuple (id, description, element_type, num_elements).
         """
         d = {}
         s = line[line.find(b"<") + 1: line.find(b">")]
@@ -366,33 +3800,59 @@ class VCFReader(FileReader):
             element_size = 1
         else:
             raise ValueError("Unknown VCF type:", st)
-        
-        self.add_column_definition(prefix + COLUMN_SEPARATOR + name, 
-                description, element_type, num_elements)
+        return name, description, element_type, num_elements
 
-    def generate_schema(self):
+    def add_parsed_column(self, prefix, definition, per_sample=False):
         """
-        Reads the header from the specified VCF file and returns an 
-        avro schema in JSON format.
+        Adds a VCF column with the specified name prefix using the specified
+        definition returned by parse_column_line.
         """
-        self.__schema = """
-        {"namespace":"vcf.avro",
-         "type":"record",
-         "name":"VCF",
-         "fields": [
+        key, description, element_type, num_elements = definition
+        name = prefix + COLUMN_SEPARATOR + key
+        if per_sample and key == GT_NAME and self.__packed_gt():
+            self.add_packed_genotype_column(name, description)
+        else:
+            self.add_column_definition(name, description, element_type, 
+                    num_elements, per_sample)
+
+    def add_packed_genotype_column(self, name, description):
+        """
+        Adds a column holding the packed GT values of all samples in a row.
+        """
+        self.add_column_definition(name, description, "bytes")
+
+    def generate_schema(self):
+        """
+        Reads the header from the specified VCF file and returns the tuple 
+        (schema, columns) where schema is the Avro schema in JSON format 
+        and columns is as described in load_schema. If a schema cache 
+        directory has been set, a schema previously generated for an 
+        identical header and options is used if present.
         """
-        self.__columns = {}
-        info_descriptions = []
-        genotype_descriptions = []
-        
         if self._version < 4.0:
             raise ValueError("VCF versions < 4.0 not supported")
+        cache_file = None
+        if self.__schema_cache is not None:
+            cache_file = os.path.join(self.__schema_cache, 
+                    self.__schema_cache_key() + ".json")
+            if os.path.exists(cache_file):
+                with open(cache_file) as f:
+                    return self.load_schema(f.read())
+        self.__fields = []
+        info_descriptions = []
+        genotype_descriptions = []
         for s in self.__header:
             # skip FILTER values 
             if s.startswith(b"##INFO"):
-                info_descriptions.append(s)
+                key = get_header_id(s)
+                if (key not in self.__info_exclude and (
+                        self.__info_include is None 
+                        or key in self.__info_include)):
+                    info_descriptions.append(s)
             elif s.startswith(b"##FORMAT"):
-                genotype_descriptions.append(s)
+                if (self.__format_keys is None 
+                        or get_header_id(s) in self.__format_keys):
+                    genotype_descriptions.append(s)
 
         # Add the fixed columns
         self.add_char_column(CHROM_NAME, CHROM_DESCRIPTION)
@@ -405,114 +3865,1200 @@ class VCFReader(FileReader):
         
         for s in info_descriptions:
             self.add_column(INFO_NAME, s)
-        for genotype in self.__genotypes:
-            for s in genotype_descriptions: 
-                self.add_column(genotype, s) 
-        # Remove the last ','
-        self.__schema = self.__schema.rstrip("\n ,")
-        self.__schema += "]}"
-        return self.__schema, self.__columns
+        if self.__layout == SAMPLE_LAYOUT:
+            if len(self.__genotypes) > 0:
+                for s in genotype_descriptions:
+                    self.add_column(FORMAT_NAME, s, True)
+        else:
+            # Parse the FORMAT lines once rather than once per sample.
+            definitions = [self.parse_column_line(s) 
+                    for s in genotype_descriptions]
+            for genotype in self.__genotypes:
+                for definition in definitions: 
+                    self.add_parsed_column(genotype, definition) 
+        if self.__compute_stats:
+            for name, description, avro_type, num_elements in STATS_COLUMNS:
+                self.add_column_definition(name, description, avro_type, 
+                        num_elements)
+        schema = json.dumps({"namespace": "vcf.avro", "type": "record",
+            "name": "VCF", "fields": self.__fields})
+        self.__fields = None
+        if cache_file is not None:
+            self.__write_schema_cache(cache_file, schema)
+        return self.load_schema(schema)
+
+    def load_schema(self, schema):
+        """
+        Sets the columns of this reader to those of the specified schema, 
+        which must have been generated by generate_schema for the same 
+        options. Returns the tuple (schema, columns), where columns is a 
+        dictionary mapping the column names in schema order to the 
+        functions converting their values, or None for bytes columns.
+        """
+        self.__columns = {}
+        self.__column_types = {}
+        converters = {}
+        packed_gt_name = FORMAT_NAME + COLUMN_SEPARATOR + GT_NAME
+        for field in json.loads(schema)["fields"]:
+            name = field["name"].encode()
+            t = get_value_type(field["type"])
+            per_sample = False
+            if isinstance(t, dict) and isinstance(t["items"], list):
+                per_sample = True
+                t = get_value_type(t["items"])
+            num_elements = 1
+            if isinstance(t, dict):
+                t = t["items"]
+                num_elements = VARIABLE_SIZE
+            key = t, num_elements, per_sample
+            if (name == packed_gt_name and self.__packed_gt() 
+                    and not per_sample):
+                f = pack_genotypes
+            elif key in converters:
+                f = converters[key]
+            elif per_sample:
+                f = converters[key] = self._get_sample_converter(
+                        t, num_elements)
+            else:
+                f = converters[key] = self._get_converter(t, num_elements)
+            self.__columns[name] = f
+            self.__column_types[name] = (t, num_elements)
+        return schema, self.__columns
+
+    def set_schema_cache(self, directory):
+        """
+        Caches generated schemas as files in the specified directory, keyed
+        by a hash of the header and the options affecting the schema.
+        """
+        self.__schema_cache = directory
+
+    def __schema_cache_key(self):
+        """
+        Returns the key identifying the schema for the header and options
+        of this reader in the schema cache.
+        """
+        h = hashlib.sha1()
+        for s in self.__header:
+            h.update(s)
+        h.update(b"\t".join(self.__all_genotypes) + b"\n")
+        options = {
+            "version": SCHEMA_CACHE_VERSION,
+            "layout": self.__layout, 
+            "packed_gt": self.__packed_gt(),
+            "dictionary_encoding": self.__dictionary_encoding,
+            "compute_stats": self.__compute_stats,
+            "info_include": None if self.__info_include is None 
+                else sorted(k.decode() for k in self.__info_include),
+            "info_exclude": sorted(k.decode() for k in self.__info_exclude),
+            "format_keys": None if self.__format_keys is None
+                else sorted(k.decode() for k in self.__format_keys),
+            "samples": [g.decode() for g in self.__genotypes]}
+        h.update(json.dumps(options, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def __write_schema_cache(self, cache_file, schema):
+        """
+        Writes the specified schema to the specified cache file. The file 
+        is written under a temporary name and then renamed, so that readers
+        never see a partial schema. Failures are ignored, as the cache is 
+        only an optimisation.
+        """
+        try:
+            directory = os.path.dirname(cache_file)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(schema)
+            os.replace(tmp, cache_file)
+        except OSError:
+            pass
 
     def read_header(self):
         """
         Read header lines, parse version and column names
         """
         f = self.get_input_file()
-        self.__header = [f.readline()]  
+        self.__header = [self.readline()]  
         while self.__header[-1].startswith(b"##"):
-            self.__header.append(f.readline())
+            self.__header.append(self.readline())
         self.parse_version(self.__header[0])
         self.parse_header_line(self.__header.pop()) 
-        
+        self.__data_offset = None
+        if self.is_seekable():
+            self.__data_offset = f.tell()
 
-    def rows(self, table_columns):
+    def partition(self, num_parts):
         """
-        Returns an iterator over the rows in this VCF file. Each row is a 
-        dictionary mapping column positions to their encoded string values.
+        Returns a list of parts of the input file that can be converted 
+        independently. For indexed input, these are the names of the
+        chromosomes in the index, to be passed to set_contig; otherwise, these are at most num_parts
+        (start, end) byte ranges covering the data lines in the input file, 
+        with each range boundary aligned to the start of a line. Returns 
+        None if the input does not support random access.
+        """
+        index = self.get_index()
+        if index is not None and self.__region is None:
+            return [name.decode() for name in index.get_names()]
+        if self.__data_offset is None or self.__region is not None:
+            return None
+        f = self.get_input_file()
+        size = self.get_input_file_size()
+        start = self.__data_offset
+        boundaries = [start]
+        for j in range(1, num_parts):
+            offset = start + j * (size - start) // num_parts
+            # Find the start of the first line beginning at or after offset.
+            f.seek(max(offset - 1, start))
+            f.readline()
+            boundary = min(f.tell(), size)
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+        if size > boundaries[-1] or len(boundaries) == 1:
+            boundaries.append(size)
+        f.seek(start)
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+    def __compile_parse_plans(self, table_columns):
+        """
+        Returns the tuple (converters, fixed_columns, info_plan, format_plan)
+        describing how to map the parts of a VCF line to the slots of the
+        columns in table_columns. The info_plan and format_plan functions 
+        return the cached plans for a tuple of INFO keys and a FORMAT 
+        string, respectively.
         """
         # First we construct the mappings from the various parts of the 
-        # VCF row to the corresponding column name in the Avro schema 
-        num_columns = len(table_columns) 
-        all_fixed_columns = VCF_FIXED_COLUMNS 
+        # VCF row to the corresponding column slot in the Avro schema 
+        slots = {}
+        converters = []
+        for name, f in table_columns.items():
+            slots[name] = len(converters)
+            converters.append(f)
         fixed_columns = []
         # weed out the columns that are not in the table
-        for j in range(len(all_fixed_columns)):
-            name = all_fixed_columns[j]
-            if name in table_columns:
-                fixed_columns.append((j, name))
+        for j, name in enumerate(VCF_FIXED_COLUMNS):
+            if name in slots:
+                fixed_columns.append((j, slots[name], converters[slots[name]]))
         info_columns = {}
-        genotype_columns = [{} for g in self.__genotypes]
-        for k in table_columns: 
+        format_columns = {}
+        genotype_columns = {}
+        sample_index = dict((g, j) for j, g in enumerate(self.__genotypes))
+        num_samples = len(self.__genotypes)
+        for k, slot in slots.items(): 
+            if k in STATS_COLUMN_NAMES:
+                # These are filled in by a GenotypeStats.
+                continue
             if COLUMN_SEPARATOR in k:
                 split = k.split(COLUMN_SEPARATOR)
                 if split[0] == INFO:
                     name = COLUMN_SEPARATOR.join(split[1:])
-                    info_columns[name] = k 
+                    info_columns[name] = slot 
+                elif split[0] == FORMAT_NAME and self.__layout == SAMPLE_LAYOUT:
+                    name = COLUMN_SEPARATOR.join(split[1:])
+                    format_columns[name] = slot 
                 else:
                     g = COLUMN_SEPARATOR.join(split[:-1])
                     name = split[-1]
-                    index = self.__genotypes.index(g)
-                    genotype_columns[index][name] = k 
-        ref_index = 3
-        alt_index = 4
+                    if name not in genotype_columns:
+                        genotype_columns[name] = [None] * num_samples
+                    genotype_columns[name][sample_index[g]] = slot 
+
+        def compile_info_plan(keys):
+            # Maps the positions of the keys in an INFO column to the 
+            # slots and converters for these keys.
+            plan = []
+            for j, key in enumerate(keys):
+                if key in info_columns:
+                    slot = info_columns[key]
+                    plan.append((j, slot, converters[slot]))
+            return plan
+
+        def compile_format_plan(fmt):
+            # Maps the positions of the keys in a FORMAT column to the 
+            # slots for these keys.
+            fmt = fmt.split(b":")
+            plan = []
+            for k, key in enumerate(fmt):
+                if key in format_columns:
+                    slot = format_columns[key]
+                    plan.append((k, slot, converters[slot]))
+                elif key in genotype_columns:
+                    key_slots = genotype_columns[key]
+                    if None not in key_slots:
+                        conv = converters[key_slots[0]]
+                        plan.append((k, key_slots, conv))
+            return len(fmt), plan
+
+        info_plan = functools.lru_cache(PARSE_PLAN_CACHE_SIZE)(
+                compile_info_plan)
+        format_plan = functools.lru_cache(PARSE_PLAN_CACHE_SIZE)(
+                compile_format_plan)
+        return converters, fixed_columns, info_plan, format_plan
+
+    def __parse_site(self, l, row, fixed_columns, info_plan):
+        """
+        Fills in the fixed and INFO columns of the specified row from the 
+        list of tokens in a VCF line.
+        """
+        for vcf_index, slot, f in fixed_columns:
+            tok = l[vcf_index]
+            if tok != MISSING_VALUE:
+                row[slot] = tok if f is None else f(tok)
+        if l[7] != MISSING_VALUE:
+            mappings = [t.split(b"=", 1) for t in l[7].split(b";")]
+            keys = tuple([t[0] for t in mappings])
+            for j, slot, f in info_plan(keys):
+                tokens = mappings[j]
+                if len(tokens) == 2:
+                    row[slot] = tokens[1] if f is None else f(tokens[1])
+                else:
+                    # This is a Flag column.
+                    row[slot] = 1
+
+    def rows(self, table_columns):
+        """
+        Returns an iterator over the rows in this VCF file. Each row is a 
+        list of the converted values of the columns in table_columns, in 
+        order, with None for missing values.
+        """
+        converters, fixed_columns, info_plan, format_plan = (
+                self.__compile_parse_plans(table_columns))
+        num_columns = len(converters)
+        num_samples = len(self.__genotypes)
         # Now we are ready to process the file.
         update_rows = self.get_progress_update_rows()
         num_rows = 0
-        for s in self.get_input_file():
-            row = {} 
-            l = s.split()
-            # Read in the fixed columns
-            for vcf_index, wt_index in fixed_columns:
-                if l[vcf_index] != MISSING_VALUE:
-                    row[wt_index] = l[vcf_index]
-            # Now process the info columns.
-            for mapping in l[7].split(b";"):
-                tokens = mapping.split(b"=")
-                name = tokens[0]
-                if name in info_columns:
-                    col = info_columns[name]
-                    if len(tokens) == 2:
-                        row[col] = tokens[1]
-                    else:
-                        # This is a Flag column.
-                        row[col] = b"1"
+        # In the column layout, splitting the sample columns is counted as 
+        # conversion, as it is interleaved with converting their values.
+        stats = self.get_stats()
+        for s in self.lines():
+            if stats is not None:
+                t = stats.start()
+            row = [None] * num_columns
+            l = self.__split_line(s)
+            if stats is not None:
+                t = stats.lap("tokenize", t)
+            self.__parse_site(l, row, fixed_columns, info_plan)
             # Process the genotype columns, if they exist
             if len(l) > 8:
-                j = 0
-                fmt = l[8].split(b":")
-                for genotype_values in l[9:]:
-                    tokens = genotype_values.split(b":")
-                    if len(tokens) == len(fmt):
-                        for k in range(len(fmt)):
-                            if fmt[k] in genotype_columns[j]:
-                                col = genotype_columns[j][fmt[k]]
+                num_keys, plan = format_plan(l[8])
+                if self.__layout == SAMPLE_LAYOUT:
+                    if stats is not None:
+                        t = stats.lap("convert", t)
+                    keys = []
+                    for k, slot, f in plan:
+                        values = [None] * num_samples
+                        row[slot] = values
+                        keys.append((k, values))
+                    j = 0
+                    for genotype_values in l[9:]:
+                        tokens = genotype_values.split(b":")
+                        if len(tokens) < num_keys:
+                            # Trailing fields may be dropped.
+                            tokens += [MISSING_VALUE] * (num_keys - len(tokens))
+                        if len(tokens) == num_keys:
+                            for k, values in keys:
+                                tok = tokens[k]
+                                if tok != MISSING_VALUE and tok != b".,.":
+                                    values[j] = tok
+                        j += 1
+                    if stats is not None:
+                        t = stats.lap("tokenize", t)
+                    for k, slot, f in plan:
+                        if f is not None:
+                            row[slot] = f(row[slot])
+                else:
+                    j = 0
+                    for genotype_values in l[9:]:
+                        tokens = genotype_values.split(b":")
+                        if len(tokens) < num_keys:
+                            tokens += [MISSING_VALUE] * (num_keys - len(tokens))
+                        if len(tokens) == num_keys:
+                            for k, key_slots, f in plan:
                                 tok = tokens[k]
                                 # FIXME this is a hack to detect missing values 
                                 # in genotype columns. I'm not sure why anybody 
                                 # would do this, but we need it to parse the 
                                 # example VCF from the 1000genomes site.
                                 if tok != MISSING_VALUE and tok != b".,.":
-                                    row[col] = tok 
-                    j += 1
-            d = {}
-            """
-            for k  in table_columns:
-                if k not in row:
-                    print("Column", k, "not found")
-                    row[k] = "0"
-            """
-            for k, v in row.items():
-                f = table_columns[k]
-                if f is None:
-                    d[k] = v
-                else:
-                    d[k] = f(v)
-            yield d
+                                    row[key_slots[j]] = (tok if f is None 
+                                            else f(tok))
+                        j += 1
+            if stats is not None:
+                stats.lap("convert", t)
+            yield row
             num_rows += 1
             if num_rows % update_rows == 0:
                 self.update_progress()
         self.finish_progress()
 
+    def batches(self, table_columns, batch_size):
+        """
+        Returns an iterator over VariantBatch objects containing up to 
+        batch_size consecutive rows of this VCF file. The sample columns 
+        of each FORMAT key are parsed into NumPy arrays in bulk rather 
+        than one value at a time. Requires the sample genotype layout.
+        If memory mapping is enabled and the input is a plain file, the 
+        lines are not read; only the site columns are copied out of the 
+        mapped file, and the sample tokens that are needed are gathered 
+        from it directly into arrays.
+        """
+        if self.__layout != SAMPLE_LAYOUT:
+            raise ValueError("Batches require the sample genotype layout")
+        converters, fixed_columns, info_plan, format_plan = (
+                self.__compile_parse_plans(table_columns))
+        names = list(table_columns.keys())
+        num_columns = len(converters)
+        update_rows = self.get_progress_update_rows()
+        num_rows = 0
+        stats = self.get_stats()
+        chunks = None
+        if (self.__memory_map and self.__region is None 
+                and self.__skip_lines == 0):
+            chunks = self.line_spans(batch_size)
+        mapped = chunks is not None
+        if not mapped:
+            lines = self.lines()
+            chunks = iter(lambda: list(itertools.islice(lines, batch_size)), 
+                    [])
+        input_offset = self.get_input_offset()
+        for chunk in chunks:
+            if stats is not None:
+                t = stats.start()
+            rows = []
+            groups = collections.OrderedDict()
+            if mapped:
+                data = chunk[0]
+                lines_tokens, spans = self.__split_mapped_lines(*chunk)
+            else:
+                lines_tokens = [self.__split_line(s) for s in chunk]
+            if stats is not None:
+                t = stats.lap("tokenize", t)
+            for l in lines_tokens:
+                row = [None] * num_columns
+                self.__parse_site(l, row, fixed_columns, info_plan)
+                if len(l) > 8:
+                    if l[8] not in groups:
+                        groups[l[8]] = []
+                    groups[l[8]].append((len(rows), l))
+                rows.append(row)
+            batch = VariantBatch(rows, input_offset)
+            for fmt, group in groups.items():
+                num_keys, plan = format_plan(fmt)
+                keys = fmt.split(b":")
+                if stats is not None:
+                    t = stats.lap("convert", t)
+                tokens = None
+                if mapped:
+                    tokens = self.__gather_samples(data, 
+                            [spans[j] for j, l in group], num_keys, 
+                            [k for k, slot, f in plan])
+                    if tokens is None:
+                        group = [(j, l if spans[j] is None else 
+                            self.__split_line(data[spans[j][0]:spans[j][2]
+                                ].tobytes())) for j, l in group]
+                if tokens is None:
+                    a = self.__split_samples(group, num_keys)
+                    tokens = dict((k, a[:, :, k]) for k, slot, f in plan)
+                if stats is not None:
+                    t = stats.lap("tokenize", t)
+                indexes = [j for j, l in group]
+                for k, slot, f in plan:
+                    avro_type, num_elements = self.__column_types[names[slot]]
+                    conv = self._get_converter(avro_type, num_elements)
+                    kind = "tokens"
+                    if keys[k] == GT_NAME and self.__packed_gt():
+                        kind = "packed_gt"
+                    elif num_elements == 1 and avro_type in ("int", "float"):
+                        kind = avro_type
+                    elif avro_type == "int":
+                        kind = "int_list"
+                    batch.add_tokens(slot, indexes, tokens[k], kind,
+                            conv, keys[k] == GT_NAME)
+            batch.finalise()
+            if stats is not None:
+                stats.lap("convert", t)
+            yield batch
+            num_rows += len(rows)
+            if num_rows % update_rows < len(rows):
+                self.update_progress()
+            input_offset = self.get_input_offset()
+        self.finish_progress()
+
+    def __split_mapped_lines(self, data, starts, ends):
+        """
+        Returns the tuple (lines_tokens, spans) for the lines at the 
+        specified offsets in the memory mapped data. The tokens of each 
+        line are its site and FORMAT columns; the sample columns are not 
+        split, and the span of the line is the tuple (start, samples_start,
+        samples_end), or None if it has no sample columns. If samples have 
+        been selected, the span ends after the last selected sample.
+        """
+        first = starts[0]
+        tabs = np.flatnonzero(data[first:ends[-1]] == 9) + first
+        # The index of the tab before the first sample column of each line
+        k = np.searchsorted(tabs, starts) + 8
+        has_samples = k < len(tabs)
+        samples_start = ends.copy()
+        samples_start[has_samples] = tabs[k[has_samples]]
+        has_samples &= samples_start < ends
+        samples_end = ends
+        if self.__sample_columns is not None:
+            k += self.__max_split - 9
+            truncated = k < len(tabs)
+            samples_end = ends.copy()
+            samples_end[truncated] = np.minimum(tabs[k[truncated]], 
+                    ends[truncated])
+        lines_tokens = []
+        spans = []
+        for a, b, c, sampled in zip(starts.tolist(), samples_start.tolist(), 
+                samples_end.tolist(), has_samples.tolist()):
+            if sampled:
+                lines_tokens.append(data[a:b].tobytes().split(b"\t"))
+                spans.append((a, b + 1, c))
+            else:
+                lines_tokens.append(data[a:c].tobytes().split(b"\t"))
+                spans.append(None)
+        return lines_tokens, spans
+
+    def __gather_samples(self, data, spans, num_keys, keys):
+        """
+        Returns a dictionary mapping each of the specified key indexes to a
+        NumPy bytes array of shape (len(spans), num_samples) containing the 
+        tokens of that key for the selected samples of the lines with the 
+        specified spans in the memory mapped data, which share a FORMAT 
+        string. The separators are located in bulk, and only the tokens of
+        the requested keys are copied. As for __split_samples, trailing 
+        values missing from a sample are filled in, and samples with too 
+        many tokens are treated as missing. Returns None if
+        any line does not have one column for every sample in the header,
+        up to the last selected sample.
+        """
+        if any(span is None for span in spans):
+            return None
+        num_lines = len(spans)
+        num_samples = len(self.__all_genotypes)
+        if self.__sample_columns is not None:
+            num_samples = self.__max_split - 9
+        tab = np.array([9], dtype=np.uint8)
+        parts = []
+        for a, b, c in spans:
+            parts.append(data[b:c])
+            parts.append(tab)
+        buf = np.concatenate(parts)
+        # Each sample column, including the last in each line, ends with a
+        # tab. We only check the total, as for __split_samples.
+        sample_ends = np.flatnonzero(buf == 9)
+        if len(sample_ends) != num_lines * num_samples:
+            return None
+        sample_starts = np.empty_like(sample_ends)
+        sample_starts[0] = 0
+        sample_starts[1:] = sample_ends[:-1] + 1
+        colons = np.flatnonzero(buf == 58)
+        # Append a sentinel so that indexing past the last colon is safe.
+        colons = np.append(colons, len(buf))
+        first = np.searchsorted(colons, sample_starts)
+        num_colons = np.searchsorted(colons, sample_ends) - first
+        shape = (num_lines, num_samples)
+        columns = slice(None)
+        if self.__sample_columns is not None:
+            columns = [j - 9 for j in self.__sample_columns]
+        invalid = num_colons > num_keys - 1
+        tokens = {}
+        for k in keys:
+            # Samples may drop trailing fields, which are then missing.
+            missing = (invalid | (num_colons < k)).reshape(shape)[:, columns]
+            if k == 0:
+                starts = sample_starts
+            else:
+                starts = colons[np.minimum(first + k - 1, len(colons) - 1)] + 1
+            ends = np.where(num_colons > k, 
+                    colons[np.minimum(first + k, len(colons) - 1)], 
+                    sample_ends)
+            starts = starts.reshape(shape)[:, columns]
+            lengths = ends.reshape(shape)[:, columns] - starts
+            lengths[missing] = 0
+            width = max(1, int(lengths.max()) if lengths.size > 0 else 1)
+            offsets = np.arange(width)
+            chars = buf[np.minimum(starts[..., None] + offsets, len(buf) - 1)]
+            chars[offsets >= lengths[..., None]] = 0
+            chars[missing, 0] = ord(MISSING_VALUE)
+            tokens[k] = chars.view("S{0}".format(width)).reshape(
+                    starts.shape)
+        return tokens
+
+    def __split_samples(self, group, num_keys):
+        """
+        Returns a NumPy bytes array of shape (len(group), num_samples, 
+        num_keys) containing the tokens of the sample columns of the 
+        specified (index, tokens) lines, which share a FORMAT string. 
+        Samples with fewer tokens than keys have missing trailing values, 
+        and samples with more are treated as missing.
+        """
+        num_samples = len(self.__genotypes)
+        flat = []
+        for j, l in group:
+            tokens = b":".join(l[9:]).split(b":")
+            if len(tokens) != num_samples * num_keys:
+                tokens = []
+                for genotype_values in l[9:]:
+                    t = genotype_values.split(b":")
+                    if len(t) < num_keys:
+                        t += [MISSING_VALUE] * (num_keys - len(t))
+                    elif len(t) > num_keys:
+                        t = [MISSING_VALUE] * num_keys
+                    tokens.extend(t)
+            flat.extend(tokens)
+        a = np.array(flat, dtype=bytes)
+        return a.reshape((len(group), num_samples, num_keys))
+
+
+def get_header_id(line):
+    """
+    Returns the value of the ID field in the specified structured header 
+    line, such as an ##INFO or ##FORMAT line.
+    """
+    s = line[line.find(b"<") + 1: line.rfind(b">")]
+    for tok in s.split(b","):
+        if tok.startswith(b"ID="):
+            return tok[3:]
+    return None
+
+def parse_genotype(s):
+    """
+    Parses the specified GT string and returns the tuple (alleles, phased),
+    where alleles is a list of allele indexes with GT_MISSING for missing 
+    alleles and phased is True if the genotype is phased.
+    """
+    phased = b"|" in s
+    alleles = []
+    for a in s.replace(b"|", b"/").split(b"/"):
+        alleles.append(GT_MISSING if a == MISSING_VALUE else int(a))
+    return alleles, phased
+
+class TokenTable(dict):
+    """
+    A dictionary mapping tokens to the result of the specified function, 
+    which is called once for each distinct token as it is first looked up.
+    Mapping __getitem__ over the tokens of an array is much faster than
+    parsing every token individually, as most values repeat many times.
+    """
+    def __init__(self, function):
+        super(TokenTable, self).__init__()
+        self.__function = function
+
+    def __missing__(self, key):
+        value = self.__function(key)
+        self[key] = value
+        return value
+
+def genotype_matrix(tokens):
+    """
+    Parses the specified NumPy array of GT strings and returns the tuple 
+    (alleles, phased). Alleles is an integer array with an extra trailing 
+    dimension of size equal to the maximum ploidy, in which missing 
+    alleles are GT_MISSING and haploid calls are padded with GT_PAD. 
+    Phased is a boolean array of the same shape as tokens. Each distinct 
+    GT string is only parsed once.
+    """
+    codes = TokenTable(lambda t: len(codes))
+    flat = tokens.ravel().tolist()
+    inverse = np.fromiter(map(codes.__getitem__, flat), dtype=np.int32, 
+            count=len(flat))
+    parsed = [parse_genotype(t) for t in codes]
+    ploidy = max([len(a) for a, p in parsed] + [1])
+    max_allele = max([max(a) for a, p in parsed] + [0])
+    dtype = np.int8 if max_allele < 2**7 else np.int16 
+    table = np.full((len(parsed), ploidy), GT_PAD, dtype=dtype)
+    phased = np.zeros(len(parsed), dtype=bool)
+    for j, (a, p) in enumerate(parsed):
+        table[j, :len(a)] = a
+        phased[j] = p
+    inverse = inverse.reshape(tokens.shape)
+    return table[inverse], phased[inverse]
+
+
+def _pack_codes(ploidy, codes, max_code, phase_bits):
+    """
+    Returns the packed genotype bytes for the specified ploidy, list or 
+    array of allele codes with the specified maximum and phase bitmap.
+    """
+    width = 1 if max_code < 2**8 else 2
+    if np is not None:
+        data = np.asarray(codes, dtype="<u{0}".format(width)).tobytes()
+    else:
+        a = array.array("B" if width == 1 else "H", codes)
+        if sys.byteorder != "little":
+            a.byteswap()
+        data = a.tobytes()
+    return bytes(bytearray([ploidy, width])) + bytes(phase_bits) + data
+
+def pack_genotypes(genotypes):
+    """
+    Packs the specified list of GT strings for the samples in a row, with
+    None for missing values, into a bytes value. The format is:
+
+    - 1 byte: the maximum ploidy P of the genotypes.
+    - 1 byte: the width W of each allele code in bytes, 1 or 2.
+    - ceil(num_samples / 8) bytes: a bitmap in which bit j % 8 of byte 
+      j // 8 is set if the genotype of sample j is phased.
+    - num_samples * P allele codes of W bytes each, little-endian, in 
+      sample order. Code 0 pads genotypes with ploidy less than P, code 1 
+      is a missing allele ('.') and code a + 2 is allele index a.
+
+    A missing GT value is stored as a single missing allele.
+    """
+    parsed = TokenTable(parse_genotype)
+    genotypes = [parsed[MISSING_VALUE if g is None else g] for g in genotypes]
+    ploidy = max([len(a) for a, p in genotypes] + [1])
+    phase_bits = bytearray((len(genotypes) + 7) // 8)
+    codes = []
+    for j, (alleles, phased) in enumerate(genotypes):
+        if phased:
+            phase_bits[j >> 3] |= 1 << (j & 7)
+        for a in alleles:
+            codes.append(1 if a == GT_MISSING else a + 2)
+        codes.extend([0] * (ploidy - len(alleles)))
+    return _pack_codes(ploidy, codes, max(codes + [0]), phase_bits)
+
+def pack_genotype_matrix(alleles, phased):
+    """
+    Returns a list of the packed genotypes for each row of the specified 
+    alleles and phased arrays, as returned by genotype_matrix. The output
+    is identical to that of pack_genotypes.
+    """
+    codes = np.where(alleles >= 0, alleles.astype(np.int32) + 2, 
+            np.where(alleles == GT_MISSING, 1, 0))
+    ret = []
+    for j in range(codes.shape[0]):
+        c = codes[j]
+        ploidy = max(1, int(np.count_nonzero(c.any(axis=0))))
+        phase_bits = np.packbits(phased[j], bitorder="little")
+        ret.append(_pack_codes(ploidy, c[:, :ploidy].ravel(), 
+            int(c.max(initial=0)), phase_bits))
+    return ret
+
+def unpack_genotypes(data, num_samples):
+    """
+    Unpacks the specified packed genotypes bytes value for num_samples 
+    samples and returns a list of (alleles, phased) tuples, in which 
+    missing alleles are None.
+    """
+    data = bytearray(data)
+    ploidy = data[0]
+    width = data[1]
+    offset = 2 + (num_samples + 7) // 8
+    phase_bits = data[2:offset]
+    ret = []
+    for j in range(num_samples):
+        alleles = []
+        for k in range(ploidy):
+            c = data[offset]
+            if width == 2:
+                c |= data[offset + 1] << 8
+            offset += width
+            if c == 1:
+                alleles.append(None)
+            elif c > 1:
+                alleles.append(c - 2)
+        ret.append((alleles, bool(phase_bits[j >> 3] & (1 << (j & 7)))))
+    return ret
+
+def unpack_genotype_matrix(data, num_samples):
+    """
+    Unpacks the specified packed genotypes bytes value for num_samples
+    samples into the (alleles, phased) arrays of genotype_matrix.
+    """
+    ploidy = bytearray(data[:1])[0]
+    width = bytearray(data[1:2])[0]
+    offset = 2 + (num_samples + 7) // 8
+    phase_bits = np.frombuffer(data, dtype=np.uint8, count=offset - 2, 
+            offset=2)
+    phased = np.unpackbits(phase_bits, bitorder="little")[:num_samples]
+    codes = np.frombuffer(data, dtype="<u{0}".format(width), 
+            count=num_samples * ploidy, offset=offset)
+    codes = codes.reshape((num_samples, ploidy)).astype(np.int32)
+    alleles = np.where(codes > 1, codes - 2, np.where(codes == 1, 
+        GT_MISSING, GT_PAD))
+    dtype = np.int8 if codes.max(initial=0) < 2**7 else np.int16
+    return alleles.astype(dtype), phased.astype(bool)
+
+def format_genotype(alleles, phased):
+    """
+    Returns the GT string for the specified list of alleles, in which 
+    missing alleles are None, and phase.
+    """
+    sep = b"|" if phased else b"/"
+    return sep.join(MISSING_VALUE if a is None else str(a).encode() 
+            for a in alleles)
+
+
+class VariantBatch(object):
+    """
+    Class representing a batch of consecutive VCF rows in which the site 
+    columns are stored in row lists, and the per-sample columns of the 
+    sample genotype layout are stored in NumPy arrays with one row per
+    variant and one column per sample. Integer arrays use INT_MISSING
+    and float arrays NaN for missing values. Other columns are stored 
+    as arrays of the original tokens. For the GT column, the parsed 
+    allele and phase arrays are also available from get_genotypes.
+    The input_offset is the offset in the input of the first line of the 
+    batch, or None if it is not known.
+    """
+    def __init__(self, rows, input_offset=None):
+        # The per-sample slots of the rows are None; the values for these
+        # slots are held in arrays, which maps slots to tuples
+        # (values, missing, present, kind, converter). Missing is a boolean
+        # array of missing values, present is a boolean array of the rows 
+        # in which the FORMAT key occurs, kind is one of "int", "float", 
+        # "int_list", "packed_gt" or "tokens" and converter converts a 
+        # single token to a value. For "int_list" the values are a tuple 
+        # (items, counts) of the concatenated items of the non-missing 
+        # values and the number of items in each value. For "packed_gt"
+        # the values are the (alleles, phased) arrays of genotype_matrix.
+        self.rows = rows
+        self.input_offset = input_offset
+        self.arrays = {}
+        self.__tokens = {}
+        self.__kinds = {}
+        self.__genotypes = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add_tokens(self, slot, indexes, tokens, kind, converter, is_genotype):
+        """
+        Adds the specified array of tokens for the per-sample column in the 
+        specified slot, for the rows with the specified indexes. The 
+        converter is used to convert individual tokens to values.
+        """
+        if slot not in self.__tokens:
+            self.__tokens[slot] = []
+            self.__kinds[slot] = kind, converter, is_genotype
+        self.__tokens[slot].append((indexes, tokens))
+
+    def finalise(self):
+        """
+        Converts the tokens added to this batch into arrays.
+        """
+        num_rows = len(self.rows)
+        for slot, parts in self.__tokens.items():
+            kind, converter, is_genotype = self.__kinds[slot]
+            width = max(t.dtype.itemsize for indexes, t in parts)
+            num_samples = parts[0][1].shape[1]
+            tokens = np.full((num_rows, num_samples), MISSING_VALUE, 
+                    dtype="S{0}".format(width))
+            present = np.zeros(num_rows, dtype=bool)
+            for indexes, t in parts:
+                tokens[indexes] = t
+                present[indexes] = True
+            missing = (tokens == MISSING_VALUE) | (tokens == b".,.")
+            if kind == "int":
+                a = np.where(missing, b"0", tokens).astype(np.int32)
+                a[missing] = INT_MISSING
+            elif kind == "float":
+                a = np.where(missing, b"nan", tokens).astype(np.float32)
+            elif kind == "int_list":
+                # Parse all the items in one go, falling back to individual
+                # tokens if any items are missing.
+                items = b",".join(tokens[~missing].tolist()).split(b",")
+                counts = np.char.count(tokens, b",") + 1
+                try:
+                    a = np.array(items).astype(np.int64), counts
+                except ValueError:
+                    kind = "tokens"
+                    a = tokens
+            else:
+                a = tokens
+            if is_genotype:
+                self.__genotypes = genotype_matrix(
+                        np.where(missing, MISSING_VALUE, tokens))
+                if kind == "packed_gt":
+                    a = self.__genotypes
+            self.arrays[slot] = a, missing, present, kind, converter
+        self.__tokens = None
+
+    def get_genotypes(self):
+        """
+        Returns the (alleles, phased) arrays for the GT column of this 
+        batch, or None if there is no GT column.
+        """
+        return self.__genotypes
+
+    def get_column(self, slot):
+        """
+        Returns the list of the values of the per-sample column in the 
+        specified slot for each row, as they would appear in the rows 
+        returned by VCFReader.rows: a list with one value per sample, or
+        None for rows without this FORMAT key.
+        """
+        values, missing, present, kind, converter = self.arrays[slot]
+        num_rows = len(self.rows)
+        if kind == "packed_gt":
+            packed = pack_genotype_matrix(*values)
+            return [packed[j] if present[j] else None for j in range(num_rows)]
+        if kind in ("int", "float"):
+            a = values.astype(object)
+            a[missing] = None
+            column = a.tolist()
+        elif kind == "int_list":
+            items, counts = values
+            items = items.tolist()
+            column = []
+            k = 0
+            for row_missing, row_counts in zip(missing.tolist(), 
+                    counts.tolist()):
+                row = []
+                for m, c in zip(row_missing, row_counts):
+                    if m:
+                        row.append(None)
+                    else:
+                        row.append(items[k:k + c])
+                        k += c
+                column.append(row)
+        else:
+            def convert(tok):
+                if tok == MISSING_VALUE or tok == b".,.":
+                    return None
+                return tok if converter is None else converter(tok)
+            lookup = TokenTable(convert).__getitem__
+            column = [list(map(lookup, row)) for row in values.tolist()]
+        return [column[j] if present[j] else None for j in range(num_rows)]
+
+
+class GenotypeStats(object):
+    """
+    Class that computes the per-variant statistics in STATS_COLUMNS from 
+    the GT values of each row as it is converted, and accumulates the 
+    number of variants at which each sample is called, heterozygous, 
+    homozygous for the REF allele and homozygous for an ALT allele. A 
+    sample is called if all the alleles of its GT are called. Rows 
+    without a GT value have null statistics, and count as not called for 
+    every sample. Requires NumPy.
+    """
+    def __init__(self, columns, samples):
+        names = list(columns.keys())
+        self.__samples = list(samples)
+        self.__gt_slots = None
+        self.__packed = False
+        gt_name = FORMAT_NAME + COLUMN_SEPARATOR + GT_NAME
+        if gt_name in names:
+            self.__gt_slots = names.index(gt_name)
+            self.__packed = columns[gt_name] is pack_genotypes
+        elif len(samples) > 0 and all(g + COLUMN_SEPARATOR + GT_NAME in names
+                for g in samples):
+            self.__gt_slots = [names.index(g + COLUMN_SEPARATOR + GT_NAME) 
+                    for g in samples]
+        if self.__gt_slots is None:
+            raise ValueError("Statistics require the GT column")
+        self.__stats_slots = [names.index(name) if name in names else None
+                for name in STATS_COLUMN_NAMES]
+        self.__alt_slot = names.index(ALT_NAME) if ALT_NAME in names else None
+        self.__num_variants = 0
+        self.__counts = np.zeros((len(SAMPLE_STATS_COUNTS), len(samples)), 
+                dtype=np.int64)
+
+    def update(self, row):
+        """
+        Fills in the statistics of the specified row returned by 
+        VCFReader.rows.
+        """
+        num_samples = len(self.__samples)
+        if isinstance(self.__gt_slots, list):
+            values = [row[slot] for slot in self.__gt_slots]
+            if all(v is None for v in values):
+                values = None
+        else:
+            values = row[self.__gt_slots]
+        if values is None:
+            alleles = np.full((1, num_samples, 1), GT_MISSING, dtype=np.int8)
+        elif self.__packed:
+            alleles = unpack_genotype_matrix(values, num_samples)[0][None]
+        else:
+            tokens = np.array([[MISSING_VALUE if v is None else v 
+                for v in values]])
+            alleles = genotype_matrix(tokens)[0]
+        self.__update([row], alleles, [values is not None])
+
+    def update_batch(self, batch):
+        """
+        Fills in the statistics of the rows of the specified VariantBatch.
+        """
+        genotypes = batch.get_genotypes()
+        if genotypes is None:
+            alleles = np.full((len(batch), len(self.__samples), 1), 
+                    GT_MISSING, dtype=np.int8)
+            present = np.zeros(len(batch), dtype=bool)
+        else:
+            alleles = genotypes[0]
+            present = batch.arrays[self.__gt_slots][2]
+        self.__update(batch.rows, alleles, present.tolist())
+
+    def __update(self, rows, alleles, present):
+        """
+        Updates the statistics for the specified rows from the specified 
+        array of alleles, as returned by genotype_matrix, and list of 
+        flags for the rows that have GT values.
+        """
+        valid = alleles != GT_PAD
+        called = (valid.sum(axis=2) == (alleles >= 0).sum(axis=2)) & \
+                valid.any(axis=2)
+        high = np.where(valid, alleles, -1).max(axis=2)
+        low = np.where(valid, alleles, np.iinfo(alleles.dtype).max).min(
+                axis=2)
+        het = called & (low != high)
+        hom_ref = called & (high == 0)
+        hom_alt = called & ~het & (low > 0)
+        for j, a in enumerate([called, het, hom_ref, hom_alt]):
+            self.__counts[j] += a.sum(axis=0)
+        self.__num_variants += len(rows)
+        if all(slot is None for slot in self.__stats_slots):
+            return
+        num_samples = alleles.shape[1]
+        max_allele = alleles.max(axis=(1, 2), initial=0).tolist()
+        ac = np.stack([(alleles == k).sum(axis=(1, 2)) 
+            for k in range(max(max_allele) + 1)], axis=1).tolist()
+        an = (alleles >= 0).sum(axis=(1, 2)).tolist()
+        num_called = called.sum(axis=1).tolist()
+        num_het = het.sum(axis=1).tolist()
+        ac_slot, an_slot, rate_slot, missing_slot, het_slot = (
+                self.__stats_slots)
+        for j, row in enumerate(rows):
+            if not present[j]:
+                continue
+            # The number of alleles is taken from ALT, if we have it.
+            n = max_allele[j] + 1
+            if self.__alt_slot is not None and row[self.__alt_slot]:
+                n = max(n, row[self.__alt_slot].count(b",") + 2)
+            values = [(ac[j] + [0] * n)[:n], an[j], num_called[j] / max(1, num_samples), 
+                    num_samples - num_called[j], 
+                    num_het[j] / num_called[j] if num_called[j] > 0 else None]
+            for slot, value in zip(self.__stats_slots, values):
+                if slot is not None:
+                    row[slot] = value
+
+    def get_counts(self):
+        """
+        Returns the tuple (num_variants, counts), where counts is a list 
+        of the lists of the per-sample counts in SAMPLE_STATS_COUNTS.
+        """
+        return self.__num_variants, self.__counts.tolist()
+
+    def merge(self, counts):
+        """
+        Adds the specified counts returned by get_counts for another part 
+        of the input to the counts of this GenotypeStats.
+        """
+        self.__num_variants += counts[0]
+        self.__counts += np.array(counts[1], dtype=np.int64).reshape(
+                self.__counts.shape)
+
+    def write(self, filename):
+        """
+        Writes the per-sample statistics to the specified file, as JSON.
+        """
+        write_sample_stats(filename, [s.decode() for s in self.__samples],
+                self.__num_variants, self.__counts.tolist())
+
+def sample_stats_file_name(filename):
+    """
+    Returns the name of the per-sample statistics sidecar file for the 
+    specified destination.
+    """
+    return filename + SAMPLE_STATS_SUFFIX
+
+def write_sample_stats(filename, samples, num_variants, counts):
+    """
+    Writes the per-sample statistics sidecar file for the specified list
+    of sample names, given the number of variants and the list of the 
+    lists of per-sample counts in SAMPLE_STATS_COUNTS.
+    """
+    l = []
+    for j, sample in enumerate(samples):
+        d = {"sample": sample}
+        for name, c in zip(SAMPLE_STATS_COUNTS, counts):
+            d[name] = int(c[j])
+        d["missing"] = num_variants - d["called"]
+        d["call_rate"] = d["called"] / max(1, num_variants)
+        d["het_rate"] = d["het"] / d["called"] if d["called"] > 0 else None
+        l.append(d)
+    with open(filename, "w") as f:
+        json.dump({"num_variants": num_variants, "samples": l}, f, indent=1)
+
+def read_sample_stats(filename):
+    """
+    Reads the specified per-sample statistics sidecar file and returns 
+    the tuple (samples, num_variants, counts), as passed to 
+    write_sample_stats.
+    """
+    with open(filename) as f:
+        d = json.load(f)
+    samples = [s["sample"] for s in d["samples"]]
+    counts = [[s[name] for s in d["samples"]] for name in SAMPLE_STATS_COUNTS]
+    return samples, d["num_variants"], counts
+
+
+def create_reader(args):
+    """
+    Returns a VCFReader for the source file in the specified command line
+    arguments, configured using the corresponding options.
+    """
+    reader = VCFReader(args.SOURCE, args.threads)
+    reader.set_buffer_size(get_stage_buffer_size(args))
+    reader.set_truncate_REF_ALT(args.truncate)
+    reader.set_genotype_layout(args.genotype_layout)
+    reader.set_gt_encoding(args.gt_encoding)
+    reader.set_dictionary_encoding(args.dictionary_encode)
+    reader.set_memory_map(not args.no_mmap)
+    reader.set_compute_stats(args.compute_stats)
+    if args.schema_cache is not None:
+        reader.set_schema_cache(args.schema_cache)
+    if args.region is not None:
+        reader.set_region(args.region)
+    if args.include_info is not None or args.exclude_info is not None:
+        reader.set_info_keys(split_keys(args.include_info), 
+                split_keys(args.exclude_info))
+    if args.format_keys is not None:
+        reader.set_format_keys(split_keys(args.format_keys))
+    samples = split_keys(args.samples)
+    if args.samples_file is not None:
+        with open(args.samples_file, "rb") as f:
+            samples = (samples or []) + [s.strip() for s in f if s.strip()]
+    if samples is not None:
+        reader.set_samples(samples)
+    return reader
+
+def get_schema(args, reader):
+    """
+    Returns the (schema, columns) tuple for the specified reader, loading
+    the schema from the file given in the command line arguments if there
+    is one, and generating it otherwise.
+    """
+    if args.schema is not None:
+        with open(args.schema) as f:
+            return reader.load_schema(f.read())
+    return reader.generate_schema()
+
+def split_keys(s):
+    """
+    Returns the list of bytes values in the specified comma separated 
+    string, or None if s is None.
+    """
+    if s is None:
+        return None
+    return [k.encode() for k in s.split(",") if k != ""]
+
+def get_stage_buffer_size(args):
+    """
+    Returns the memory budget in bytes for each of the buffered stages of 
+    the conversion pipeline. The cache size is divided equally among the 
+    BGZF read-ahead, the lines read ahead of the parser and the blocks 
+    waiting to be written in each worker process.
+    """
+    return max(1, parse_size(args.cache_size) // (3 * max(1, args.jobs)))
+
+def create_writer(args, dest, schema, metadata, stats=None, shards=None):
+    """
+    Returns an AvroFileWriter for the specified destination file, or for
+    the specified ShardSet if there is one, configured using the specified
+    command line arguments. With --columnar, the columns are written by a
+    ColumnarWriter either alongside the Avro file or instead of it.
+    """
+    if args.columnar == "only":
+        return ColumnarWriter(dest, schema, metadata, args.codec, 
+                stats=stats)
+    if shards is not None:
+        return AvroFileWriter(None, schema, metadata, args.codec,
+                parse_size(args.sync_interval), None,
+                get_stage_buffer_size(args), stats, shards)
+    writer = AvroFileWriter(open(dest, "wb"), schema, metadata, args.codec,
+            parse_size(args.sync_interval), index_file_name(dest),
+            get_stage_buffer_size(args), stats)
+    if args.columnar == "alongside":
+        columns = ColumnarWriter(columnar_directory_name(dest), schema, 
+                metadata, args.codec, stats=stats)
+        writer = TeeWriter([writer, columns])
+    return writer
+
+def create_genotype_stats(args, reader, columns):
+    """
+    Returns a GenotypeStats for the specified reader and columns if 
+    --compute-stats was given, and None otherwise.
+    """
+    if not args.compute_stats:
+        return None
+    return GenotypeStats(columns, reader.get_samples())
+
+def convert(args, reader, writer, columns, genotype_stats=None):
+    """
+    Writes the rows from the specified reader to the specified writer, 
+    in batches if requested in the command line arguments, and returns
+    the number of rows written. If genotype_stats is not None, it is 
+    updated with each row before it is written.
+    """
+    num_rows = 0
+    stats = reader.get_stats()
+    writer.set_input(reader)
+    if args.batch_size > 0:
+        for batch in reader.batches(columns, args.batch_size):
+            if genotype_stats is not None:
+                genotype_stats.update_batch(batch)
+            writer.append_batch(batch)
+            num_rows += len(batch)
+            if stats is not None:
+                stats.rows = num_rows
+    else:
+        for r in reader.rows(columns):
+            if genotype_stats is not None:
+                genotype_stats.update(r)
+            writer.append(r)
+            num_rows += 1
+            if stats is not None:
+                stats.rows = num_rows
+    return num_rows
+
+def _convert_range(work):
+    """
+    Worker process entry point for parallel conversion. Converts the 
+    lines in the specified byte range or chromosome of the source VCF into
+    a temporary Avro file and returns the tuple (num_rows, report, shards,
+    counts), where report is the ConversionStats report if requested, and 
+    None otherwise. If shard_prefix is not None, the shards are written 
+    directly into the destination directory with this prefix and shards 
+    is the list of their manifest entries; otherwise it is None. Counts 
+    are the GenotypeStats counts with --compute-stats, and None otherwise.
+    """
+    args, part, dest, shard_prefix = work
+    stats = None
+    if args.stats is not None:
+        stats = ConversionStats()
+    reader = create_reader(args)
+    reader.set_stats(stats)
+    schema, columns = get_schema(args, reader)
+    if isinstance(part, tuple):
+        reader.set_range(*part)
+    else:
+        reader.set_contig(part)
+    shards = None
+    if shard_prefix is not None:
+        shards = ShardSet(dest, args.shard_by, shard_prefix)
+    writer = create_writer(args, dest, schema, reader.get_metadata(), stats,
+            shards)
+    genotype_stats = create_genotype_stats(args, reader, columns)
+    num_rows = convert(args, reader, writer, columns, genotype_stats)
+    writer.close()
+    reader.close()
+    report = None
+    if stats is not None:
+        report = stats.report()
+    if shards is not None:
+        shards = shards.get_shards()
+    counts = None
+    if genotype_stats is not None:
+        counts = genotype_stats.get_counts()
+    return num_rows, report, shards, counts
+
 
 class ProgramRunner(object):
     """
@@ -520,19 +5066,30 @@ class ProgramRunner(object):
     """
     def __init__(self, args):
         self.__destination = args.DEST 
-        self.__db_cache_size = args.cache_size
         self.__force = args.force
         self.__generate_schema = args.generate_schema
         self.__progress = not args.quiet
         self.__quiet = args.quiet
         self.__schema = args.schema
         self.__truncate = args.truncate
+        self.__jobs = args.jobs
+        self.__args = args
         self.__tmp_dirs = []
         self.__tmp_files = []
         self.__table = None
         self.__column_map = None
-        self.__reader = VCFReader(args.SOURCE)
+        self.__reader = None
         self.__writer = None
+        self.__shards = None
+        self.__genotype_stats = None
+        self.__stats = None
+        if args.stats is not None:
+            self.__stats = ConversionStats()
+        try:
+            self.__reader = create_reader(args)
+        except ValueError as e:
+            self.error(str(e))
+        self.__reader.set_stats(self.__stats)
         # if reading from STDIN, set progress monitor to False regardless
         if args.SOURCE == '-': 
             self.__progress = False
@@ -543,23 +5100,70 @@ class ProgramRunner(object):
 
     def generate_schema(self):
         """
-        Reads the header of the input VCF and generates a schema file.
+        Reads the header of the input VCF and generates a schema, or reads 
+        the schema file specified on the command line.
         """
-        self.__schema, columns = self.__reader.generate_schema()
+        try:
+            self.__schema, columns = get_schema(self.__args, self.__reader)
+        except (ValueError, KeyError) as e:
+            self.error("invalid schema: {0}".format(e))
         self.__column_map = columns
-        #with open("schema.json", "w") as f:
-        #    f.write(self.__schema)
-        #with open("schema.json", "r") as f:
-        #    self.__schema = f.read()
+        try:
+            self.__genotype_stats = create_genotype_stats(self.__args, 
+                    self.__reader, columns)
+        except ValueError as e:
+            self.error(str(e))
 
     def create_table(self):
         """
         Creates the table and reads the column information for the VCF reader.
+        If we are sharding, the destination directory is created and the 
+        shards are written into it.
+        """
+        if self.__args.shard_by is not None:
+            os.mkdir(self.__destination)
+            self.__shards = ShardSet(self.__destination, self.__args.shard_by)
+        self.__writer = create_writer(self.__args, self.__destination, 
+                self.__schema, self.__reader.get_metadata(), self.__stats,
+                self.__shards)
+
+    def open_table(self, resume):
         """
-        schema = avro.schema.parse(self.__schema)
-        self.__output_file = open(self.__destination, "w")
-        self.__writer = avro.datafile.DataFileWriter(self.__output_file, 
-                avro.io.DatumWriter(), schema) #, codec="deflate")
+        Opens the existing destination file for appending, after discarding
+        any partially written blocks left by an interrupted conversion. If
+        resume is True, the reader is positioned at the checkpoint recorded
+        with the last complete block.
+        """
+        dest = self.__destination
+        try:
+            num_blocks, checkpoint = recover_avro_file(dest)
+        except (IOError, OSError, ValueError) as e:
+            self.error("cannot append to '{0}': {1}".format(dest, e))
+        f = open(dest, "r+b")
+        meta, sync = read_avro_header(f)
+        schema = meta[AVRO_SCHEMA_KEY].decode()
+        if json.loads(schema) != json.loads(self.__schema):
+            self.error("the schema of '{0}' does not match '{1}'".format(
+                dest, self.__args.SOURCE))
+        for key, value in self.__reader.get_metadata().items():
+            # The meta-information lines of the first file are kept.
+            if (key not in (DICTIONARIES_KEY, HEADER_KEY) and 
+                    meta.get(key) != value):
+                self.error("the {0} metadata of '{1}' does not match".format(
+                    key, dest))
+        if resume and num_blocks > 0:
+            if checkpoint is None:
+                self.error("'{0}' has no checkpoint to resume from".format(
+                    dest))
+            try:
+                self.__reader.resume(checkpoint)
+            except ValueError as e:
+                self.error(str(e))
+        f.seek(0, os.SEEK_END)
+        codec = meta.get(AVRO_CODEC_KEY, b"null").decode()
+        self.__writer = AvroFileWriter(f, schema, meta, codec, 
+                parse_size(self.__args.sync_interval), index_file_name(dest),
+                get_stage_buffer_size(self.__args), self.__stats, sync=sync)
 
     def write_table(self):
         """
@@ -567,34 +5171,214 @@ class ProgramRunner(object):
         a table ready for writing.
         """
         self.__reader.set_progress(self.__progress)
-        self.__reader.set_truncate_REF_ALT(self.__truncate)
-        for r in self.__reader.rows(self.__column_map):
-            self.__writer.append(r) 
+        convert(self.__args, self.__reader, self.__writer, self.__column_map,
+                self.__genotype_stats)
         self.__reader.close()
         self.__reader = None
         self.__writer.close()
         self.__writer = None
+        if self.__shards is not None:
+            write_manifest(self.__destination, self.__args.shard_by, 
+                    self.__shards.get_shards())
+
+    def write_table_parallel(self, parts):
+        """
+        Converts the specified parts of the input in parallel using a 
+        pool of worker processes, each of which writes its own temporary 
+        Avro file. The data blocks of these files are then copied in input
+        order into the destination file. If we are sharding, the workers 
+        write their shards directly into the destination directory instead,
+        and we only write the manifest.
+        """
+        sharded = self.__args.shard_by is not None
+        if sharded:
+            os.mkdir(self.__destination)
+        else:
+            tmp_dir = tempfile.mkdtemp(prefix="vcf2avro_", 
+                    dir=os.path.dirname(os.path.abspath(self.__destination)))
+            self.__tmp_dirs.append(tmp_dir)
+        work = []
+        sizes = []
+        for j, part in enumerate(parts):
+            if sharded:
+                work.append((self.__args, part, self.__destination, 
+                    "shard_{0:04d}".format(j)))
+            else:
+                dest = os.path.join(tmp_dir, "part_{0}.avro".format(j))
+                work.append((self.__args, part, dest, None))
+            sizes.append(part[1] - part[0] if isinstance(part, tuple) else 1)
+        units = "bytes" if isinstance(parts[0], tuple) else "regions"
+        self.__reader.close()
+        self.__reader = None
+        monitor = None
+        if self.__progress:
+            monitor = ProgressMonitor(sum(sizes), units)
+            monitor.update(0)
+        pool = multiprocessing.Pool(self.__jobs)
+        shards = []
+        try:
+            processed = 0
+            for j, result in enumerate(pool.imap(_convert_range, work)):
+                num_rows, report, part_shards, counts = result
+                if self.__stats is not None:
+                    self.__stats.merge(report)
+                if counts is not None:
+                    self.__genotype_stats.merge(counts)
+                if part_shards is not None:
+                    shards.extend(part_shards)
+                processed += sizes[j]
+                if monitor is not None:
+                    monitor.update(processed)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        if monitor is not None:
+            monitor.finish()
+        if sharded:
+            write_manifest(self.__destination, self.__args.shard_by, shards)
+            return
+        with open(self.__destination, "wb") as out:
+            concatenate_avro_files([w[2] for w in work], out,
+                    index_file_name(self.__destination))
 
     def run(self):
         """
         Top level entry point.
         """ 
-        if self.__schema is None:
-            self.generate_schema()
+        try:
+            get_compressor(self.__args.codec)
+        except ImportError as e:
+            self.error("codec '{0}' is not available: {1}".format(
+                self.__args.codec, e))
+        if self.__args.batch_size > 0:
+            if np is None:
+                self.error("--batch-size requires NumPy")
+            if self.__args.genotype_layout != SAMPLE_LAYOUT:
+                self.error("--batch-size requires --genotype-layout=sample")
+        if (self.__args.gt_encoding == PACKED_GT_ENCODING and 
+                self.__args.genotype_layout != SAMPLE_LAYOUT):
+            self.error("--gt-encoding=packed requires --genotype-layout=sample")
+        if self.__args.shard_by is not None:
+            try:
+                parse_shard_by(self.__args.shard_by)
+            except ValueError as e:
+                self.error(str(e))
+        append = self.__args.resume or self.__args.append
+        if append:
+            if self.__force or self.__generate_schema:
+                self.error("--resume and --append cannot be used with "
+                        "--force or --generate-schema")
+            if self.__args.shard_by is not None:
+                self.error("--resume and --append cannot be used with "
+                        "--shard-by")
+            if not os.path.isfile(self.__destination):
+                self.error("'{0}' does not exist".format(self.__destination))
+        if self.__args.compute_stats:
+            if np is None:
+                self.error("--compute-stats requires NumPy")
+            if append:
+                self.error("--compute-stats cannot be used with --resume "
+                        "or --append")
+        if self.__args.columnar is not None:
+            if append or self.__args.shard_by is not None:
+                self.error("--columnar cannot be used with --resume, "
+                        "--append or --shard-by")
+            if np is None:
+                self.error("--columnar requires NumPy")
+        self.generate_schema()
+        if self.__args.columnar is not None and not self.__generate_schema:
+            try:
+                for field in json.loads(self.__schema)["fields"]:
+                    get_column_layout(field["type"])
+            except ValueError as e:
+                self.error(str(e))
         
-        if os.path.exists(self.__destination):
+        if append:
+            # The destination is recovered and appended to in open_table.
+            pass
+        elif os.path.isdir(self.__destination):
+            if not (os.path.exists(manifest_file_name(self.__destination)) or
+                    os.path.exists(os.path.join(self.__destination, 
+                        COLUMNAR_INDEX_FILE))):
+                self.error("'{0}' is a directory".format(self.__destination))
+            if not self.__force:
+                s = "'{0}' exists; use -f to overwrite".format(self.__destination)
+                self.error(s)
+            shutil.rmtree(self.__destination)
+        elif os.path.exists(self.__destination):
             if self.__force:
                 os.unlink(self.__destination)
+                index_file = index_file_name(self.__destination)
+                if os.path.exists(index_file):
+                    os.unlink(index_file)
             else:
                 s = "'{0}' exists; use -f to overwrite".format(self.__destination)
                 self.error(s)
+        if self.__args.columnar == "alongside" and not self.__generate_schema:
+            columns_dir = columnar_directory_name(self.__destination)
+            if os.path.exists(columns_dir):
+                if not self.__force:
+                    self.error("'{0}' exists; use -f to overwrite".format(
+                        columns_dir))
+                shutil.rmtree(columns_dir)
                 
         if self.__generate_schema:
-            # copy the schema and we're done.
-            shutil.copyfile(self.__schema, self.__destination) 
+            # write the schema and we're done.
+            with open(self.__destination, "w") as f:
+                f.write(self.__schema)
         else:
-            self.create_table()
-            self.write_table()
+            parts = None
+            if self.__jobs > 1 and not append and self.__args.columnar is None:
+                parts = self.__reader.partition(self.__jobs)
+            stats_file = self.start_stats()
+            if parts is not None and len(parts) > 1:
+                self.write_table_parallel(parts)
+            else:
+                if append:
+                    self.open_table(self.__args.resume)
+                else:
+                    self.create_table()
+                self.write_table()
+            if self.__genotype_stats is not None:
+                self.__genotype_stats.write(sample_stats_file_name(
+                    self.__destination))
+            self.finish_stats(stats_file)
+
+    def start_stats(self):
+        """
+        Opens the file that statistics are written to, if requested, and 
+        starts writing periodic reports to it. Returns the file.
+        """
+        f = None
+        if self.__stats is not None:
+            f = sys.stderr
+            if self.__args.stats != "-":
+                f = open(self.__args.stats, "w")
+            if self.__args.stats_interval > 0:
+                self.__stats.start_reporting(f, self.__args.stats_interval)
+        return f
+
+    def finish_stats(self, f):
+        """
+        Writes the final statistics report to the specified file.
+        """
+        if self.__stats is not None:
+            self.__stats.stop_reporting()
+            if self.__args.columnar == "only":
+                self.__stats.output_bytes = sum(os.path.getsize(
+                    os.path.join(self.__destination, name))
+                    for name in os.listdir(self.__destination))
+            elif os.path.isdir(self.__destination):
+                self.__stats.output_bytes = sum(os.path.getsize(
+                    os.path.join(self.__destination, shard["file"]))
+                    for shard in read_manifest(self.__destination)["shards"])
+            else:
+                self.__stats.output_bytes = os.path.getsize(
+                        self.__destination)
+            self.__stats.write_report(f, True)
+            if f is not sys.stderr:
+                f.close()
 
     def error(self, s):
         """
@@ -637,8 +5421,126 @@ def main(args=None):
             characters long. REF and ALT values are truncated to 253 characters
             and suffixed with a '+' to indicate that truncation has 
             occured""")   
-    parser.add_argument("--cache-size", "-c", default="64M",
-        help="cache size in bytes; suffixes K, M and G also supported.")   
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+        help="""Number of worker processes to use. Uncompressed input 
+            is split into line-aligned byte ranges which are converted 
+            in parallel and stitched into DEST in input order. Indexed 
+            BGZF input is split by chromosome.""")   
+    parser.add_argument("--threads", "-T", type=int, default=BGZF_THREADS,
+        help="Number of threads used to decompress BGZF input")   
+    parser.add_argument("--region", "-r", default=None,
+        help="""Only convert records overlapping the region chrom:start-end.
+            Uses the tabix or CSI index if one exists.""")   
+    parser.add_argument("--genotype-layout", "-l", default=COLUMN_LAYOUT,
+        choices=GENOTYPE_LAYOUTS,
+        help="""Layout of the genotype columns. The column layout stores 
+            each sample and FORMAT key pair in its own field; the sample 
+            layout stores each FORMAT key as an array with one entry per
+            sample, listed in the vcf.samples file metadata.""")   
+    parser.add_argument("--gt-encoding", "-G", default=STRING_GT_ENCODING,
+        choices=GT_ENCODINGS,
+        help="""Encoding of the GT column. The packed encoding stores the
+            ploidy, phase and allele indexes of all samples in a row in a 
+            single compact bytes value, and requires the sample genotype 
+            layout.""")   
+    parser.add_argument("--batch-size", "-B", type=int, default=0,
+        help="""Parse and encode BATCH_SIZE rows at a time, converting the
+            sample columns of each FORMAT key into NumPy arrays in bulk. 
+            Requires NumPy and the sample genotype layout.""")   
+    parser.add_argument("--no-mmap", action="store_true", default=False,
+        help="""Read plain uncompressed input as a stream rather than 
+            memory mapping it with --batch-size. When the file is memory
+            mapped, the sample columns are not split into a bytes object 
+            per value; only the tokens of the selected samples and FORMAT
+            keys are copied out.""")   
+    parser.add_argument("--dictionary-encode", "-D", action="store_true",
+        default=False,
+        help="""Dictionary encode the CHROM, REF, ALT and FILTER columns,
+            storing int codes in place of repeated values. The initial 
+            dictionaries are taken from the ##contig and ##FILTER header 
+            lines and grow as new values are seen in each block.""")   
+    parser.add_argument("--codec", "-C", default=DEFAULT_CODEC, 
+        choices=AVRO_CODECS,
+        help="""Compression codec for the Avro data blocks. Blocks are 
+            compressed and written in a background thread. The snappy and
+            zstandard codecs require the python-snappy and zstandard 
+            packages.""")   
+    parser.add_argument("--block-size", "--sync-interval", "-b", 
+        dest="sync_interval", default=str(DEFAULT_SYNC_INTERVAL),
+        help="""Approximate size of the uncompressed data blocks in bytes; 
+            suffixes K, M and G also supported.""")   
+    g = parser.add_mutually_exclusive_group()
+    g.add_argument("--resume", action="store_true", default=False,
+        help="""Resume an interrupted conversion of SOURCE into DEST. Each 
+            block written is recorded in the block index along with a 
+            checkpoint of the input offset reached; DEST is truncated 
+            after the last complete block and the conversion continues 
+            from its checkpoint. The same SOURCE and options must be 
+            given, and --jobs is ignored.""")   
+    g.add_argument("--append", action="store_true", default=False,
+        help="""Append the records of SOURCE to the existing DEST, which 
+            must have been written with the same schema; for example, to
+            add newly arrived variants. --jobs is ignored.""")   
+    parser.add_argument("--shard-by", default=None,
+        help="""Write DEST as a directory of Avro files, each with its own
+            block index, and a manifest.json listing the file, record 
+            count and regions of each shard. A new shard is started when 
+            CHROM changes (chrom), POS enters a new bin of N bases on the
+            same CHROM (bp:N), or every N records (records:N). With --jobs,
+            each worker writes its shards directly, so records:N counts 
+            from the start of each worker's part of the input.""")   
+    parser.add_argument("--compute-stats", action="store_true", 
+        default=False,
+        help="""Compute summary statistics from the GT values of each 
+            variant while converting: the per-variant allele counts 
+            STATS_AC and STATS_AN, call rate STATS_CALL_RATE, number of 
+            samples not called STATS_MISSING and heterozygosity 
+            STATS_HET_RATE are added as columns, and the number of 
+            variants at which each sample is called, heterozygous and 
+            homozygous is written to DEST{0}. Requires NumPy.""".format(
+                SAMPLE_STATS_SUFFIX))   
+    parser.add_argument("--columnar", default=None, choices=COLUMNAR_MODES,
+        help="""Also write each column as its own file of compressed chunks
+            of {0} rows, in the directory DEST{1} (alongside), or write 
+            only the columns, into the directory DEST (only). These can be
+            read as NumPy arrays using ColumnarReader, which memory maps 
+            the files. Requires NumPy; --jobs is ignored.""".format(
+                COLUMNAR_CHUNK_ROWS, COLUMNAR_SUFFIX))   
+    g = parser.add_mutually_exclusive_group()
+    g.add_argument("--include-info", default=None,
+        help="Comma separated list of the INFO keys to convert")   
+    g.add_argument("--exclude-info", default=None,
+        help="Comma separated list of INFO keys not to convert")   
+    parser.add_argument("--format-keys", default=None,
+        help="Comma separated list of the FORMAT keys to convert")   
+    parser.add_argument("--samples", default=None,
+        help="""Comma separated list of the samples to convert. Samples 
+            are stored in the order they appear in the VCF, and the 
+            columns of other samples are not parsed.""")   
+    parser.add_argument("--samples-file", default=None,
+        help="""File listing the samples to convert, one per line. May be 
+            combined with --samples.""")   
+    parser.add_argument("--schema-cache", default=None,
+        help="""Directory in which generated schemas are cached, keyed by 
+            a hash of the VCF header and the options affecting the schema,
+            so that files with identical headers can reuse them.""")   
+    parser.add_argument("--stats", nargs="?", const="-", default=None,
+        help="""Report the wall clock and CPU time spent reading, 
+            decompressing, tokenizing, converting, encoding, compressing 
+            and writing, along with rows/sec, bytes in and out, and 
+            peak RSS. Reports are written as lines of JSON to the 
+            specified file, or to stderr if no file is given.""")   
+    parser.add_argument("--stats-interval", type=float, default=10,
+        help="""Seconds between the periodic --stats reports; 0 to only 
+            report at exit.""")   
+    parser.add_argument("--cache-size", "-c", default=DEFAULT_CACHE_SIZE,
+        help="""Memory budget for the conversion pipeline in bytes; 
+            suffixes K, M and G also supported. Lines are read (and BGZF 
+            blocks decompressed) in a background thread ahead of the 
+            parser, and encoded blocks are compressed and written in 
+            another; the data buffered between these stages is limited to 
+            this size, divided among the worker processes. This does not
+            include the rows of the batch being parsed.""")   
     g = parser.add_mutually_exclusive_group()
     g.add_argument("--generate-schema", "-g", action="store_true", 
         default=False,
@@ -34,9 +34,6 @@ fatal_error(char *msg, ...)
     exit(EXIT_FAILURE);
 }
 
-/* For convenience until we change the avro type to string */
-#define MAX_STRING 8192
-
 /* 
  * Prints out the values in the specified row.
  */
@@ -47,7 +44,6 @@ print_row_legacy(avro_datum_t row, const char *col)
     int64_t i64;
     float  f;
     char *str;
-    char dest[MAX_STRING];
     avro_datum_t union_dt, value_dt;
 
     if (avro_record_get(row, col, &union_dt) != 0) {
@@ -70,12 +66,8 @@ print_row_legacy(avro_datum_t row, const char *col)
         if (avro_bytes_get(value_dt, &str, &i64) != 0) {
             fatal_error("Error converting to bytes");
         }
-        if (i64 >= MAX_STRING) {
-            fatal_error("max string size exceeded");
-        }
-        memcpy(dest, str, i64);
-        dest[i64] = '\0';
-        printf("%s", dest);
+        /* bytes values are not NUL terminated, and may be of any length */
+        fwrite(str, 1, (size_t) i64, stdout);
     } else if (is_avro_float(value_dt)) {
         if (avro_float_get(value_dt, &f) != 0) {
             fatal_error("Error converting to float");